@@ -1,3 +1,4 @@
+import asyncio
 import importlib
 import logging
 import time
@@ -19,7 +20,12 @@ from fastapi import (
     Response,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from jose import JWTError
@@ -63,6 +69,7 @@ from activetigger.datamodels import (
 )
 from activetigger.functions import get_gpu_memory_info
 from activetigger.generation.generations import Generations
+from activetigger.metrics import Metrics
 from activetigger.orchestrator import Orchestrator
 from activetigger.project import Project
 
@@ -180,7 +187,28 @@ logger_simplemodel = logging.getLogger("simplemodel")
 
 # starting the server
 orchestrator = Orchestrator()
-timer = time.time()
+metrics = Metrics()
+# routes working on a project run out of the event loop,
+# the routes changing a project one at a time
+blocking = orchestrator.requests_executor.blocking
+exclusive = orchestrator.requests_executor.exclusive
+
+# interval between two updates of the server state (seconds)
+UPDATE_STEP = 1
+
+
+async def update_processes(step: float = UPDATE_STEP) -> None:
+    """
+    Background task to update server state
+    (i.e. joining parallel processes)
+    Integration of the results is done in a thread, off the event loop
+    """
+    while True:
+        await asyncio.sleep(step)
+        try:
+            await asyncio.to_thread(orchestrator.update)
+        except Exception as e:
+            logger.error("Error updating processes: %s", e)
 
 
 @asynccontextmanager
@@ -189,9 +217,20 @@ async def lifespan(app: FastAPI):
     Frame the execution of the api
     """
     print("Active Tigger starting")
+    orchestrator.logs_writer.start()
+    updater = asyncio.create_task(update_processes())
+    preloading = asyncio.create_task(asyncio.to_thread(orchestrator.preload_projects))
     yield
     print("Active Tigger closing")
+    for task in (updater, preloading):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await orchestrator.logs_writer.stop()
     orchestrator.queue.close()
+    orchestrator.requests_executor.close()
 
 
 # starting the app
@@ -201,29 +240,28 @@ app.mount("/static", StaticFiles(directory=orchestrator.path / "static"), name="
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")  # defining the authentification object
 
 
-async def check_processes(timer: float, step: int = 1) -> None:
-    """
-    Function to update server state
-    (i.e. joining parallel processes)
-    Limited to once per time interval
-    """
-    # max one update alllowed per step
-    if (time.time() - timer) < step:
-        return None
-
-    # update processes for each active projects
-    orchestrator.update()
-
-
 @app.middleware("http")
 async def middleware(request: Request, call_next: Callable[[Request], Awaitable[Response]]):
     """
-    Middleware to take care of completed processes
+    Middleware to record the requests metrics
     Executed at each action on the server
     """
-    await check_processes(timer)
-    response = await call_next(request)
-    return response
+    start = time.perf_counter()
+    status = 500
+    metrics.start()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # use the route template to group the requests
+        route = request.scope.get("route")
+        metrics.end(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status,
+            time.perf_counter() - start,
+        )
 
 
 # allow multiple servers (avoir CORS error)
@@ -252,36 +290,11 @@ async def get_project(project_slug: str) -> ProjectModel:
     if not orchestrator.exists(project_slug):
         raise HTTPException(status_code=404, detail="Project not found")
 
-    # if the project is already loaded
     if project_slug in orchestrator.projects:
-        return orchestrator.projects[project_slug]
-
-    # Manage a FIFO queue when there is too many projects
-    try:
-        if len(orchestrator.projects) >= orchestrator.max_projects:
-            old_element = sorted(
-                [[p, orchestrator.projects[p].starting_time] for p in orchestrator.projects],
-                key=lambda x: x[1],
-            )[0]
-            if (
-                old_element[1] < time.time() - 3600
-            ):  # check if the project has a least one hour old to avoid destroying current projects
-                del orchestrator.projects[old_element[0]]
-                print(f"Delete project {old_element[0]} to gain memory")
-            else:
-                print("Too many projects in the current memory")
-                raise HTTPException(
-                    status_code=500,
-                    detail="There is too many projects currently loaded in this server. Please wait",
-                )
-    except Exception as e:
-        print("PROBLEM IN THE FIFO QUEUE", e)
-
-    # load the project
-    orchestrator.start_project(project_slug)
+        return orchestrator.get_project(project_slug)
 
-    # return loaded project
-    return orchestrator.projects[project_slug]
+    # load the project out of the event loop, not to block the other users
+    return await asyncio.to_thread(orchestrator.get_project, project_slug)
 
 
 async def verified_user(
@@ -290,6 +303,11 @@ async def verified_user(
     """
     Dependency to test if the user is authentified with its token
     """
+    # token already verified
+    user = orchestrator.users.get_token_user(token)
+    if user is not None:
+        return user
+
     # decode token
     try:
         payload = orchestrator.decode_access_token(token)
@@ -304,9 +322,10 @@ async def verified_user(
     # get user caracteristics
     try:
         user = orchestrator.users.get_user(name=username)
-        return user
     except Exception as e:
         raise HTTPException(status_code=404) from e
+    orchestrator.users.cache_token_user(token, user, payload["exp"])
+    return user
 
 
 async def check_auth_exists(
@@ -412,10 +431,12 @@ async def existing_users(
 
 
 @app.get("/users/recent")
-async def recent_users() -> list[str]:
+@blocking
+def recent_users() -> list[str]:
     """
     Get recently connected users
     """
+    orchestrator.logs_writer.flush()
     users = orchestrator.db_manager.projects_service.get_current_users(300)
     return users
 
@@ -515,7 +536,8 @@ async def get_auth(username: str) -> list:
 
 
 @app.get("/logs", dependencies=[Depends(verified_user)])
-async def get_logs(
+@blocking
+def get_logs(
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project_slug: str = "all",
     limit: int = 100,
@@ -542,7 +564,8 @@ async def get_logs(
     "/projects/{project_slug}",
     dependencies=[Depends(verified_user), Depends(check_auth_exists)],
 )
-async def get_project_state(
+@blocking
+def get_project_state(
     project: Annotated[Project, Depends(get_project)],
 ) -> ProjectStateModel:
     """
@@ -555,7 +578,8 @@ async def get_project_state(
 
 
 @app.get("/projects/{project_slug}/statistics", dependencies=[Depends(verified_user)])
-async def get_project_statistics(
+@blocking
+def get_project_statistics(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str | None = None,
@@ -634,6 +658,16 @@ async def get_queue() -> dict:
     return r
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    """
+    Metrics of the server in the Prometheus text format
+    - requests latency, counts and errors by route
+    - queue depth and workers utilization
+    """
+    return metrics.export(orchestrator.queue.state(), orchestrator.queue.nb_workers)
+
+
 @app.get("/queue/num")
 async def get_nb_queue() -> int:
     """
@@ -673,7 +707,8 @@ async def get_project_auth(project_slug: str) -> ProjectAuthsModel:
 
 
 @app.post("/projects/testset", dependencies=[Depends(verified_user)])
-async def add_testdata(
+@exclusive
+def add_testdata(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     testset: TestSetDataModel,
@@ -694,7 +729,8 @@ async def add_testdata(
 
 
 @app.post("/projects/new", dependencies=[Depends(verified_user)])
-async def new_project(
+@blocking
+def new_project(
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project: ProjectDataModel,
 ) -> str:
@@ -736,7 +772,8 @@ async def delete_project(
 
 
 @app.post("/elements/next", dependencies=[Depends(verified_user)])
-async def get_next(
+@blocking
+def get_next(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     next: NextInModel,
@@ -761,7 +798,8 @@ async def get_next(
 
 
 @app.get("/elements/projection", dependencies=[Depends(verified_user)])
-async def get_projection(
+@blocking
+def get_projection(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str,
@@ -795,7 +833,8 @@ async def get_projection(
 
 
 @app.post("/elements/projection/compute", dependencies=[Depends(verified_user)])
-async def compute_projection(
+@exclusive
+def compute_projection(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     projection: ProjectionInStrictModel,
@@ -809,6 +848,12 @@ async def compute_projection(
     if len(projection.features) == 0:
         raise HTTPException(status_code=400, detail="No feature available")
     features = project.features.get(projection.features)
+    # rows added since the features were computed are left out (see /features/update)
+    for name in projection.features:
+        if name in project.features.map:
+            features = features.drop(index=project.features.get_missing(name), errors="ignore")
+    if len(features) == 0:
+        raise HTTPException(status_code=400, detail="Features not computed, update them")
 
     # get func and validate parameters for projection
     try:
@@ -822,6 +867,8 @@ async def compute_projection(
         project.name,
         r["func"],
         {"features": features, "params": r["params"]},
+        user=current_user.username,
+        resources=project.projections.estimate_memory_use(features),
     )
     if unique_id == "error":
         raise HTTPException(status_code=500, detail="Error in adding in the queue")
@@ -845,7 +892,8 @@ async def compute_projection(
 
 
 @app.get("/elements/table", dependencies=[Depends(verified_user)])
-async def get_list_elements(
+@blocking
+def get_list_elements(
     project: Annotated[Project, Depends(get_project)],
     scheme: str,
     min: int = 0,
@@ -872,7 +920,8 @@ async def get_list_elements(
 
 
 @app.post("/annotation/table", dependencies=[Depends(verified_user)])
-async def post_list_elements(
+@exclusive
+def post_list_elements(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     table: TableAnnotationsModel,
@@ -913,7 +962,8 @@ async def post_list_elements(
 
 
 @app.get("/elements/reconciliate", dependencies=[Depends(verified_user)])
-async def get_reconciliation_table(
+@blocking
+def get_reconciliation_table(
     project: Annotated[Project, Depends(get_project)], scheme: str
 ) -> ReconciliationModel:
     """
@@ -929,7 +979,8 @@ async def get_reconciliation_table(
 
 
 @app.post("/elements/reconciliate", dependencies=[Depends(verified_user)])
-async def post_reconciliation(
+@exclusive
+def post_reconciliation(
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project: Annotated[Project, Depends(get_project)],
     users: list = Query(),
@@ -1000,7 +1051,8 @@ async def delete_project_generation_models(project_slug: str, model_id: int) ->
 
 
 @app.post("/elements/generate/start", dependencies=[Depends(verified_user)])
-async def postgenerate(
+@exclusive
+def postgenerate(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     request: GenerationRequest,
@@ -1028,7 +1080,9 @@ async def postgenerate(
         "model": model,
     }
 
-    unique_id = orchestrator.queue.add("generation", Generations.generate, args)
+    unique_id = orchestrator.queue.add(
+        "generation", project.name, Generations.generate, args, user=current_user.username
+    )
 
 
     if unique_id == "error":
@@ -1058,7 +1112,8 @@ async def postgenerate(
 
 
 @app.post("/elements/generate/stop", dependencies=[Depends(verified_user)])
-async def stop_generation(
+@exclusive
+def stop_generation(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
 ) -> None:
@@ -1079,7 +1134,8 @@ async def stop_generation(
 
 
 @app.get("/elements/generate/elements", dependencies=[Depends(verified_user)])
-async def getgenerate(
+@blocking
+def getgenerate(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     n_elements: int,
@@ -1100,7 +1156,8 @@ async def getgenerate(
 
 
 @app.get("/elements/{element_id}", dependencies=[Depends(verified_user)])
-async def get_element(
+@blocking
+def get_element(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     element_id: str,
@@ -1117,7 +1174,8 @@ async def get_element(
 
 
 @app.post("/annotation/{action}", dependencies=[Depends(verified_user)])
-async def post_annotation(
+@exclusive
+def post_annotation(
     action: ActionModel,
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project: Annotated[Project, Depends(get_project)],
@@ -1179,7 +1237,8 @@ async def post_annotation(
 
 
 @app.post("/schemes/label/rename", dependencies=[Depends(verified_user)])
-async def rename_label(
+@exclusive
+def rename_label(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str,
@@ -1223,7 +1282,8 @@ async def rename_label(
 
 
 @app.post("/schemes/label/{action}", dependencies=[Depends(verified_user)])
-async def add_label(
+@exclusive
+def add_label(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     action: ActionModel,
@@ -1259,7 +1319,8 @@ async def add_label(
 
 
 @app.post("/schemes/codebook", dependencies=[Depends(verified_user)])
-async def post_codebook(
+@exclusive
+def post_codebook(
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project: Annotated[Project, Depends(get_project)],
     codebook: CodebookModel,
@@ -1281,7 +1342,8 @@ async def post_codebook(
 
 
 @app.get("/schemes/codebook", dependencies=[Depends(verified_user)])
-async def get_codebook(
+@blocking
+def get_codebook(
     project: Annotated[Project, Depends(get_project)],
     scheme: str,
 ) -> CodebookModel:
@@ -1299,7 +1361,8 @@ async def get_codebook(
 
 
 @app.post("/schemes/{action}", dependencies=[Depends(verified_user)])
-async def post_schemes(
+@exclusive
+def post_schemes(
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     project: Annotated[Project, Depends(get_project)],
     action: ActionModel,
@@ -1347,7 +1410,8 @@ async def post_schemes(
 
 
 @app.get("/features", dependencies=[Depends(verified_user)])
-async def get_features(project: Annotated[Project, Depends(get_project)]) -> list[str]:
+@blocking
+def get_features(project: Annotated[Project, Depends(get_project)]) -> list[str]:
     """
     Available features for the project
     """
@@ -1355,7 +1419,8 @@ async def get_features(project: Annotated[Project, Depends(get_project)]) -> lis
 
 
 @app.post("/features/add", dependencies=[Depends(verified_user)])
-async def post_embeddings(
+@exclusive
+def post_embeddings(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     feature: FeatureModel,
@@ -1387,8 +1452,27 @@ async def post_embeddings(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/features/update", dependencies=[Depends(verified_user)])
+@exclusive
+def update_features(
+    project: Annotated[Project, Depends(get_project)],
+    current_user: Annotated[UserInDBModel, Depends(verified_user)],
+) -> dict[str, Any]:
+    """
+    Compute the features for the rows added to the project since
+    """
+    test_rights("modify project", current_user.username, project.name)
+    try:
+        r = project.update_features(current_user.username)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    orchestrator.log_action(current_user.username, "INFO update features", project.name)
+    return r
+
+
 @app.post("/features/delete", dependencies=[Depends(verified_user)])
-async def delete_feature(
+@exclusive
+def delete_feature(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     name: str = Query(),
@@ -1405,7 +1489,8 @@ async def delete_feature(
 
 
 @app.get("/features/available", dependencies=[Depends(verified_user)])
-async def get_feature_info(
+@blocking
+def get_feature_info(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
 ) -> dict[str, Any]:
@@ -1423,7 +1508,8 @@ async def get_feature_info(
 
 
 @app.post("/models/simplemodel", dependencies=[Depends(verified_user)])
-async def post_simplemodel(
+@exclusive
+def post_simplemodel(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     simplemodel: SimpleModelModel,
@@ -1440,7 +1526,8 @@ async def post_simplemodel(
 
 
 @app.get("/models/simplemodel", dependencies=[Depends(verified_user)])
-async def get_simplemodel(
+@blocking
+def get_simplemodel(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str,
@@ -1455,7 +1542,8 @@ async def get_simplemodel(
 
 
 @app.get("/models/bert", dependencies=[Depends(verified_user)])
-async def get_bert(project: Annotated[Project, Depends(get_project)], name: str) -> dict[str, Any]:
+@blocking
+def get_bert(project: Annotated[Project, Depends(get_project)], name: str) -> dict[str, Any]:
     """
     Get Bert parameters and statistics
     """
@@ -1467,7 +1555,8 @@ async def get_bert(project: Annotated[Project, Depends(get_project)], name: str)
 
 
 @app.post("/models/bert/predict", dependencies=[Depends(verified_user)])
-async def predict(
+@exclusive
+def predict(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     model_name: str,
@@ -1505,7 +1594,8 @@ async def predict(
 
 
 @app.post("/models/bert/train", dependencies=[Depends(verified_user)])
-async def post_bert(
+@exclusive
+def post_bert(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     bert: BertModelModel,
@@ -1560,7 +1650,8 @@ async def post_bert(
 
 
 @app.post("/models/bert/stop", dependencies=[Depends(verified_user)])
-async def stop_bert(
+@exclusive
+def stop_bert(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
 ) -> None:
@@ -1584,7 +1675,8 @@ async def stop_bert(
 
 
 @app.post("/models/bert/test", dependencies=[Depends(verified_user)])
-async def start_test(
+@exclusive
+def start_test(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str,
@@ -1615,7 +1707,8 @@ async def start_test(
 
 
 @app.post("/models/bert/delete", dependencies=[Depends(verified_user)])
-async def delete_bert(
+@exclusive
+def delete_bert(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     bert_name: str,
@@ -1635,7 +1728,8 @@ async def delete_bert(
 
 
 @app.post("/models/bert/rename", dependencies=[Depends(verified_user)])
-async def save_bert(
+@exclusive
+def save_bert(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     former_name: str,
@@ -1662,7 +1756,8 @@ async def save_bert(
 
 
 @app.get("/export/data", dependencies=[Depends(verified_user)])
-async def export_data(
+@blocking
+def export_data(
     project: Annotated[Project, Depends(get_project)],
     scheme: str,
     format: str,
@@ -1678,7 +1773,8 @@ async def export_data(
 
 
 @app.get("/export/features", dependencies=[Depends(verified_user)])
-async def export_features(
+@blocking
+def export_features(
     project: Annotated[Project, Depends(get_project)],
     features: list = Query(),
     format: str = Query(),
@@ -1694,7 +1790,8 @@ async def export_features(
 
 
 @app.get("/export/prediction/simplemodel", dependencies=[Depends(verified_user)])
-async def export_simplemodel_predictions(
+@blocking
+def export_simplemodel_predictions(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     scheme: str,
@@ -1713,7 +1810,8 @@ async def export_simplemodel_predictions(
 
 
 @app.get("/export/prediction", dependencies=[Depends(verified_user)])
-async def export_prediction(
+@blocking
+def export_prediction(
     project: Annotated[Project, Depends(get_project)],
     format: str = Query(),
     name: str = Query(),
@@ -1730,7 +1828,8 @@ async def export_prediction(
 
 
 @app.get("/export/bert", dependencies=[Depends(verified_user)])
-async def export_bert(
+@blocking
+def export_bert(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     name: str = Query(),
@@ -1747,7 +1846,8 @@ async def export_bert(
 
 
 @app.get("/export/raw", dependencies=[Depends(verified_user)])
-async def export_raw(
+@blocking
+def export_raw(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
 ) -> dict:
@@ -1762,7 +1862,8 @@ async def export_raw(
 
 
 @app.get("/export/generations", dependencies=[Depends(verified_user)])
-async def export_generations(
+@blocking
+def export_generations(
     project: Annotated[Project, Depends(get_project)],
     current_user: Annotated[UserInDBModel, Depends(verified_user)],
     number: int = Query(),
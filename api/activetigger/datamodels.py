@@ -423,6 +423,7 @@ class UserFeatureComputing(UserComputing):
     name: str
     type: str
     parameters: dict
+    append: bool = False  # computed for the rows missing of an existing feature
 
 
 class UserModelComputing(UserComputing):
@@ -0,0 +1,65 @@
+import datetime
+from typing import Any, Sequence
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session as SessionType
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.db.models import Jobs
+
+
+class JobsService:
+    Session: sessionmaker[SessionType]
+
+    def __init__(self, sessionmaker: sessionmaker[SessionType]):
+        self.Session = sessionmaker
+
+    def add_job(
+        self,
+        unique_id: str,
+        kind: str,
+        project_slug: str,
+        user: str | None,
+        params: dict[str, Any],
+        result_path: str | None = None,
+        owner: str | None = None,
+    ) -> None:
+        with self.Session.begin() as session:
+            session.add(
+                Jobs(
+                    id=unique_id,
+                    time_created=datetime.datetime.now(),
+                    kind=kind,
+                    project_id=project_slug,
+                    user_id=user,
+                    status="pending",
+                    params=params,
+                    result_path=result_path,
+                    owner=owner,
+                )
+            )
+
+    def update_job(self, unique_id: str, status: str, error: str | None = None) -> None:
+        """
+        Change the status of a job and set the matching time
+        """
+        values: dict[str, Any] = {"status": status}
+        if status == "running":
+            values["time_started"] = datetime.datetime.now()
+        else:
+            values["time_ended"] = datetime.datetime.now()
+        if error is not None:
+            values["error"] = error
+        with self.Session.begin() as session:
+            session.execute(update(Jobs).filter_by(id=unique_id).values(**values))
+
+    def get_jobs(
+        self, project_slug: str | None = None, status: list[str] | None = None
+    ) -> Sequence[Jobs]:
+        with self.Session() as session:
+            stmt = select(Jobs).order_by(Jobs.time_created)
+            if project_slug is not None:
+                stmt = stmt.where(Jobs.project_id == project_slug)
+            if status is not None:
+                stmt = stmt.where(Jobs.status.in_(status))
+            return session.scalars(stmt).all()
@@ -1,7 +1,7 @@
 import datetime
 from typing import Any
 
-from sqlalchemy import DateTime, ForeignKey, Integer, MetaData, Text, func
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, MetaData, Text, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.types import JSON
 
@@ -32,19 +32,24 @@ class Projects(Base):
         onupdate=func.current_timestamp(),
     )
     parameters: Mapped[dict[str, Any]]
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    user: Mapped["Users"] = relationship("Users")
+    user_id: Mapped[str]
     schemes: Mapped[list["Schemes"]] = relationship(
         "Schemes", cascade="all,delete,delete-orphan", back_populates="project"
     )
     annotations: Mapped[list["Annotations"]] = relationship(
         "Annotations", cascade="all,delete,delete-orphan", back_populates="project"
     )
+    current_annotations: Mapped[list["CurrentAnnotations"]] = relationship(
+        "CurrentAnnotations", cascade="all,delete,delete-orphan", back_populates="project"
+    )
     auths: Mapped[list["Auths"]] = relationship(
         "Auths", cascade="all,delete,delete-orphan", back_populates="project"
     )
     logs: Mapped[list["Logs"]] = relationship(
-        "Logs", cascade="all,delete,delete-orphan", back_populates="project"
+        "Logs",
+        primaryjoin="Projects.project_slug == foreign(Logs.project_id)",
+        cascade="all,delete,delete-orphan",
+        back_populates="project",
     )
     generations: Mapped[list["Generations"]] = relationship(
         "Generations", cascade="all,delete,delete-orphan", back_populates="project"
@@ -67,14 +72,11 @@ class Users(Base):
     time: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    user: Mapped[str]
+    user: Mapped[str] = mapped_column(index=True)
     key: Mapped[str]
     description: Mapped[str]
     contact: Mapped[str] = mapped_column(Text)
     created_by: Mapped[str]
-    projects: Mapped[list[Projects]] = relationship(
-        back_populates="user", cascade="all,delete,delete-orphan"
-    )
 
 
 class Schemes(Base):
@@ -89,30 +91,57 @@ class Schemes(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp(),
     )
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="schemes")
-    models: Mapped[list["Models"]] = relationship()
     name: Mapped[str]
     params: Mapped[dict[str, Any]]
 
 
 class Annotations(Base):
     __tablename__ = "annotations"
+    __table_args__ = (
+        Index("ix_annotations_element", "project_id", "scheme_id", "element_id", "time"),
+        Index("ix_annotations_dataset", "project_id", "scheme_id", "dataset", "time"),
+        Index("ix_annotations_user", "project_id", "scheme_id", "user_id", "time"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     time: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
     dataset: Mapped[str]
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="annotations")
     element_id: Mapped[str]
-    scheme_id: Mapped[int] = mapped_column(ForeignKey("schemes.id"))
-    scheme: Mapped[Schemes] = relationship()
+    scheme_id: Mapped[str]
+    annotation: Mapped[str | None]
+    comment: Mapped[str | None] = mapped_column(Text)
+
+
+class CurrentAnnotations(Base):
+    """
+    Last annotation for each element of a project/scheme/dataset
+    Maintained alongside the append-only annotations table
+    """
+
+    __tablename__ = "current_annotations"
+    __table_args__ = (
+        Index("ix_current_annotations_time", "project_id", "scheme_id", "dataset", "time"),
+    )
+
+    project_id: Mapped[str] = mapped_column(
+        ForeignKey("projects.project_slug", ondelete="CASCADE"), primary_key=True
+    )
+    project: Mapped[Projects] = relationship(back_populates="current_annotations")
+    scheme_id: Mapped[str] = mapped_column(primary_key=True)
+    dataset: Mapped[str] = mapped_column(primary_key=True)
+    element_id: Mapped[str] = mapped_column(primary_key=True)
+    time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    user_id: Mapped[str]
     annotation: Mapped[str | None]
     comment: Mapped[str | None] = mapped_column(Text)
 
@@ -121,8 +150,7 @@ class Auths(Base):
     __tablename__ = "auth"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="auths")
     status: Mapped[str]
@@ -136,10 +164,11 @@ class Logs(Base):
     time: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
-    project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
-    project: Mapped[Projects] = relationship(back_populates="logs")
+    user_id: Mapped[str]
+    project_id: Mapped[str]
+    project: Mapped[Projects] = relationship(
+        primaryjoin="Projects.project_slug == foreign(Logs.project_id)", back_populates="logs"
+    )
     action: Mapped[str | None]
     connect: Mapped[str | None]
 
@@ -151,7 +180,7 @@ class Tokens(Base):
     time_created: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    token: Mapped[str]
+    token: Mapped[str] = mapped_column(index=True)
     status: Mapped[str]
     time_revoked: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
 
@@ -177,8 +206,7 @@ class Generations(Base):
     time: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="generations")
     element_id: Mapped[str]
@@ -195,8 +223,7 @@ class Features(Base):
     time: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="features")
     name: Mapped[str]
@@ -217,12 +244,10 @@ class Models(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp(),
     )
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    user: Mapped[Users] = relationship()
+    user_id: Mapped[str]
     project_id: Mapped[str] = mapped_column(ForeignKey("projects.project_slug", ondelete="CASCADE"))
     project: Mapped[Projects] = relationship(back_populates="models")
-    scheme_id: Mapped[int] = mapped_column(ForeignKey("schemes.id"))
-    scheme: Mapped[Schemes] = relationship(back_populates="models")
+    scheme_id: Mapped[str]
     kind: Mapped[str]
     name: Mapped[str]
     parameters: Mapped[dict[str, Any]]
@@ -232,6 +257,29 @@ class Models(Base):
     test: Mapped[str | None]
 
 
+class Jobs(Base):
+    """
+    Jobs sent to the queue, kept after the end of the process
+    """
+
+    __tablename__ = "jobs"
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    time_created: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    time_started: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
+    time_ended: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
+    kind: Mapped[str]
+    project_id: Mapped[str] = mapped_column(index=True)
+    user_id: Mapped[str | None]
+    status: Mapped[str] = mapped_column(index=True)
+    params: Mapped[dict[str, Any]]
+    result_path: Mapped[str | None]
+    error: Mapped[str | None] = mapped_column(Text)
+    owner: Mapped[str | None]  # server process running the job (host:pid:start)
+
+
 class Prompts(Base):
     __tablename__ = "prompts"
 
@@ -1,9 +1,8 @@
 import datetime
 import logging
-from collections.abc import Sequence
 from typing import Any, TypedDict
 
-from sqlalchemy import delete, func, select, update
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.orm import Session as SessionType
 from sqlalchemy.orm import sessionmaker
 
@@ -11,13 +10,13 @@ from activetigger.db import DBException
 from activetigger.db.models import (
     Annotations,
     Auths,
+    CurrentAnnotations,
     Features,
     Logs,
     Models,
     Projects,
     Schemes,
     Tokens,
-    Users,
 )
 
 
@@ -45,6 +44,13 @@ class ProjectsService:
         session.commit()
         session.close()
 
+    def add_logs(self, logs: list[dict[str, Any]]) -> None:
+        """
+        Add several logs in one transaction
+        """
+        with self.Session.begin() as session:
+            session.execute(insert(Logs), logs)
+
     def get_logs(self, username: str, project_slug: str, limit: int):
         """
         TODO : secure the log through the project_slug auth
@@ -70,6 +76,23 @@ class ProjectsService:
             for log in logs
         ]
 
+    def get_recent_projects(self, limit: int, timespan: int = 7 * 24 * 3600) -> list[str]:
+        """
+        Projects with the most recent activity in the logs
+        """
+        time_threshold = datetime.datetime.now() - datetime.timedelta(seconds=timespan)
+        with self.Session() as session:
+            last_time = func.max(Logs.time)
+            stmt = (
+                select(Logs.project_id)
+                .join(Projects, Projects.project_slug == Logs.project_id)
+                .filter(Logs.time > time_threshold)
+                .group_by(Logs.project_id)
+                .order_by(last_time.desc())
+                .limit(limit)
+            )
+            return list(session.scalars(stmt).all())
+
     def get_project(self, project_slug: str):
         session = self.Session()
         project = session.query(Projects).filter_by(project_slug=project_slug).first()
@@ -203,24 +226,22 @@ class ProjectsService:
             ).first()
             session.delete(project)
 
-    def get_distinct_users(
-        self, project_slug: str, timespan: int | None
-    ) -> Sequence[Users]:
+    def get_distinct_users(self, project_slug: str, timespan: int | None) -> list[str]:
+        """
+        Users who annotated in the project, during the last timespan seconds if given
+        """
         with self.Session() as session:
             stmt = (
-                select(Projects.user)
-                .join_from(Projects, Users)
-                .where(Projects.project_slug == project_slug)
+                select(Annotations.user_id)
+                .where(Annotations.project_id == project_slug)
                 .distinct()
             )
             if timespan:
                 time_threshold = datetime.datetime.now() - datetime.timedelta(
                     seconds=timespan
                 )
-                stmt = stmt.join(Annotations).where(
-                    Annotations.time > time_threshold,
-                )
-        return session.scalars(stmt).all()
+                stmt = stmt.where(Annotations.time > time_threshold)
+            return list(session.scalars(stmt).all())
 
     def get_current_users(self, timespan: int = 600):
         session = self.Session()
@@ -290,44 +311,59 @@ class ProjectsService:
         session.close()
         return [[row[0], row[1]] for row in result]
 
-    def get_scheme_elements(self, project_slug: str, scheme: str, dataset: list[str]):
+    def get_scheme_elements(
+        self,
+        project_slug: str,
+        scheme: str,
+        dataset: list[str],
+        since: datetime.datetime | None = None,
+    ):
         """
         Get last annotation for each element id for a project/scheme
+        Read from the current annotations table
+        since: only the elements annotated after this time
         """
         with self.Session() as session:
-            results = session.execute(
+            stmt = (
                 select(
-                    Annotations.element_id,
-                    Annotations.annotation,
-                    Annotations.user_id,
-                    Annotations.time,
-                    Annotations.comment,
-                    func.max(Annotations.time),
+                    CurrentAnnotations.element_id,
+                    CurrentAnnotations.annotation,
+                    CurrentAnnotations.user_id,
+                    CurrentAnnotations.time,
+                    CurrentAnnotations.comment,
                 )
                 .filter_by(scheme_id=scheme, project_id=project_slug)
-                .where(Annotations.dataset.in_(dataset))
-                .group_by(Annotations.element_id)
-                .order_by(func.max(Annotations.time).desc())
+                .where(CurrentAnnotations.dataset.in_(dataset))
+                .order_by(CurrentAnnotations.time.desc())
             )
-
-            # Execute the query and fetch all results
-            return [
-                [row.element_id, row.annotation, row.user_id, row.time, row.comment]
-                for row in results
-            ]
-
-    def get_coding_users(self, scheme: str, project_slug: str) -> Sequence[Users]:
+            if since is not None:
+                stmt = stmt.where(CurrentAnnotations.time >= since)
+            results = session.execute(stmt)
+
+            # an element can be annotated in several datasets, keep the last one
+            elements: dict[str, list] = {}
+            for row in results:
+                if row.element_id not in elements:
+                    elements[row.element_id] = [
+                        row.element_id,
+                        row.annotation,
+                        row.user_id,
+                        row.time,
+                        row.comment,
+                    ]
+            return list(elements.values())
+
+    def get_coding_users(self, scheme: str, project_slug: str) -> list[str]:
         with self.Session() as session:
             distinct_users = session.scalars(
-                select(Annotations.user)
-                .join_from(Annotations, Users)
+                select(Annotations.user_id)
                 .where(
                     Annotations.project_id == project_slug,
                     Annotations.scheme_id == scheme,
                 )
                 .distinct()
             ).all()
-            return distinct_users
+            return list(distinct_users)
 
     def get_recent_annotations(
         self, project_slug: str, user: str, scheme: str, limit: int
@@ -340,9 +376,9 @@ class ProjectsService:
                     scheme_id=scheme,
                     dataset="train",
                 )
-                .order_by(Annotations.time.desc())
+                .group_by(Annotations.element_id)
+                .order_by(func.max(Annotations.time).desc())
                 .limit(limit)
-                .distinct()
             )
             if user != "all":
                 stmt = stmt.filter_by(user_id=user)
@@ -380,21 +416,18 @@ class ProjectsService:
             dict
         ],  # [{"element_id": str, "annotation": str, "comment": str}]
     ):
-        session = self.Session()
-        for e in elements:
-            annotation = Annotations(
-                time=datetime.datetime.now(),
-                dataset=dataset,
-                user_id=user,
-                project_id=project_slug,
-                element_id=e["element_id"],
-                scheme_id=scheme,
-                annotation=e["annotation"],
-                comment=e["comment"],
-            )
-            session.add(annotation)
-        session.commit()
-        session.close()
+        with self.Session.begin() as session:
+            for e in elements:
+                self._add_annotation(
+                    session,
+                    dataset=dataset,
+                    user=user,
+                    project_slug=project_slug,
+                    element_id=e["element_id"],
+                    scheme=scheme,
+                    annotation=e["annotation"],
+                    comment=e["comment"],
+                )
 
     def add_annotation(
         self,
@@ -405,10 +438,42 @@ class ProjectsService:
         scheme: str,
         annotation: str,
         comment: str = "",
-    ):
+    ) -> datetime.datetime:
+        """
+        Add an annotation, return its time
+        """
         with self.Session.begin() as session:
-            new_annotation = Annotations(
-                time=datetime.datetime.now(),
+            return self._add_annotation(
+                session,
+                dataset=dataset,
+                user=user,
+                project_slug=project_slug,
+                element_id=element_id,
+                scheme=scheme,
+                annotation=annotation,
+                comment=comment,
+            )
+
+    def _add_annotation(
+        self,
+        session: SessionType,
+        dataset: str,
+        user: str,
+        project_slug: str,
+        element_id: str,
+        scheme: str,
+        annotation: str | None,
+        comment: str | None,
+    ) -> datetime.datetime:
+        """
+        Append the annotation and update the current annotation
+        of the element in the same transaction
+        """
+        # local time with its offset (kept by PostgreSQL, dropped by SQLite)
+        now = datetime.datetime.now().astimezone()
+        session.add(
+            Annotations(
+                time=now,
                 dataset=dataset,
                 user_id=user,
                 project_id=project_slug,
@@ -417,14 +482,62 @@ class ProjectsService:
                 annotation=annotation,
                 comment=comment,
             )
-            session.add(new_annotation)
+        )
+        session.merge(
+            CurrentAnnotations(
+                project_id=project_slug,
+                scheme_id=scheme,
+                dataset=dataset,
+                element_id=element_id,
+                time=now,
+                user_id=user,
+                annotation=annotation,
+                comment=comment,
+            )
+        )
+        return now
+
+    def sync_current_annotations(self) -> None:
+        """
+        Fill the current annotations table from the annotations history
+        if it is empty (i.e. database created before the table existed)
+        """
+        with self.Session.begin() as session:
+            if session.scalars(select(CurrentAnnotations).limit(1)).first() is not None:
+                return None
+            last_ids = (
+                select(func.max(Annotations.id))
+                .group_by(
+                    Annotations.project_id,
+                    Annotations.scheme_id,
+                    Annotations.dataset,
+                    Annotations.element_id,
+                )
+                .scalar_subquery()
+            )
+            columns = [
+                "project_id",
+                "scheme_id",
+                "dataset",
+                "element_id",
+                "time",
+                "user_id",
+                "annotation",
+                "comment",
+            ]
+            session.execute(
+                insert(CurrentAnnotations).from_select(
+                    columns,
+                    select(*[getattr(Annotations, c) for c in columns]).where(
+                        Annotations.id.in_(last_ids)
+                    ),
+                )
+            )
 
     def available_schemes(self, project_slug: str):
         with self.Session() as session:
             schemes = session.execute(
-                select(Schemes.name, Schemes.params)
-                .filter_by(project_id=project_slug)
-                .distinct()
+                select(Schemes.name, Schemes.params).filter_by(project_id=project_slug)
             ).all()
         r = []
         for s in schemes:
@@ -449,23 +562,35 @@ class ProjectsService:
             )
 
     def get_table_annotations_users(self, project_slug: str, scheme: str):
+        """
+        Last annotation of each user for each element
+        """
         with self.Session() as session:
             subquery = (
                 select(
-                    Annotations.id,
+                    Annotations.element_id,
+                    Annotations.annotation,
                     Annotations.user_id,
-                    func.max(Annotations.time).label("last_timestamp"),
+                    Annotations.time,
+                    func.row_number()
+                    .over(
+                        partition_by=(Annotations.element_id, Annotations.user_id),
+                        order_by=(Annotations.time.desc(), Annotations.id.desc()),
+                    )
+                    .label("rank"),
+                )
+                .where(
+                    Annotations.project_id == project_slug,
+                    Annotations.scheme_id == scheme,
                 )
-                .filter_by(project_id=project_slug, scheme_id=scheme)
-                .group_by(Annotations.element_id, Annotations.user_id)
                 .subquery()
             )
             query = select(
-                Annotations.element_id,
-                Annotations.annotation,
-                Annotations.user_id,
-                Annotations.time,
-            ).join(subquery, Annotations.id == subquery.c.id)
+                subquery.c.element_id,
+                subquery.c.annotation,
+                subquery.c.user_id,
+                subquery.c.time,
+            ).where(subquery.c.rank == 1)
 
             results = session.execute(query).fetchall()
             return [
@@ -585,7 +710,6 @@ class ProjectsService:
                     project_id=project,
                     status="trained",
                 )
-                .distinct()
             ).all()
         return [
             {
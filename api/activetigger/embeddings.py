@@ -0,0 +1,164 @@
+import hashlib
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+# memory in GB of the embeddings kept on disk
+EMBEDDINGS_CACHE_SIZE = 10
+# texts by query (SQLite limit of variables)
+CHUNK = 500
+# seconds between two updates of the last access of an embedding
+ACCESS_INTERVAL = 3600
+
+
+class EmbeddingsCache:
+    """
+    Embeddings of texts computed by a model, kept on disk for all the projects
+    - keyed by model and hash of the normalized text
+    - least recently used embeddings are evicted when the size is over max_size (GB),
+      the last access being updated at most every ACCESS_INTERVAL, to keep the reads
+      without writing
+    - SQLite database, shared by the workers of the queue
+    - total size kept up to date by triggers, for all the processes
+    """
+
+    path: Path
+    max_size: float
+
+    def __init__(self, path: Path, max_size: float = EMBEDDINGS_CACHE_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    dtype TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (model, key)
+                )
+                """
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS ix_embeddings_access ON embeddings (last_access)"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS total (size INTEGER NOT NULL)")
+            con.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings
+                BEGIN UPDATE total SET size = size + NEW.size; END
+                """
+            )
+            con.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings
+                BEGIN UPDATE total SET size = size - OLD.size; END
+                """
+            )
+            # embeddings saved before the total
+            con.execute(
+                """
+                INSERT INTO total SELECT COALESCE(SUM(size), 0) FROM embeddings
+                WHERE NOT EXISTS (SELECT 1 FROM total)
+                """
+            )
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection committed and closed at the end
+        """
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Hash of a text, normalized (unicode form, spaces)
+        """
+        normalized = " ".join(unicodedata.normalize("NFC", str(text)).split())
+        return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+    @property
+    def size(self) -> float:
+        with self.connect() as con:
+            total = con.execute("SELECT size FROM total").fetchone()[0]
+        return total / 1e9
+
+    def get(self, model: str, keys: list[str]) -> dict[str, np.ndarray]:
+        """
+        Embeddings found in the cache, by key
+        """
+        found = {}
+        accessed = []  # keys with an old last access
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        with self.connect() as con:
+            for i in range(0, len(keys), CHUNK):
+                chunk = keys[i : i + CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = con.execute(
+                    f"SELECT key, vector, dtype, last_access FROM embeddings "
+                    f"WHERE model = ? AND key IN ({marks})",
+                    [model, *chunk],
+                ).fetchall()
+                for key, vector, dtype, last_access in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype)
+                    if now - last_access > ACCESS_INTERVAL:
+                        accessed.append(key)
+            for i in range(0, len(accessed), CHUNK):
+                chunk = accessed[i : i + CHUNK]
+                marks = ",".join("?" * len(chunk))
+                con.execute(
+                    f"UPDATE embeddings SET last_access = ? WHERE model = ? AND key IN ({marks})",
+                    [now, model, *chunk],
+                )
+        return found
+
+    def add(self, model: str, keys: list[str], vectors: np.ndarray) -> None:
+        """
+        Add embeddings, then evict the oldest ones if needed
+        (the embeddings already in the cache are kept : replacing them
+        would skip the trigger of the total)
+        """
+        now = time.time()
+        with self.connect() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (model, key, vector.tobytes(), str(vector.dtype), vector.nbytes, now)
+                    for key, vector in zip(keys, vectors)
+                ],
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used embeddings while the size is over the limit
+        """
+        excess = self.size * 1e9 - self.max_size * 1e9
+        if excess <= 0:
+            return None
+        with self.connect() as con:
+            rows = con.execute("SELECT rowid, size FROM embeddings ORDER BY last_access")
+            evicted = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                evicted.append((rowid,))
+                excess -= size
+            con.executemany("DELETE FROM embeddings WHERE rowid = ?", evicted)
@@ -0,0 +1,75 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# threads running the blocking work of the requests
+THREADS = 8
+
+
+class RequestsExecutor:
+    """
+    Run the blocking work of the requests (pandas, parquet, database)
+    out of the event loop
+    - in a bounded pool of threads
+    - the requests changing a project run one at a time for this project,
+      the reading requests run concurrently (files guarded by their own locks)
+    """
+
+    threads: int
+    pool: ThreadPoolExecutor
+    locks: dict[str, asyncio.Lock]
+    waiting: dict[str, int]
+
+    def __init__(self, threads: int = THREADS) -> None:
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+        self.locks = {}
+        self.waiting = {}  # requests holding or waiting the lock of a project
+
+    async def run(self, call: Callable[[], Any], project_slug: str | None = None) -> Any:
+        """
+        Run a function in the pool, after the other changes of the same project
+        """
+        loop = asyncio.get_running_loop()
+        if project_slug is None:
+            return await loop.run_in_executor(self.pool, call)
+        # the lock is awaited in the loop, not in a thread of the pool
+        lock = self.locks.setdefault(project_slug, asyncio.Lock())
+        self.waiting[project_slug] = self.waiting.get(project_slug, 0) + 1
+        try:
+            async with lock:
+                return await loop.run_in_executor(self.pool, call)
+        finally:
+            # lock removed when no request uses it anymore
+            self.waiting[project_slug] -= 1
+            if self.waiting[project_slug] == 0:
+                del self.waiting[project_slug]
+                del self.locks[project_slug]
+
+    def blocking(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Decorator of the synchronous routes reading data, run in the pool
+        """
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.run(functools.partial(func, *args, **kwargs))
+
+        return wrapper
+
+    def exclusive(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Decorator of the synchronous routes changing a project, run in the pool
+        The changes of a loaded project (argument project) are serialized
+        """
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            project_slug = getattr(kwargs.get("project"), "name", None)
+            return await self.run(functools.partial(func, *args, **kwargs), project_slug)
+
+        return wrapper
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import re
@@ -5,30 +6,48 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 import pandas as pd
 import pyarrow.parquet as pq
 from pandas import DataFrame, Series
+from scipy import sparse
+from slugify import slugify
 
 from activetigger.datamodels import UserFeatureComputing
 from activetigger.db.projects import ProjectsService
+from activetigger.embeddings import EMBEDDINGS_CACHE_SIZE
 from activetigger.functions import to_dtm, to_fasttext, to_sbert
+from activetigger.locks import RWLock, atomic_write
 from activetigger.queue import Queue
 
-# Use parquet files to save features
-# In the future : database ?
+# Each feature is saved in its own parquet file (features/<name>.parquet),
+# aligned on the rows of features.parquet (index only), with a manifest
+# features/manifest.json : {name: {"file":, "columns":}}
+# Dense embeddings are saved as a matrix (features/<name>.npy) in the order
+# of the rows of features.parquet, read memory-mapped
+# Document-term matrices are saved as a CSR matrix (features/<name>.npz),
+# in the same order, with their vectorizer (vocabulary frozen at the first fit)
+# Rows added to the project are appended to features.parquet : the matrices
+# then cover the first rows, the features are updated for the missing rows
+
+# kinds of features saved as a matrix
+DENSE_FEATURES = {"sbert", "fasttext"}
+SPARSE_FEATURES = {"dfm"}
 
 
 class Features:
     """
     Manage project features
     Comment :
-    - for the moment as a file
+    - for the moment as files, one per feature
     - database for informations
     - use "__" as separator
     """
 
     project_slug: str
     path_train: Path
+    path_features: Path
+    path_manifest: Path
     path_model: Path
     path_all: Path
     queue: Queue
@@ -40,6 +59,9 @@ class Features:
     lang: str
     projects_service: ProjectsService
     n: int
+    index: pd.Index
+    matrices: dict[str, np.ndarray]
+    lock: RWLock
 
     def __init__(
         self,
@@ -51,18 +73,28 @@ class Features:
         computing: list[UserFeatureComputing],
         db_manager,
         lang: str,
+        embeddings_cache_size: float = EMBEDDINGS_CACHE_SIZE,
     ) -> None:
         """
         Initit features
+        embeddings_cache_size : memory in GB of the sbert embeddings kept on disk
         """
         self.project_slug = project_slug
         self.projects_service = db_manager.projects_service
         self.path_train = path_train
         self.path_all = path_all
         self.path_models = models_path
+        self.embeddings_cache_size = embeddings_cache_size
         self.queue = queue
         self.informations = {}
-        self.map, self.n = self.get_map()
+        self.path_features = path_train.with_suffix("")  # one file per feature
+        self.path_manifest = self.path_features / "manifest.json"
+        self.lock = RWLock()  # features files written by the completed jobs
+        self.index = pd.read_parquet(self.path_train, columns=[]).index  # row ids
+        self.n = len(self.index)
+        self.matrices = {}  # memory-mapped matrices of the dense features
+        self.migrate()
+        self.map = self.get_map()
         self.lang = lang
         self.computing = computing
 
@@ -86,25 +118,131 @@ class Features:
             "dataset": {},
         }
 
-        self.get_map()
-
     def __repr__(self) -> str:
         return f"Available features : {self.map}"
 
-    def get_map(self) -> tuple[dict, int]:
-        parquet_file = pq.ParquetFile(self.path_train)
-        column_names = parquet_file.schema.names
+    def read_manifest(self) -> dict:
+        if not self.path_manifest.exists():
+            return {}
+        with open(self.path_manifest) as f:
+            return json.load(f)
 
-        def find_strings_with_pattern(strings, pattern):
-            matching_strings = [s for s in strings if re.match(pattern, s)]
-            return matching_strings
+    def write_manifest(self, manifest: dict) -> None:
+        with atomic_write(self.path_manifest) as path:
+            with open(path, "w") as f:
+                json.dump(manifest, f)
 
-        var = set(
-            [i.split("__")[0] for i in column_names if "__index" not in i and i != "id"]
-        )
-        dic = {i: find_strings_with_pattern(column_names, i) for i in var}
-        num_rows = parquet_file.metadata.num_rows
-        return dic, num_rows
+    def get_file(self, name: str, extension: str = ".parquet") -> str:
+        """
+        File name of a feature (feature names can have any character)
+        """
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        return f"{slugify(name)[:64]}-{digest}{extension}"
+
+    def migrate(self) -> None:
+        """
+        Split the features of a project saved in one file (previous versions)
+        in the format of their kind, recorded in the database
+        """
+        with self.lock.write():
+            columns = pq.ParquetFile(self.path_train).schema.names
+            columns = [i for i in columns if "__index" not in i and i != "id"]
+            if len(columns) == 0:
+                return None
+            content = pd.read_parquet(self.path_train)
+            manifest = self.read_manifest()
+            for name in dict.fromkeys(i.split("__")[0] for i in columns):
+                cols = [i for i in columns if i.split("__")[0] == name]
+                feature = self.projects_service.get_feature(self.project_slug, name)
+                kind = feature.kind if feature is not None else None
+                file = self.save(name, kind, content[cols])
+                manifest[name] = {"file": file, "columns": cols}
+            self.write_manifest(manifest)
+            with atomic_write(self.path_train) as path:
+                content[[]].to_parquet(path)
+
+    def save(
+        self,
+        name: str,
+        kind: str | None,
+        content: DataFrame,
+        dtype: str = "float32",
+        rows: pd.Index | None = None,
+    ) -> str:
+        """
+        Write the file of a feature, in the format of its kind
+        (under the write lock)
+        dtype : float32 by default, float16 to halve the memory of the dense features
+        rows : first rows of the project computed, all by default
+        """
+        if rows is None:
+            rows = self.index
+        self.path_features.mkdir(exist_ok=True)
+        if kind in DENSE_FEATURES:
+            file = self.get_file(name, ".npy")
+            matrix = content.reindex(rows).to_numpy(dtype=dtype)
+            with atomic_write(self.path_features / file) as path:
+                with open(path, "wb") as f:
+                    np.save(f, matrix)
+        elif kind in SPARSE_FEATURES:
+            file = self.get_file(name, ".npz")
+            positions = content.index.get_indexer(rows)
+            if (positions < 0).any():
+                raise ValueError("Features don't have the right rows")
+            if hasattr(content, "sparse"):
+                matrix = content.sparse.to_coo().tocsr()[positions]
+            else:
+                matrix = sparse.csr_matrix(content.to_numpy()[positions])
+            with atomic_write(self.path_features / file) as path:
+                with open(path, "wb") as f:
+                    sparse.save_npz(f, matrix)
+        else:
+            file = self.get_file(name)
+            with atomic_write(self.path_features / file) as path:
+                content.to_parquet(path)
+        return file
+
+    def get_map(self) -> dict:
+        """
+        Columns of each feature
+        """
+        with self.lock.read():
+            manifest = self.read_manifest()
+        return {name: feature["columns"] for name, feature in manifest.items()}
+
+    def get_rows(self, feature: dict) -> pd.Index:
+        """
+        Rows computed for a feature of the manifest
+        """
+        path = self.path_features / feature["file"]
+        if feature["file"].endswith(".npy"):
+            return self.index[: np.load(path, mmap_mode="r").shape[0]]
+        if feature["file"].endswith(".npz"):
+            with np.load(path) as f:
+                return self.index[: f["shape"][0]]
+        return pd.read_parquet(path, columns=[]).index
+
+    def get_missing(self, name: str) -> pd.Index:
+        """
+        Rows of the project not computed for a feature
+        """
+        with self.lock.read():
+            feature = self.read_manifest()[name]
+            return self.index.difference(self.get_rows(feature), sort=False)
+
+    def add_rows(self, index: pd.Index) -> None:
+        """
+        Add the new rows of the project, at the end
+        The features are then missing for them, until updated
+        """
+        new = index.difference(self.index, sort=False)
+        if len(new) == 0:
+            return None
+        with self.lock.write():
+            self.index = self.index.append(new)
+            self.n = len(self.index)
+            with atomic_write(self.path_train) as path:
+                pd.DataFrame(index=self.index).to_parquet(path)
 
     def add(
         self,
@@ -121,8 +259,10 @@ class Features:
         if name in self.map:
             return {"error": "feature name already exists for this project"}
 
-        # test length
-        if len(new_content) != self.n:
+        # test length : rows may have been added to the project during the
+        # computation, they are then missing until the feature is updated
+        rows = self.index[: len(new_content)]
+        if len(new_content) > self.n or not rows.isin(new_content.index).all():
             raise ValueError("Features don't have the right shape")
 
         # change type for series
@@ -132,17 +272,15 @@ class Features:
         # change column name with a prefix
         new_content.columns = [f"{name}__{i}" for i in new_content.columns]
 
-        # read data, add the feature to the dataset and save
-        content = pd.read_parquet(self.path_train)
-        content = pd.concat(
-            [
-                content[[i for i in content.columns if i not in new_content.columns]],
-                new_content,
-            ],
-            axis=1,
-        )
-        content.to_parquet(self.path_train)
-        del content
+        # save the feature in its own file, then add it to the manifest
+        with self.lock.write():
+            # another request may have added it since the test
+            manifest = self.read_manifest()
+            if name in manifest:
+                return {"error": "feature name already exists for this project"}
+            file = self.save(name, kind, new_content, parameters.get("dtype", "float32"), rows)
+            manifest[name] = {"file": file, "columns": list(new_content.columns)}
+            self.write_manifest(manifest)
 
         # add informations to database
         self.projects_service.add_feature(
@@ -155,7 +293,7 @@ class Features:
         )
 
         # refresh the map
-        self.map = self.get_map()[0]
+        self.map = self.get_map()
 
         return {"success": "feature added"}
 
@@ -169,47 +307,152 @@ class Features:
         if self.projects_service.get_feature(self.project_slug, name) is None:
             return {"error": "feature doesn't exist in database"}
 
-        col = self.get([name])
-        # read data, delete columns and save
-        content = pd.read_parquet(self.path_train)
-        content[[i for i in content.columns if i not in col]].to_parquet(
-            self.path_train
-        )
-        del content
+        # remove from the manifest, then delete the file
+        with self.lock.write():
+            manifest = self.read_manifest()
+            feature = manifest.pop(name)
+            self.write_manifest(manifest)
+            self.matrices.pop(name, None)
+            (self.path_features / feature["file"]).unlink(missing_ok=True)
+            self.get_path_vectorizer(name).unlink(missing_ok=True)
 
         # delete from database
         self.projects_service.delete_feature(self.project_slug, name)
 
         # refresh the map
-        self.map = self.get_map()[0]
+        self.map = self.get_map()
 
         return {"success": "feature deleted"}
 
-    def get(self, features: list | str = "all"):
+    def get(self, features: list | str = "all", dense: bool = False):
         """
         Get content for specific features
+        Only the files of the requested features are read
+        Sparse features (dfm) are densified if dense (files export)
         """
         if features == "all":
             features = list(self.map.keys())
         if type(features) is str:
             features = [features]
 
-        cols = []
-        missing = []
-        for i in features:
-            if i in self.map:
-                cols += self.map[i]
-            else:
-                missing.append(i)
-
-        if len(i) > 0:
+        missing = [i for i in features if i not in self.map]
+        if len(missing) > 0:
             print("Missing features:", missing)
 
-        # load only needed data from file
-        print("read parquet")
-        data = pd.read_parquet(self.path_train, columns=cols)
+        # load only needed data from files
+        with self.lock.read():
+            manifest = self.read_manifest()
+            data = [pd.DataFrame(index=self.index)]
+            found = []
+            for i in features:
+                if i not in manifest:
+                    continue
+                found.append(i)
+                if manifest[i]["file"].endswith(".npy"):
+                    # no copy of the matrix, missing rows as NA
+                    matrix = self.get_matrix(i)
+                    df = pd.DataFrame(
+                        matrix,
+                        index=self.index[: matrix.shape[0]],
+                        columns=manifest[i]["columns"],
+                        copy=False,
+                    )
+                    if matrix.shape[0] < self.n:
+                        df = df.reindex(self.index)
+                    data.append(df)
+                elif manifest[i]["file"].endswith(".npz"):
+                    # missing rows as empty documents
+                    matrix = sparse.load_npz(self.path_features / manifest[i]["file"])
+                    if matrix.shape[0] < self.n:
+                        empty = sparse.csr_matrix((self.n - matrix.shape[0], matrix.shape[1]))
+                        matrix = sparse.vstack([matrix, empty], format="csr")
+                    if dense:
+                        df = pd.DataFrame(
+                            matrix.toarray(), index=self.index, columns=manifest[i]["columns"]
+                        )
+                    else:
+                        df = pd.DataFrame.sparse.from_spmatrix(
+                            matrix, index=self.index, columns=manifest[i]["columns"]
+                        )
+                    data.append(df)
+                else:
+                    data.append(
+                        pd.read_parquet(self.path_features / manifest[i]["file"])
+                    )
+
+        # a matrix feature alone is returned as is (no copy of the matrix)
+        if len(found) == 1 and not manifest[found[0]]["file"].endswith(".parquet"):
+            return data[1]
+        return pd.concat(data, axis=1)
+
+    def get_matrix(self, name: str) -> np.ndarray:
+        """
+        Matrix of a dense feature, memory-mapped (read only)
+        Rows in the order of the index (the first rows if some are missing)
+        """
+        if name not in self.matrices:
+            manifest = self.read_manifest()
+            if name not in manifest or not manifest[name]["file"].endswith(".npy"):
+                raise ValueError(f"{name} is not a dense feature")
+            self.matrices[name] = np.load(
+                self.path_features / manifest[name]["file"], mmap_mode="r"
+            )
+        return self.matrices[name]
 
-        return data
+    def get_path_vectorizer(self, name: str) -> Path:
+        return self.path_features / self.get_file(name, ".vectorizer.pickle")
+
+    def append(self, name: str, new_content: DataFrame | Series) -> dict:
+        """
+        Add the rows missing of a feature, computed since
+        """
+        if name not in self.map:
+            return {"error": "feature doesn't exist in mapping"}
+        if type(new_content) is Series:
+            new_content = pd.DataFrame(new_content)
+        new_content.columns = [f"{name}__{i}" for i in new_content.columns]
+
+        with self.lock.write():
+            feature = self.read_manifest()[name]
+            if list(new_content.columns) != feature["columns"]:
+                raise ValueError("Features don't have the right columns")
+            rows = self.get_rows(feature)
+            # the rows computed, following the existing ones
+            added = self.index.difference(rows, sort=False)[: len(new_content)]
+            if not added.isin(new_content.index).all():
+                raise ValueError("Features don't have the right rows")
+            path_file = self.path_features / feature["file"]
+
+            if feature["file"].endswith(".npy"):
+                # copied by chunks in the new file, not in memory
+                matrix = np.load(path_file, mmap_mode="r")
+                with atomic_write(path_file) as path:
+                    new = np.lib.format.open_memmap(
+                        path,
+                        mode="w+",
+                        dtype=matrix.dtype,
+                        shape=(len(rows) + len(added), matrix.shape[1]),
+                    )
+                    for i in range(0, len(rows), 100_000):
+                        j = min(i + 100_000, len(rows))
+                        new[i:j] = matrix[i:j]
+                    new[len(rows) :] = new_content.loc[added].to_numpy(dtype=matrix.dtype)
+                    new.flush()
+                    del new
+                self.matrices.pop(name, None)
+            elif feature["file"].endswith(".npz"):
+                matrix = sparse.load_npz(path_file)
+                positions = new_content.index.get_indexer(added)
+                new = new_content.sparse.to_coo().tocsr()[positions]
+                with atomic_write(path_file) as path:
+                    with open(path, "wb") as f:
+                        sparse.save_npz(f, sparse.vstack([matrix, new], format="csr"))
+            else:
+                content = pd.read_parquet(path_file)
+                with atomic_write(path_file) as path:
+                    pd.concat([content, new_content.loc[added]]).to_parquet(path)
+
+        return {"success": "feature updated"}
 
     def info(self, name: str):
         feature = self.projects_service.get_feature(self.project_slug, name)
@@ -239,7 +482,8 @@ class Features:
         Get column raw dataset
         """
         df = pd.read_parquet(self.path_all)
-        df_train = pd.read_parquet(self.path_train, columns=[])  # only the index
+        with self.lock.read():
+            df_train = pd.read_parquet(self.path_train, columns=[])  # only the index
         if column_name not in list(df.columns):
             return {"error": "Column doesn't exist"}
         if index == "train":  # filter only train id
@@ -255,6 +499,29 @@ class Features:
     def current_computing(self):
         return [e.name for e in self.computing if e.kind == "feature"]
 
+    def estimate_memory_use(self, kind: str, n: int, parameters: dict) -> dict[str, float]:
+        """
+        Estimate the memory in GB needed to compute a feature for n texts
+        """
+        if kind == "sbert":
+            # model and batches on GPU if available, embeddings (768 float32) in RAM
+            resources = {"ram": 1 + n * 768 * 4 / 1e9}
+            if self.queue.capacity.get("gpu"):
+                resources["gpu"] = 2
+            else:
+                resources["ram"] += 2
+            return resources
+        if kind == "fasttext":
+            # the whole model is loaded in memory (~7 GB for the default models)
+            model = parameters.get("model")
+            size = 7.5
+            if model and (self.path_models / model).exists():
+                size = (self.path_models / model).stat().st_size / 1e9
+            return {"ram": 1 + size + n * 300 * 8 / 1e9}
+        if kind == "dfm":
+            return {"ram": 1 + n * 1e-5}
+        return {}
+
     def compute(
         self, df: pd.Series, name: str, kind: str, parameters: dict, username: str
     ):
@@ -273,38 +540,104 @@ class Features:
                 raise ValueError("No value for regex")
 
             regex_name = f"regex_[{parameters['value']}]_by_{username}"
-            pattern = re.compile(parameters["value"])
-            f = df.apply(lambda x: bool(pattern.search(x)))
+            f = self.compute_regex(df, parameters["value"])
             parameters["count"] = int(f.sum())
             r = self.add(regex_name, kind, username, parameters, f)
             return {"success": "regex added"}
 
         elif kind == "dataset":
             # get the raw column for the train set
-            r = self.get_column_raw(parameters["dataset_col"])
+            r = self.compute_dataset(parameters)
             if "error" in r:
                 return r
-            column = r["success"]
-
-            # convert the column to a specific format
-            if len(column.dropna()) != len(column):
-                return {"error": "Column contains null values"}
-            if parameters["dataset_type"] == "Numeric":
-                try:
-                    column = column.apply(float)
-                except Exception:
-                    return {
-                        "error": "The column can't be transform into numerical feature"
-                    }
-            else:
-                column = column.apply(str)
 
             # add the feature to the project
             dataset_name = f"dataset_{parameters['dataset_col']}_{parameters['dataset_type']}".lower()
-            self.add(dataset_name, kind, username, parameters, column)
+            self.add(dataset_name, kind, username, parameters, r["success"])
             return {"success": "Feature added"}
-        elif kind == "sbert":
-            args = {"texts": df, "model": "all-mpnet-base-v2"}
+
+        if kind == "fasttext":
+            if parameters["model"] is not None and parameters["model"] != "":
+                name = f"{name}_{parameters['model']}"
+        if kind == "dfm" and name not in self.map:
+            # new vocabulary
+            self.get_path_vectorizer(name).unlink(missing_ok=True)
+
+        return self.start_computing(df, name, kind, parameters, username)
+
+    def update(self, name: str, df: pd.Series, username: str) -> dict:
+        """
+        Compute a feature only for the rows missing (added to the project since)
+        """
+        feature = self.projects_service.get_feature(self.project_slug, name)
+        if feature is None:
+            return {"error": "feature doesn't exist in database"}
+        if name in self.current_computing():
+            return {"error": "feature already computing"}
+        missing = self.get_missing(name)
+        if len(missing) == 0:
+            return {"success": "feature up to date"}
+
+        if feature.kind == "regex":
+            return self.append(
+                name, self.compute_regex(df.loc[missing], feature.parameters["value"])
+            )
+        if feature.kind == "dataset":
+            r = self.compute_dataset(feature.parameters)
+            if "error" in r:
+                return r
+            return self.append(name, r["success"].loc[missing])
+        if feature.kind in {"sbert", "fasttext", "dfm"}:
+            return self.start_computing(
+                df.loc[missing], name, feature.kind, feature.parameters, username, append=True
+            )
+        return {"error": f"{feature.kind} features can't be updated"}
+
+    def compute_regex(self, df: pd.Series, value: str) -> pd.Series:
+        pattern = re.compile(value)
+        return df.apply(lambda x: bool(pattern.search(x)))
+
+    def compute_dataset(self, parameters: dict) -> dict:
+        """
+        Column of the raw dataset for the train set, converted
+        """
+        r = self.get_column_raw(parameters["dataset_col"])
+        if "error" in r:
+            return r
+        column = r["success"]
+
+        # convert the column to a specific format
+        if len(column.dropna()) != len(column):
+            return {"error": "Column contains null values"}
+        if parameters["dataset_type"] == "Numeric":
+            try:
+                column = column.apply(float)
+            except Exception:
+                return {"error": "The column can't be transform into numerical feature"}
+        else:
+            column = column.apply(str)
+        return {"success": column}
+
+    def start_computing(
+        self,
+        df: pd.Series,
+        name: str,
+        kind: str,
+        parameters: dict,
+        username: str,
+        append: bool = False,
+    ) -> dict:
+        """
+        Compute a feature in the queue
+        append : rows missing of an existing feature
+        """
+        if kind == "sbert":
+            args = {
+                "texts": df,
+                "model": "all-mpnet-base-v2",
+                "path_cache": self.path_models / "embeddings.db",
+                "cache_size": self.embeddings_cache_size,
+            }
             func = to_sbert
         elif kind == "fasttext":
             args = {
@@ -313,21 +646,26 @@ class Features:
                 "path_models": self.path_models,
                 "model": parameters["model"],
             }
-            if parameters["model"] is not None and parameters["model"] != "":
-                name = f"{name}_{parameters['model']}"
             func = to_fasttext
-
         elif kind == "dfm":
             args = parameters.copy()
             args["texts"] = df
             args["language"] = self.lang
+            args["path_vectorizer"] = self.get_path_vectorizer(name)
             func = to_dtm
 
         # add the computation to queue
-        unique_id = self.queue.add("feature", self.project_slug, func, args)
+        unique_id = self.queue.add(
+            "feature",
+            self.project_slug,
+            func,
+            args,
+            user=username,
+            resources=self.estimate_memory_use(kind, len(df), parameters),
+        )
 
         if unique_id == "error":
-            return "error"
+            return {"error": "Error in adding in the queue"}
 
         self.computing.append(
             UserFeatureComputing(
@@ -338,6 +676,7 @@ class Features:
                 user=username,
                 name=name,
                 time=datetime.now(),
+                append=append,
             )
         )
 
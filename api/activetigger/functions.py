@@ -1,79 +1,65 @@
 import gc
 import json
 import logging
-import multiprocessing
+import multiprocessing.synchronize
 import os
 import shutil
 from logging import Logger
 from pathlib import Path
-from typing import Optional, cast
+from typing import TYPE_CHECKING, Optional, cast
 
 import bcrypt
-
-# accelerate UMAP
-try:
-    import cuml
-
-    CUMl_AVAILABLE = True
-except ImportError:
-    print("CuML not installed")
-    CUMl_AVAILABLE = False
-
-import datasets
-import fasttext
 import numpy as np
 import pandas as pd
-import spacy
-import torch
-import umap
-from fasttext.util import download_model
 from pandas import DataFrame, Series
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from sklearn.manifold import TSNE
 from sklearn.metrics import accuracy_score, f1_score, precision_score
 from sklearn.model_selection import KFold, cross_val_predict
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from torch import autocast
-from transformers import (
-    AutoModelForSequenceClassification,
-    AutoTokenizer,
-    BertTokenizer,
-    Trainer,
-    TrainerCallback,
-    TrainerControl,
-    TrainerState,
-    TrainingArguments,
-)
-
-
-class CustomLoggingCallback(TrainerCallback):
-    event: Optional[multiprocessing.synchronize.Event]
-    current_path: Path
-    logger: Logger
-
-    def __init__(self, event, logger, current_path):
-        self.event = event
-        self.current_path = current_path
-        self.logger = logger
-
-    def on_step_end(
-        self,
-        args: TrainingArguments,
-        state: TrainerState,
-        control: TrainerControl,
-        **kwargs,
-    ):
-        self.logger.info(f"Step {state.global_step}")
-        progress_percentage = (state.global_step / state.max_steps) * 100
-        with open(self.current_path.joinpath("train/progress"), "w") as f:
-            f.write(str(progress_percentage))
-        # end if event set
-        if self.event is not None:
-            if self.event.is_set():
-                self.logger.info("Event set, stopping training.")
-                control.should_training_stop = True
-                raise Exception("Process interrupted by user")
+
+from activetigger.embeddings import EMBEDDINGS_CACHE_SIZE, EmbeddingsCache
+from activetigger.locks import atomic_write
+from activetigger.queue import Progress
+from activetigger.worker import get_cache
+
+if TYPE_CHECKING:
+    from transformers import TrainerControl, TrainerState, TrainingArguments
+
+# heavy libraries (torch, transformers, spacy, ...) are imported in the functions
+# using them, to keep the import of the API and of the workers fast
+
+
+def get_logging_callback(
+    event: Optional[multiprocessing.synchronize.Event],
+    logger: Logger,
+    current_path: Path,
+    progress: Optional[Progress] = None,
+):
+    """
+    Callback of the trainer (defined here to import transformers lazily)
+    - log the steps and report the progress
+    - stop the training if the event is set
+    """
+    from transformers import TrainerCallback
+
+    class CustomLoggingCallback(TrainerCallback):
+        def on_step_end(
+            self,
+            args: "TrainingArguments",
+            state: "TrainerState",
+            control: "TrainerControl",
+            **kwargs,
+        ):
+            logger.info(f"Step {state.global_step}")
+            if progress is not None:
+                progress.update((state.global_step / state.max_steps) * 100)
+            # end if event set
+            if event is not None:
+                if event.is_set():
+                    logger.info("Event set, stopping training.")
+                    control.should_training_stop = True
+                    raise Exception("Process interrupted by user")
+
+    return CustomLoggingCallback()
 
 
 def get_root_pwd() -> str:
@@ -138,6 +124,7 @@ def to_dtm(
     log: bool = False,
     language: str = "en",
     norm=None,
+    path_vectorizer: Path | None = None,
     **kwargs,
 ):
     """
@@ -147,7 +134,21 @@ def to_dtm(
     sublinear_tf : log
     Pas pris en compte : DFM : Min Docfreq
     https://quanteda.io/reference/dfm_tfidf.html
+
+    path_vectorizer : vectorizer saved at the first fit, the vocabulary
+    is then frozen for the texts added later
     """
+    import pickle
+
+    import spacy
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+    if path_vectorizer is not None and path_vectorizer.exists():
+        with open(path_vectorizer, "rb") as f:
+            vectorizer = pickle.load(f)
+        dtm = vectorizer.transform(texts)
+        names = vectorizer.get_feature_names_out()
+        return pd.DataFrame.sparse.from_spmatrix(dtm, index=texts.index, columns=names)
 
     # load stopwords
     if language == "fr":
@@ -175,10 +176,15 @@ def to_dtm(
             stop_words=stop_words,
         )
 
+    # kept sparse : the memory depends on the non zero values
     dtm = vectorizer.fit_transform(texts)
     names = vectorizer.get_feature_names_out()
-    dtm = pd.DataFrame(dtm.toarray(), columns=names, index=texts.index)
-    return {"success": dtm}
+    if path_vectorizer is not None:
+        path_vectorizer.parent.mkdir(exist_ok=True)
+        with atomic_write(path_vectorizer) as path:
+            with open(path, "wb") as f:
+                pickle.dump(vectorizer, f)
+    return pd.DataFrame.sparse.from_spmatrix(dtm, index=texts.index, columns=names)
 
 
 def tokenize(texts: Series, language: str = "fr") -> Series:
@@ -186,6 +192,8 @@ def tokenize(texts: Series, language: str = "fr") -> Series:
     Clean texts with tokenization to facilitate word count
     TODO : faster tokenization ?
     """
+    import spacy
+
     if language == "en":
         model = "en_core_web_sm"
     elif language == "fr":
@@ -193,7 +201,7 @@ def tokenize(texts: Series, language: str = "fr") -> Series:
     else:
         raise Exception(f"Language {language} is not supported")
 
-    nlp = spacy.load(model, disable=["ner", "tagger"])
+    nlp = get_cache().get(("spacy", model), lambda: spacy.load(model, disable=["ner", "tagger"]))
     docs = nlp.pipe(texts, batch_size=1000)
     textes_tk = [" ".join([str(token) for token in doc]) for doc in docs]
     # def tokenize(t, nlp):
@@ -207,6 +215,8 @@ def get_gpu_memory_info() -> dict:
     """
     Get info on GPU
     """
+    import torch
+
     if not torch.cuda.is_available():
         return {"gpu_available": False, "total_memory": 0, "available_memory": 0}
 
@@ -224,7 +234,7 @@ def get_gpu_estimate():
     return None
 
 
-def to_fasttext(texts: Series, language: str, path_models: Path) -> DataFrame:
+def to_fasttext(texts: Series, language: str, path_models: Path, **kwargs) -> DataFrame:
     """
     Compute fasttext embedding
     Download the model if needed
@@ -234,6 +244,9 @@ def to_fasttext(texts: Series, language: str, path_models: Path) -> DataFrame:
     Returns:
         pandas.DataFrame: embeddings
     """
+    import fasttext
+    from fasttext.util import download_model
+
     if not path_models.exists():
         raise Exception(f"path {str(path_models)} does not exist")
 
@@ -250,7 +263,12 @@ def to_fasttext(texts: Series, language: str, path_models: Path) -> DataFrame:
         if not Path(model_name).exists():
             raise FileNotFoundError(f"Model {model_name} not found")
     texts_tk = tokenize(texts)
-    ft = fasttext.load_model(model_name)
+    model_path = str(Path(model_name).resolve())
+    ft = get_cache().get(
+        ("fasttext", model_path),
+        lambda: fasttext.load_model(model_path),
+        lambda _: os.path.getsize(model_path) / 1e9,
+    )
     emb = [ft.get_sentence_vector(t.replace("\n", " ")) for t in texts_tk]
     df = pd.DataFrame(emb, index=texts.index)
     # WARN: this seems strange. Maybe replace with a more explicit syntax
@@ -262,6 +280,8 @@ def to_sbert(
     texts: Series,
     model: str = "all-mpnet-base-v2",
     batch_size: int = 32,
+    path_cache: Path | None = None,
+    cache_size: float = EMBEDDINGS_CACHE_SIZE,
     **kwargs,
 ) -> DataFrame:
     """
@@ -269,9 +289,38 @@ def to_sbert(
     Args:
         texts (pandas.Series): texts
         model (str): model to use
+        path_cache (Path): embeddings cache shared by the projects,
+            only the texts missing in the cache are encoded
+        cache_size (float): memory in GB of the embeddings cache
     Returns:
         pandas.DataFrame: embeddings
     """
+    if path_cache is None:
+        emb = encode_sbert(list(texts), model, batch_size)
+    else:
+        cache = EmbeddingsCache(path_cache, cache_size)
+        keys = [cache.key(t) for t in texts]
+        found = cache.get(model, keys)
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        logging.debug(f"{len(keys) - len(missing)} embeddings found in the cache")
+        if len(missing) > 0:
+            vectors = encode_sbert(list(missing.values()), model, batch_size)
+            cache.add(model, list(missing), vectors)
+            found.update(zip(missing, vectors))
+        emb = np.stack([found[k] for k in keys])
+    emb = pd.DataFrame(emb, index=texts.index)
+    emb.columns = ["sb%03d" % (x + 1) for x in range(len(emb.columns))]
+    return emb
+
+
+def encode_sbert(texts: list[str], model: str, batch_size: int = 32) -> np.ndarray:
+    """
+    Encode texts with a sbert model
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from torch import autocast
+
     try:
         os.nice(5)
     except PermissionError:
@@ -286,27 +335,28 @@ def to_sbert(
     else:
         device = torch.device("cpu")  # Fallback to CPU
 
+    sbert = None
     try:
-        sbert = SentenceTransformer(model, device=str(device))
+        # kept on CPU by the worker between jobs
+        sbert = get_cache().get(("sbert", model), lambda: SentenceTransformer(model, device="cpu"))
+        sbert.to(device)
         sbert.max_seq_length = 512
 
         print("start computation")
         if device.type == "cuda":
             with autocast(device_type=str(device)):
-                emb = sbert.encode(
-                    list(texts), device=str(device), batch_size=batch_size
-                )
+                emb = sbert.encode(texts, device=str(device), batch_size=batch_size)
         else:
-            emb = sbert.encode(list(texts), batch_size=batch_size, device=str(device))
-        emb = pd.DataFrame(emb, index=texts.index)
-        emb.columns = ["sb%03d" % (x + 1) for x in range(len(emb.columns))]
+            emb = sbert.encode(texts, batch_size=batch_size, device=str(device))
         logging.debug("computation end")
-        return emb
+        return np.asarray(emb, dtype=np.float32)
     except Exception as e:
         logging.error(e)
         raise e
     finally:
         # cleaning
+        if sbert is not None:
+            sbert.to("cpu")
         del sbert, texts
         gc.collect()
         if torch.cuda.is_available():
@@ -315,17 +365,31 @@ def to_sbert(
             torch.cuda.ipc_collect()
 
 
+def scale_features(features: DataFrame):
+    """
+    Standardize the features of a projection
+    Sparse features (dfm) are kept sparse, scaled without centering
+    """
+    if hasattr(features, "sparse"):
+        return StandardScaler(with_mean=False).fit_transform(features.sparse.to_coo().tocsr())
+    return StandardScaler().fit_transform(features)
+
+
 def compute_umap(features: DataFrame, params: dict, **kwargs):
     """
     Compute UMAP projection
     """
-    scaled_features = StandardScaler().fit_transform(features)
+    scaled_features = scale_features(features)
 
     # Check if cuML is available for GPU acceleration
     try:
+        import cuml
+
         reducer = cuml.UMAP(**params)
         print("Using cuML for UMAP computation")
     except Exception:
+        import umap
+
         reducer = umap.UMAP(**params)
         print("Using standard UMAP for computation")
 
@@ -339,7 +403,14 @@ def compute_tsne(features: DataFrame, params: dict, **kwargs):
     """
     Compute TSNE
     """
-    scaled_features = StandardScaler().fit_transform(features)
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.manifold import TSNE
+
+    scaled_features = scale_features(features)
+    if hasattr(features, "sparse"):
+        # TSNE needs dense features (PCA initialization), reduced first
+        n_components = min(50, scaled_features.shape[1] - 1)
+        scaled_features = TruncatedSVD(n_components=n_components).fit_transform(scaled_features)
     reduced_features = TSNE(**params).fit_transform(scaled_features)
     df = pd.DataFrame(reduced_features, index=features.index)
     df_scaled = 2 * (df - df.min()) / (df.max() - df.min()) - 1
@@ -350,9 +421,14 @@ def fit_model(model, X, Y, labels, **kwargs):
     """
     Fit simplemodel and calculate statistics
     """
+    index = X.index
+    # sparse features (dfm) given to the model as a CSR matrix
+    if hasattr(X, "sparse"):
+        X = X.sparse.to_coo().tocsr()
+
     # drop NA values
     f = Y.notnull()
-    Xf = X[f]
+    Xf = X[f.to_numpy()]
     Yf = Y[f]
 
     # fit model
@@ -360,7 +436,7 @@ def fit_model(model, X, Y, labels, **kwargs):
 
     # compute probabilities
     proba = model.predict_proba(X)
-    proba = pd.DataFrame(proba, columns=model.classes_, index=X.index)
+    proba = pd.DataFrame(proba, columns=model.classes_, index=index)
     proba["entropy"] = -1 * (proba * np.log(proba)).sum(axis=1)
     proba["prediction"] = proba.drop(columns="entropy").idxmax(axis=1)
 
@@ -434,6 +510,14 @@ def train_bert(
 
     # ATTENTION : environ 160 Mo de cache reste dans le GPU par worker
     """
+    import datasets
+    import torch
+    from transformers import (
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+        Trainer,
+        TrainingArguments,
+    )
 
     try:
         os.nice(5)
@@ -487,7 +571,9 @@ def train_bert(
     df["text"] = df[col_text]
     df = datasets.Dataset.from_pandas(df[["text", "labels"]])
 
-    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    tokenizer = get_cache().get(
+        ("tokenizer", base_model), lambda: AutoTokenizer.from_pretrained(base_model)
+    )
 
     print("tokenize")
 
@@ -570,7 +656,12 @@ def train_bert(
             train_dataset=df["train"],
             eval_dataset=df["test"],
             callbacks=[
-                CustomLoggingCallback(event, current_path=current_path, logger=logger)
+                get_logging_callback(
+                    event,
+                    current_path=current_path,
+                    logger=logger,
+                    progress=kwargs.get("progress"),
+                )
             ],
         )
 
@@ -620,6 +711,7 @@ def predict_bert(
     col_labels: str | None = None,
     batch: int = 32,
     file_name: str = "predict.parquet",
+    progress: Progress | None = None,
     **kwargs,
 ) -> dict:
     """
@@ -627,6 +719,9 @@ def predict_bert(
     + probabilities
     + entropy
     """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
     # empty cache
     torch.cuda.empty_cache()
     print("batch size", batch)
@@ -639,7 +734,6 @@ def predict_bert(
 
     # logging the process
     log_path = path / "status_predict.log"
-    progress_path = path / "progress_predict"
     logger = logging.getLogger("predict_bert_model")
     file_handler = logging.FileHandler(log_path)
     formatter = logging.Formatter(
@@ -651,8 +745,14 @@ def predict_bert(
     print("load model")
     with open(path / "config.json", "r") as jsonfile:
         modeltype = json.load(jsonfile)["_name_or_path"]
-    tokenizer = AutoTokenizer.from_pretrained(modeltype)
-    model = AutoModelForSequenceClassification.from_pretrained(path)
+    tokenizer = get_cache().get(
+        ("tokenizer", modeltype), lambda: AutoTokenizer.from_pretrained(modeltype)
+    )
+    # the version of the model files is part of the key
+    model = get_cache().get(
+        ("bert", str(path), os.path.getmtime(path / "config.json")),
+        lambda: AutoModelForSequenceClassification.from_pretrained(path),
+    )
 
     print("function prediction : start")
     if torch.cuda.is_available():
@@ -688,9 +788,9 @@ def predict_bert(
             res = res.softmax(1).detach().numpy()
             predictions.append(res)
 
-            # write progress
-            with open(progress_path, "w") as f:
-                f.write(str((len(predictions) * batch / df.shape[0]) * 100))
+            # report progress
+            if progress is not None:
+                progress.update(min(len(predictions) * batch / df.shape[0] * 100, 100))
 
         # to dataframe
         pred = pd.DataFrame(
@@ -725,7 +825,9 @@ def predict_bert(
     finally:
         # delete the logs
         os.remove(log_path)
-        os.remove(progress_path)
+        # the model stays in the cache of the worker, on CPU
+        if gpu:
+            model.cpu()
         # clean memory
         del tokenizer, model, chunk, df, res, predictions, outputs, event
         gc.collect()
@@ -739,6 +841,8 @@ def truncate_text(text: str, max_tokens: int = 512):
     """
     Limit a text to a specific number of tokens
     """
+    from transformers import BertTokenizer
+
     tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
     tokens = tokenizer.tokenize(text)
     num_tokens = len(tokens)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class RWLock:
+    """
+    Reader/writer lock for the files of a project
+    - several readers at the same time
+    - one writer alone, waiting writers go before the new readers
+    - reentrant for the writer (a writer can read or write again)
+    """
+
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer: int | None = None  # thread holding the lock to write
+        self.writes = 0  # reentrant writes of the writer
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        me = threading.get_ident()
+        if self.writer == me:
+            yield
+            return
+        with self.condition:
+            while self.writer is not None or self.waiting_writers > 0:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer != me:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers > 0:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+            self.writes += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writes -= 1
+                if self.writes == 0:
+                    self.writer = None
+                    self.condition.notify_all()
+
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[Path]:
+    """
+    Write a file through a temporary file in the same directory,
+    renamed on success : readers see the old or the new file, never a partial one
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield Path(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import logging
+import threading
+
+from activetigger.db.projects import ProjectsService
+
+logger = logging.getLogger("server")
+
+
+class LogsWriter:
+    """
+    Buffer the actions to log and write them in bulk in the database
+
+    The buffer is flushed by a background task every flush_interval ms,
+    or earlier when it contains flush_size records
+    """
+
+    projects_service: ProjectsService
+    flush_interval: float
+    flush_size: int
+    buffer: list[dict]
+
+    def __init__(
+        self,
+        projects_service: ProjectsService,
+        flush_interval: int = 500,
+        flush_size: int = 100,
+    ) -> None:
+        self.projects_service = projects_service
+        self.flush_interval = flush_interval / 1000
+        self.flush_size = flush_size
+        self.buffer = []
+        self.lock = threading.Lock()  # buffer can be filled from worker threads
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.wake: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+
+    def add(self, user: str, action: str, project_slug: str, connect: str) -> None:
+        """
+        Add an action to the buffer
+        """
+        with self.lock:
+            self.buffer.append(
+                {
+                    "user_id": user,
+                    "project_id": project_slug,
+                    "action": action,
+                    "connect": connect,
+                    "time": datetime.datetime.now(),
+                }
+            )
+            full = len(self.buffer) >= self.flush_size
+
+        # no background task, write directly
+        if self.loop is None or self.wake is None:
+            self.flush()
+        elif full:
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    def flush(self) -> None:
+        """
+        Write the buffered actions in the database
+        """
+        with self.lock:
+            logs, self.buffer = self.buffer, []
+        if len(logs) == 0:
+            return None
+        try:
+            self.projects_service.add_logs(logs)
+        except Exception as e:
+            logger.error("Failed to write %s logs: %s", len(logs), e)
+
+    async def run(self) -> None:
+        """
+        Flush periodically until cancelled
+        """
+        assert self.wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await asyncio.to_thread(self.flush)
+
+    def start(self) -> None:
+        """
+        Start the background task in the running event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """
+        Stop the background task and write the remaining actions
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        self.loop = None
+        self.wake = None
+        self.flush()
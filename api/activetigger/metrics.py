@@ -0,0 +1,120 @@
+import threading
+from collections import defaultdict
+
+# upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Requests metrics of the API
+    - latency histogram, requests and errors counts by route
+    - requests in flight
+
+    Exported in the Prometheus text format
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests: dict[tuple[str, str, str], int] = defaultdict(int)
+        self.errors: dict[tuple[str, str], int] = defaultdict(int)
+        self.latency_buckets: dict[tuple[str, str], list[int]] = defaultdict(
+            lambda: [0] * len(self.buckets)
+        )
+        self.latency_sum: dict[tuple[str, str], float] = defaultdict(float)
+        self.latency_count: dict[tuple[str, str], int] = defaultdict(int)
+
+    def start(self) -> None:
+        """
+        A request starts
+        """
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, method: str, route: str, status: int, duration: float) -> None:
+        """
+        A request ends
+        """
+        key = (method, route)
+        with self.lock:
+            self.in_flight -= 1
+            self.requests[(method, route, str(status))] += 1
+            if status >= 500:
+                self.errors[key] += 1
+            counts = self.latency_buckets[key]
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    counts[i] += 1
+            self.latency_sum[key] += duration
+            self.latency_count[key] += 1
+
+    def export(self, queue_state: dict, nb_workers: int) -> str:
+        """
+        Metrics in the Prometheus text format
+        queue_state: state of the queue (see Queue.state)
+        """
+        lines = []
+        with self.lock:
+            lines += [
+                "# HELP activetigger_requests_in_flight Requests being processed",
+                "# TYPE activetigger_requests_in_flight gauge",
+                f"activetigger_requests_in_flight {self.in_flight}",
+                "# HELP activetigger_requests_total Requests by route and status",
+                "# TYPE activetigger_requests_total counter",
+            ]
+            for (method, route, status), n in sorted(self.requests.items()):
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                lines.append(f"activetigger_requests_total{{{labels}}} {n}")
+            lines += [
+                "# HELP activetigger_request_errors_total Requests ending with a server error",
+                "# TYPE activetigger_request_errors_total counter",
+            ]
+            for (method, route), n in sorted(self.errors.items()):
+                labels = f'method="{method}",route="{route}"'
+                lines.append(f"activetigger_request_errors_total{{{labels}}} {n}")
+            lines += [
+                "# HELP activetigger_request_duration_seconds Requests latency by route",
+                "# TYPE activetigger_request_duration_seconds histogram",
+            ]
+            for (method, route), counts in sorted(self.latency_buckets.items()):
+                labels = f'method="{method}",route="{route}"'
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(
+                        f'activetigger_request_duration_seconds_bucket{{{labels},le="{bound}"}} {n}'
+                    )
+                count = self.latency_count[(method, route)]
+                lines += [
+                    f'activetigger_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}',
+                    (
+                        f"activetigger_request_duration_seconds_sum{{{labels}}} "
+                        f"{self.latency_sum[(method, route)]}"
+                    ),
+                    f"activetigger_request_duration_seconds_count{{{labels}}} {count}",
+                ]
+
+        # queue
+        jobs: dict[tuple[str, str], int] = defaultdict(int)
+        for job in queue_state.values():
+            jobs[(job["kind"], job["state"])] += 1
+        running = sum(n for (_, state), n in jobs.items() if state == "running")
+        pending = sum(n for (_, state), n in jobs.items() if state == "pending")
+        lines += [
+            "# HELP activetigger_queue_jobs Jobs in the queue by kind and state",
+            "# TYPE activetigger_queue_jobs gauge",
+        ]
+        for (kind, state), n in sorted(jobs.items()):
+            lines.append(f'activetigger_queue_jobs{{kind="{kind}",state="{state}"}} {n}')
+        lines += [
+            "# HELP activetigger_queue_depth Jobs waiting for a worker",
+            "# TYPE activetigger_queue_depth gauge",
+            f"activetigger_queue_depth {pending}",
+            "# HELP activetigger_queue_workers Workers of the queue",
+            "# TYPE activetigger_queue_workers gauge",
+            f"activetigger_queue_workers {nb_workers}",
+            "# HELP activetigger_queue_utilization Share of the workers running a job",
+            "# TYPE activetigger_queue_utilization gauge",
+            f"activetigger_queue_utilization {running / nb_workers if nb_workers else 0}",
+        ]
+        return "\n".join(lines) + "\n"
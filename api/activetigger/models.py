@@ -4,6 +4,7 @@ import os
 import pickle
 import shutil
 from datetime import datetime
+from functools import lru_cache, partial
 from io import BytesIO
 from multiprocessing import Process
 from pathlib import Path
@@ -19,7 +20,6 @@ from sklearn.model_selection import KFold, cross_val_predict
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.preprocessing import StandardScaler
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
 import activetigger.functions as functions
 from activetigger.datamodels import (
@@ -33,8 +33,23 @@ from activetigger.datamodels import (
 )
 from activetigger.db.manager import DatabaseManager
 from activetigger.db.projects import ProjectsService
+from activetigger.locks import RWLock, atomic_write
 from activetigger.queue import Queue
 
+# memory in GB assumed for a model without local configuration
+DEFAULT_MEMORY_USE = {"train": 8, "predict": 4}
+
+
+@lru_cache(maxsize=128)
+def get_model_config(model: str) -> Any:
+    """
+    Configuration of a model, loaded once from the local files
+    (trained model or cache of the hub), never from the network
+    """
+    from transformers import AutoConfig
+
+    return AutoConfig.from_pretrained(model, local_files_only=True)
+
 
 class BertModel:
     """
@@ -106,6 +121,8 @@ class BertModel:
         if lazy:
             self.status = "lazy"
         else:
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
             with open(self.path / "config.json", "r") as jsonfile:
                 modeltype = json.load(jsonfile)["_name_or_path"]
             self.base_model = modeltype
@@ -118,29 +135,6 @@ class BertModel:
             r = json.load(f)
         return list(r["id2label"].values())
 
-    def get_training_progress(self) -> float:
-        """
-        Get progress when training
-        (different cases)
-        """
-        # case of training
-        if (self.status == "training") & (self.path / "train/progress").exists():
-            with open(self.path / "train/progress", "r") as f:
-                r = f.read()
-                if r == "":
-                    r = 0
-            return float(r)
-        # case for prediction (predicting/testing)
-        if (("predicting" in self.status) or (self.status == "testing")) & (
-            self.path / "progress_predict"
-        ).exists():
-            with open(self.path / "progress_predict", "r") as f:
-                r = f.read()
-                if r == "":
-                    r = 0
-            return float(r)
-        return None
-
     def informations(self, decimals: int = 3) -> dict:
         """
         Compute statistics for train & test
@@ -456,15 +450,54 @@ class BertModels:
         """
         return [e for e in self.computing if e.user == user]
 
-    def estimate_memory_use(self, model: str, kind: str = "train"):
+    def estimate_memory_use(
+        self, model: str | Path, kind: str = "train", batch_size: int = 32, max_length: int = 512
+    ) -> float:
         """
-        Estimate the GPU memory in Gb needed to train a model
-        TODO : implement
+        Estimate the memory in GB needed to train or predict with a model
+        - weights, with gradients and optimizer states for training (fp32, AdamW)
+        - activations of the batches (Korthikanti et al., 2022)
+        model : name of the base model or path of a trained model
         """
+        try:
+            config = get_model_config(str(model))
+        except Exception as e:
+            # not downloaded yet : enough for the large base models
+            logging.warning(f"Can't load the configuration of {model} : {e}")
+            return DEFAULT_MEMORY_USE[kind]
+
+        hidden = config.hidden_size
+        layers = config.num_hidden_layers
+        heads = config.num_attention_heads
+        intermediate = getattr(config, "intermediate_size", 4 * hidden)
+        positions = getattr(config, "max_position_embeddings", max_length)
+        seq_length = min(max_length, positions)
+
+        # parameters : embeddings + attention and feed forward of each layer
+        nb_parameters = (config.vocab_size + positions) * hidden + layers * (
+            4 * hidden * hidden + 2 * hidden * intermediate
+        )
+
+        # activations of one layer for a batch, in bytes (fp32)
+        activations = batch_size * seq_length * (34 * hidden + 5 * heads * seq_length) * 2
+
         if kind == "train":
-            return 4
-        if kind == "predict":
-            return 3
+            # weights, gradients and two optimizer states, activations of all the layers
+            memory = 16 * nb_parameters + layers * activations
+        else:
+            # weights, activations of the current layer only
+            memory = 4 * nb_parameters + activations
+
+        # overhead of the runtime (CUDA context, buffers)
+        return round(memory / 1e9 + 0.5, 2)
+
+    def estimate_prediction_resources(self, path: Path, batch_size: int) -> dict[str, float]:
+        """
+        Memory needed to predict, on GPU if available (see functions.predict_bert)
+        """
+        memory = self.estimate_memory_use(path, kind="predict", batch_size=batch_size)
+        resource = "gpu" if self.queue.capacity.get("gpu") else "ram"
+        return {resource: memory}
 
     def start_training_process(
         self,
@@ -516,13 +549,13 @@ class BertModels:
         params = params.dict()
         e = BertParams(**params)
 
-        # if GPU requested, test if enough memory is available (to avoid CUDA out of memory)
-        if params["gpu"]:
-            mem = functions.get_gpu_memory_info()
-            if self.estimate_memory_use(name, kind="train") > mem["available_memory"]:
-                raise Exception(
-                    "Not enough GPU memory available. Wait or reduce batch."
-                )
+        # memory needed, the training waits in the queue until it is available
+        memory = self.estimate_memory_use(
+            base_model, kind="train", batch_size=int(params["batchsize"])
+        )
+        resource = "gpu" if params["gpu"] else "ram"
+        if memory > self.queue.capacity.get(resource, 0):
+            raise Exception(f"Not enough {resource.upper()} memory on the server. Reduce batch.")
 
         # launch as a independant process
         args = {
@@ -536,7 +569,15 @@ class BertModels:
             "test_size": test_size,
         }
 
-        unique_id = self.queue.add("training", project, functions.train_bert, args)
+        unique_id = self.queue.add(
+            "training",
+            project,
+            functions.train_bert,
+            args,
+            user=user,
+            resources={resource: memory},
+            result_path=self.path / name,
+        )
         del args
 
         # Update the queue state
@@ -553,7 +594,7 @@ class BertModels:
                 status="training",
                 scheme=scheme,
                 dataset=None,
-                get_training_progress=b.get_training_progress,
+                get_training_progress=partial(self.queue.get_progress, unique_id),
             )
         )
 
@@ -623,8 +664,14 @@ class BertModels:
             "batch": 32,
         }
         unique_id = self.queue.add(
-            "prediction", "project", functions.predict_bert, args
-        )  # TODO ADD PROJECT
+            "prediction",
+            self.project_slug,
+            functions.predict_bert,
+            args,
+            user=user,
+            resources=self.estimate_prediction_resources(b.path, 32),
+            result_path=b.path / "predict_test.parquet",
+        )
         b.status = "testing"
         self.computing.append(
             UserModelComputing(
@@ -635,7 +682,7 @@ class BertModels:
                 time=datetime.now(),
                 kind="bert",
                 status="testing",
-                get_training_progress=b.get_training_progress,
+                get_training_progress=partial(self.queue.get_progress, unique_id),
             )
         )
 
@@ -649,11 +696,13 @@ class BertModels:
         col_text: str,
         dataset: str,
         batch_size: int = 32,
+        check_processes: bool = True,
     ):
         """
         Start predicting process
+        check_processes : one process at a time for the user
         """
-        if len(self.current_user_processes(user)) > 0:
+        if check_processes and len(self.current_user_processes(user)) > 0:
             return {
                 "error": "User already has a process launched, please wait before launching another one"
             }
@@ -673,8 +722,14 @@ class BertModels:
             "batch": batch_size,
         }
         unique_id = self.queue.add(
-            "prediction", "project", functions.predict_bert, args
-        )  # TODO ADD PROJECT
+            "prediction",
+            self.project_slug,
+            functions.predict_bert,
+            args,
+            user=user,
+            resources=self.estimate_prediction_resources(b.path, batch_size),
+            result_path=b.path / f"predict_{dataset}.parquet",
+        )
         b.status = f"predicting {dataset}"
         self.computing.append(
             UserModelComputing(
@@ -686,7 +741,7 @@ class BertModels:
                 kind="bert",
                 dataset=dataset,
                 status="predicting",
-                get_training_progress=b.get_training_progress,
+                get_training_progress=partial(self.queue.get_progress, unique_id),
             )
         )
         return {"success": "bert model predicting"}
@@ -802,6 +857,7 @@ class SimpleModels:
     - train simplemodels
     """
 
+    project_slug: str
     available_models: dict
     validation: dict
     existing: dict
@@ -809,11 +865,13 @@ class SimpleModels:
     path: Path
     queue: Queue
     save_file: str
+    lock: RWLock
 
-    def __init__(self, path: Path, queue: Any, computing: list) -> None:
+    def __init__(self, project_slug: str, path: Path, queue: Any, computing: list) -> None:
         """
         Init Simplemodels class
         """
+        self.project_slug = project_slug
         # Models and default parameters
         self.available_models = {
             "liblinear": {"cost": 1},
@@ -836,6 +894,7 @@ class SimpleModels:
         self.path: Path = path  # path to operate
         self.queue = queue  # access to executor for multiprocessing
         self.save_file: str = "simplemodels.pickle"  # file to save current state
+        self.lock = RWLock()  # models updated by the completed jobs, read by the requests
         self.loads()  # load existing simplemodels
 
     def __repr__(self) -> str:
@@ -846,16 +905,17 @@ class SimpleModels:
         Available simplemodels
         """
         r = {}
-        for u in self.existing:
-            r[u] = {}
-            for s in self.existing[u]:
-                sm = self.existing[u][s]
-                r[u][s] = {
-                    "model": sm.name,
-                    "params": sm.model_params,
-                    "features": sm.features,
-                    "statistics": sm.statistics,
-                }
+        with self.lock.read():
+            for u in self.existing:
+                r[u] = {}
+                for s in self.existing[u]:
+                    sm = self.existing[u][s]
+                    r[u][s] = {
+                        "model": sm.name,
+                        "params": sm.model_params,
+                        "features": sm.features,
+                        "statistics": sm.statistics,
+                    }
         return r
 
     def get(self, scheme: str, username: str):
@@ -918,7 +978,11 @@ class SimpleModels:
         """
         Load data
         """
-        f_na = data[col_predictors].isna().sum(axis=1) > 0
+        if hasattr(data[col_predictors], "sparse"):
+            # sparse features (dfm) have no missing values
+            f_na = pd.Series(False, index=data.index)
+        else:
+            f_na = data[col_predictors].isna().sum(axis=1) > 0
         if f_na.sum() > 0:
             print(f"There is {f_na.sum()} predictor rows with missing values")
 
@@ -942,6 +1006,10 @@ class SimpleModels:
         """
         Apply standardization
         """
+        if hasattr(df, "sparse"):
+            # scaled without centering to stay sparse
+            df_stand = StandardScaler(with_mean=False).fit_transform(df.sparse.to_coo())
+            return pd.DataFrame.sparse.from_spmatrix(df_stand, index=df.index, columns=df.columns)
         scaler = StandardScaler()
         df_stand = scaler.fit_transform(df)
         return pd.DataFrame(df_stand, columns=df.columns, index=df.index)
@@ -1019,7 +1087,14 @@ class SimpleModels:
         # launch the compuation (model + statistics) as a future process
         # TODO: refactore the SimpleModel class / move to API the executor call ?
         args = {"model": model, "X": X, "Y": Y, "labels": labels}
-        unique_id = self.queue.add("simplemodel", "project", functions.fit_model, args)
+        unique_id = self.queue.add(
+            "simplemodel",
+            self.project_slug,
+            functions.fit_model,
+            args,
+            user=user,
+            resources={"ram": 0.5 + 3 * X.memory_usage(deep=True).sum() / 1e9},
+        )
         sm = SimpleModel(
             name, user, X, Y, labels, "computing", features, standardize, model_params
         )
@@ -1040,8 +1115,10 @@ class SimpleModels:
         """
         Dumps all simplemodels to a pickle
         """
-        with open(self.path / self.save_file, "wb") as file:
-            pickle.dump(self.existing, file)
+        with self.lock.read():
+            with atomic_write(self.path / self.save_file) as path:
+                with open(path, "wb") as file:
+                    pickle.dump(self.existing, file)
 
     def loads(self) -> bool:
         """
@@ -1062,10 +1139,11 @@ class SimpleModels:
         sm.proba = results["proba"]
         sm.cv10 = results["cv10"]
         sm.statistics = results["statistics"]
-        if element.user not in self.existing:
-            self.existing[element.user] = {}
-        self.existing[element.user][element.scheme] = sm
-        self.dumps()
+        with self.lock.write():
+            if element.user not in self.existing:
+                self.existing[element.user] = {}
+            self.existing[element.user][element.scheme] = sm
+            self.dumps()
 
     def export_prediction(self, scheme: str, username: str, format: str = "csv"):
         # get data
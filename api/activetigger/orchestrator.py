@@ -2,6 +2,7 @@ import logging
 import os
 import secrets
 import shutil
+import threading
 import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
@@ -20,8 +21,11 @@ from activetigger.datamodels import (
 )
 from activetigger.db import DBException
 from activetigger.db.manager import DatabaseManager
+from activetigger.embeddings import EMBEDDINGS_CACHE_SIZE
+from activetigger.executor import RequestsExecutor
+from activetigger.logs import LogsWriter
 from activetigger.project import Project
-from activetigger.queue import Queue
+from activetigger.queue import Queue, is_owner_alive
 from activetigger.users import Users
 
 logger = logging.getLogger("server")
@@ -29,7 +33,8 @@ logger = logging.getLogger("server")
 
 # conf deployment
 ALGORITHM = "HS256"
-MAX_LOADED_PROJECTS = 20
+PROJECTS_MEMORY = 8  # GB, estimated memory of the loaded projects
+PRELOAD_PROJECTS = 0  # recently active projects loaded at start
 N_WORKERS = 2
 
 
@@ -53,10 +58,16 @@ class Orchestrator:
     path_models: Path
     db: Path
     projects: dict
+    schemes_states: dict
     db_manager: DatabaseManager
     queue: Queue
     users: Users
-    max_projects: int
+    logs_writer: LogsWriter
+    requests_executor: RequestsExecutor
+    projects_memory: float
+    embeddings_cache_size: float
+    projects_loading: dict[str, threading.Lock]
+    preload: int
 
     def __init__(self, path=".", path_models="./models") -> None:
         """
@@ -70,7 +81,9 @@ class Orchestrator:
         except PermissionError:
             print("You need administrative privileges to set negative niceness values.")
 
-        self.max_projects = MAX_LOADED_PROJECTS
+        self.projects_memory = PROJECTS_MEMORY
+        self.preload = PRELOAD_PROJECTS
+        self.embeddings_cache_size = EMBEDDINGS_CACHE_SIZE
         self.db_name = "activetigger.db"
         self.data_all = "data_all.parquet"
         self.features_file = "features.parquet"
@@ -91,13 +104,22 @@ class Orchestrator:
         self.secret_key = self.get_secret_key()
 
         # if a YAML configuration file exists, overwrite
+        config: dict = {}
         if Path("config.yaml").exists():
             with open("config.yaml") as f:
-                config = yaml.safe_load(f)
+                config = yaml.safe_load(f) or {}
             if "path" in config:
                 self.path = Path(config["path"])
             if "path_models" in config:
                 self.path_models = Path(config["path_models"])
+            if "n_workers" in config:
+                self.n_workers = int(config["n_workers"])
+            if "projects_memory" in config:
+                self.projects_memory = float(config["projects_memory"])
+            if "preload_projects" in config:
+                self.preload = int(config["preload_projects"])
+            if "max_size" in config.get("embeddings", {}):
+                self.embeddings_cache_size = float(config["embeddings"]["max_size"])
 
         self.db = self.path.joinpath(self.db_name)
 
@@ -107,9 +129,20 @@ class Orchestrator:
 
         # attributes of the server
         self.projects = {}
-        self.db_manager = DatabaseManager(str(self.db))
-        self.queue = Queue(self.n_workers)
+        self.projects_lock = threading.RLock()
+        self.projects_loading = {}  # locks of the projects being loaded
+        self.schemes_states = {}  # labels in memory, kept when a project is unloaded
+        self.db_manager = DatabaseManager(str(self.db), config.get("database"))
+        self.queue = Queue(
+            self.n_workers,
+            **config.get("queue", {}),
+            jobs_service=self.db_manager.jobs_service,
+        )
         self.users = Users(self.db_manager)
+        self.logs_writer = LogsWriter(
+            self.db_manager.projects_service, **config.get("logs", {})
+        )
+        self.requests_executor = RequestsExecutor(**config.get("requests", {}))
 
         # logging
         logging.basicConfig(
@@ -118,6 +151,9 @@ class Orchestrator:
             format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         )
 
+        # jobs interrupted by the last stop of the server
+        self.recover_jobs()
+
     def __del__(self):
         """
         Close the server
@@ -128,6 +164,31 @@ class Orchestrator:
         self.queue.close()
         print("Server off")
 
+    def recover_jobs(self) -> None:
+        """
+        Clean the jobs left unfinished by a server process that is gone
+        (the jobs of other running processes, or other hosts, are kept)
+        - mark them as orphaned
+        - remove their partial results (model directory, prediction file)
+        """
+        jobs_service = self.db_manager.jobs_service
+        for job in jobs_service.get_jobs(status=["pending", "running"]):
+            if is_owner_alive(job.owner):
+                continue
+            logger.warning(f"Recover {job.kind} job {job.id} of {job.project_id}")
+            if job.kind == "training" and "name" in job.params:
+                # model added at the submission, pending or partially trained
+                self.db_manager.projects_service.delete_model(job.project_id, job.params["name"])
+            if job.result_path is not None and job.time_started is not None:
+                path = Path(job.result_path)
+                if job.kind == "training":
+                    if path.exists():
+                        shutil.rmtree(path, ignore_errors=True)
+                elif path.is_file() and path.stat().st_mtime >= job.time_started.timestamp():
+                    # results written by the interrupted job
+                    os.remove(path)
+            jobs_service.update_job(job.id, "orphaned", "Interrupted by a restart of the server")
+
     def get_secret_key(self) -> str:
         """
         Get the secret key used for tokens
@@ -169,8 +230,9 @@ class Orchestrator:
     ) -> None:
         """
         Log action in the database
+        (buffered, written in bulk by the logs writer)
         """
-        self.db_manager.projects_service.add_log(user, action, project, connect)
+        self.logs_writer.add(user, action, project, connect)
         logger.info("%s from %s in project %s", action, user, project)
 
     def get_logs(
@@ -180,6 +242,7 @@ class Orchestrator:
         Get logs for a user/project
         project_slug: project slug or "all"
         """
+        self.logs_writer.flush()
         logs = self.db_manager.projects_service.get_logs("all", project_slug, limit)
         df = pd.DataFrame(
             logs, columns=["id", "time", "user", "project", "action", "NA"]
@@ -241,6 +304,7 @@ class Orchestrator:
         Revoke existing access token
         """
         self.db_manager.projects_service.revoke_token(token)
+        self.users.invalidate_token(token)
         return None
 
     def decode_access_token(self, token: str):
@@ -260,6 +324,75 @@ class Orchestrator:
         payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
         return payload
 
+    def get_project(self, project_slug: str) -> Project:
+        """
+        Get a project, load it if needed
+        Loaded projects are kept in a LRU cache bounded by their estimated memory
+        """
+        with self.projects_lock:
+            if project_slug in self.projects:
+                project = self.projects[project_slug]
+                project.last_access = time.time()
+                return project
+            loading = self.projects_loading.setdefault(project_slug, threading.Lock())
+
+        # one loading per project, the other requests wait for it
+        with loading:
+            try:
+                with self.projects_lock:
+                    if project_slug in self.projects:
+                        return self.projects[project_slug]
+                r = self.start_project(project_slug)
+                if "error" in r:
+                    raise Exception(r["error"])
+                with self.projects_lock:
+                    project = self.projects[project_slug]
+                    self.evict_projects(keep=project_slug)
+                return project
+            finally:
+                with self.projects_lock:
+                    self.projects_loading.pop(project_slug, None)
+
+    def preload_projects(self) -> None:
+        """
+        Load the projects recently active in the logs (warm up at start)
+        Stop when the memory of the loaded projects is over the limit
+        """
+        if self.preload == 0:
+            return None
+        recent = self.db_manager.projects_service.get_recent_projects(self.preload)
+        for project_slug in recent:
+            try:
+                self.get_project(project_slug)
+            except Exception as e:
+                logger.error(f"Error preloading project {project_slug}: {e}")
+                continue
+            with self.projects_lock:
+                memory = sum(p.get_memory() for p in self.projects.values())
+            if memory > self.projects_memory * 1e9:
+                break
+            logger.info(f"Project {project_slug} preloaded")
+
+    def evict_projects(self, keep: str | None = None) -> None:
+        """
+        Unload the least recently used projects while the memory is over the limit
+        Projects with jobs in progress are kept, to get their results
+        """
+        with self.projects_lock:
+            memory = {p: project.get_memory() for p, project in self.projects.items()}
+            total = sum(memory.values())
+            by_access = sorted(self.projects.items(), key=lambda x: x[1].last_access)
+            for p, project in by_access:
+                if total <= self.projects_memory * 1e9:
+                    break
+                if p == keep or len(project.computing) > 0:
+                    continue
+                del self.projects[p]
+                total -= memory[p]
+                logger.info(f"Unload project {p} ({memory[p] / 1e6:.0f} MB) to gain memory")
+            if total > self.projects_memory * 1e9:
+                logger.warning(f"Loaded projects use {total / 1e9:.1f} GB, over the limit")
+
     def start_project(self, project_slug: str) -> dict:
         """
         Load project in server
@@ -267,9 +400,16 @@ class Orchestrator:
         if not self.exists(project_slug):
             return {"error": "Project does not exist"}
 
-        self.projects[project_slug] = Project(
-            project_slug, self.queue, self.db_manager, path_models=self.path_models
+        project = Project(
+            project_slug,
+            self.queue,
+            self.db_manager,
+            path_models=self.path_models,
+            schemes_states=self.schemes_states.setdefault(project_slug, {}),
+            embeddings_cache_size=self.embeddings_cache_size,
         )
+        with self.projects_lock:
+            self.projects[project_slug] = project
         return {"success": "Project loaded"}
 
     def set_project_parameters(self, project: ProjectModel, username: str) -> dict:
@@ -552,22 +692,17 @@ class Orchestrator:
             raise Exception from e
 
         # clean current memory
-        if project_slug in self.projects:
-            del self.projects[project_slug]
+        with self.projects_lock:
+            self.projects.pop(project_slug, None)
+        self.schemes_states.pop(project_slug, None)
 
     def update(self):
         """
         Update state of projects from the queue
         """
-        timer = time.time()
-        to_del = []
         self.queue.check()  # check if the queue is still up
-        for p, project in self.projects.items():
-            # if project existing since one day, remove it from memory
-            if (timer - project.starting_time) > 86400:
-                to_del.append(p)
-                continue
+        for project in list(self.projects.values()):
             project.update_processes()
 
-        for p in to_del:
-            del self.projects[p]
+        # results of the jobs take memory
+        self.evict_projects()
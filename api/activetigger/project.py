@@ -3,6 +3,7 @@ import json
 import logging
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import cast
@@ -24,6 +25,7 @@ from activetigger.datamodels import (
     UserProjectionComputing,
 )
 from activetigger.db.manager import DatabaseManager
+from activetigger.embeddings import EMBEDDINGS_CACHE_SIZE
 from activetigger.features import Features
 from activetigger.functions import clean_regex
 from activetigger.generation.generations import GenerationResult, Generations
@@ -34,6 +36,20 @@ from activetigger.schemes import Schemes
 
 MODELS = "bert_models.csv"
 TIMEZONE = pytz.timezone("Europe/Paris")
+LOADING_THREADS = 4  # files of a project read concurrently
+
+
+def get_size(data) -> int:
+    """
+    Memory of a dataframe or an array in bytes (without the python objects)
+    """
+    if isinstance(data, DataFrame):
+        return int(data.memory_usage().sum())
+    if isinstance(data, pd.Series):
+        return int(data.memory_usage())
+    if hasattr(data, "nbytes"):
+        return int(data.nbytes)
+    return 0
 
 
 class Project:
@@ -42,9 +58,12 @@ class Project:
     """
 
     starting_time: float
+    last_access: float
+    data_memory: int
     name: str
     queue: Queue
     computing: list[UserComputing]
+    completed: set[str]
     path_models: Path
     db_manager: DatabaseManager
     params: ProjectModel
@@ -63,15 +82,21 @@ class Project:
         queue: Queue,
         db_manager: DatabaseManager,
         path_models: Path,
+        schemes_states: dict | None = None,
+        embeddings_cache_size: float = EMBEDDINGS_CACHE_SIZE,
     ) -> None:
         """
         Load existing project
         """
         self.starting_time = time.time()
+        self.last_access = self.starting_time
         self.queue = queue
         self.computing = []
+        self.completed = set()
         self.db_manager = db_manager
         self.path_models = path_models
+        self.schemes_states = schemes_states
+        self.embeddings_cache_size = embeddings_cache_size
 
         # load the project
         self.name = project_slug
@@ -111,26 +136,42 @@ class Project:
         if self.params.dir is None:
             raise ValueError("No directory exists for this project")
 
-        # loading data
-        self.content = pd.read_parquet(self.params.dir.joinpath("train.parquet"))
+        # loading data : the files are read concurrently (the parquet
+        # reading releases the GIL)
+        with ThreadPoolExecutor(max_workers=LOADING_THREADS) as executor:
+            content = executor.submit(pd.read_parquet, self.params.dir.joinpath("train.parquet"))
+            schemes = executor.submit(
+                Schemes,
+                project_slug,
+                self.params.dir.joinpath("annotations.parquet"),
+                self.params.dir.joinpath("test.parquet"),
+                self.db_manager,
+                self.schemes_states,
+            )
+            features = executor.submit(
+                Features,
+                project_slug,
+                self.params.dir.joinpath("features.parquet"),
+                self.params.dir.joinpath("data_all.parquet"),
+                self.path_models,
+                self.queue,
+                cast(list[UserFeatureComputing], self.computing),
+                self.db_manager,
+                self.params.language,
+                self.embeddings_cache_size,
+            )
+            simplemodels = executor.submit(
+                SimpleModels, project_slug, self.params.dir, self.queue, self.computing
+            )
+            self.content = content.result()
+            self.schemes = schemes.result()
+            self.features = features.result()
+            self.simplemodels = simplemodels.result()
+
+        # rows added to the project since the features were computed
+        self.features.add_rows(self.content.index)
 
         # create specific management objets
-        self.schemes = Schemes(
-            project_slug,
-            self.params.dir.joinpath("annotations.parquet"),
-            self.params.dir.joinpath("test.parquet"),
-            self.db_manager,
-        )
-        self.features = Features(
-            project_slug,
-            self.params.dir.joinpath("features.parquet"),
-            self.params.dir.joinpath("data_all.parquet"),
-            self.path_models,
-            self.queue,
-            cast(list[UserFeatureComputing], self.computing),
-            self.db_manager,
-            self.params.language,
-        )
         self.bertmodels = BertModels(
             project_slug,
             self.params.dir,
@@ -139,7 +180,6 @@ class Project:
             self.db_manager,
             MODELS,
         )
-        self.simplemodels = SimpleModels(self.params.dir, self.queue, self.computing)
         # TODO: Computings should be filtered here based on their type, each type in a different list given to the appropriate class.
         # It would render the cast here and the for-loop in the class unecessary
         self.generations = Generations(
@@ -148,6 +188,71 @@ class Project:
         self.projections = Projections(cast(list[UserProjectionComputing], self.computing))
         self.errors = []  # Move to specific class / db in the future
 
+        # memory of the texts, measured once (slow for large projects)
+        self.data_memory = sum(
+            int(df.memory_usage(deep=True).sum())
+            for df in [self.content, self.schemes.content, self.schemes.test]
+            if df is not None
+        )
+
+    def update_features(self, username: str) -> dict:
+        """
+        Compute the features for the rows missing (added to the project since)
+        - regex and dataset directly, embeddings and dfm in the queue
+        - BERT predictions with the model of the feature, launched together
+        """
+        r = {}
+        predictions = {}  # prediction features to update, with their model
+        for name in self.features.map:
+            feature = self.db_manager.projects_service.get_feature(self.name, name)
+            if feature is None:
+                continue
+            if feature.kind != "prediction":
+                r[name] = self.features.update(name, self.content["text"], username)
+                continue
+            missing = self.features.get_missing(name)
+            if len(missing) == 0:
+                r[name] = {"success": "feature up to date"}
+                continue
+            predictions[name] = (
+                feature.parameters.get("model", name.removeprefix("predict_")),
+                missing,
+            )
+
+        # one BERT process at a time for a user, except for this update
+        if len(predictions) > 0 and len(self.bertmodels.current_user_processes(username)) > 0:
+            for name in predictions:
+                r[name] = {
+                    "error": "User already has a process launched, "
+                    "update the prediction features once it is finished"
+                }
+            return r
+        for name, (model, missing) in predictions.items():
+            r[name] = self.bertmodels.start_predicting_process(
+                name=model,
+                user=username,
+                df=self.content.loc[missing, ["text"]],
+                col_text="text",
+                dataset="train_missing",
+                check_processes=False,
+            )
+        return r
+
+    def get_memory(self) -> int:
+        """
+        Estimated memory used by the project in bytes
+        - texts loaded at start
+        - simplemodels and projections computed since
+        """
+        memory = self.data_memory
+        with self.simplemodels.lock.read():
+            for models in self.simplemodels.existing.values():
+                for sm in models.values():
+                    memory += sum(get_size(x) for x in [sm.X, sm.Y, sm.proba])
+        for projection in self.projections.available.values():
+            memory += get_size(projection["data"])
+        return memory
+
     def load_params(self, project_slug: str) -> ProjectModel:
         """
         Load params from database
@@ -232,6 +337,7 @@ class Project:
         df[[testset.col_text]].to_parquet(self.params.dir.joinpath(self.test_file))
         # load the data
         self.schemes.test = df[[testset.col_text]]
+        self.schemes.reset_states()
         # update parameters
         self.params.test = True
 
@@ -357,18 +463,19 @@ class Project:
             return element
 
         # select the current state of annotation
-        df = self.schemes.get_scheme_data(scheme, complete=True)
+        labels = self.schemes.get_labels(scheme).reindex(self.schemes.content.index)
+        df = self.schemes.content
 
         # build first filter from the sample
         if sample == "untagged":
-            f = df["labels"].isna()
+            f = labels.isna()
         elif sample == "tagged":
-            if label is not None and label in df["labels"].unique():
-                f = df["labels"] == label
-            else:
-                f = df["labels"].notna()
+            # categories are kept for the labels no longer used
+            f = labels == label
+            if label is None or not f.any():
+                f = labels.notna()
         else:
-            f = df["labels"].apply(lambda x: True)
+            f = pd.Series(True, index=labels.index)
 
         # add a regex condition to the selection
         if filter:
@@ -407,11 +514,11 @@ class Project:
                 return {"error": "Projection model doesn't exist for this user"}
 
         # test if there is at least one element available
-        if sum(f) == 0:
+        if f.sum() == 0:
             return {"error": "No element available with this selection mode."}
 
         # Take into account the session history
-        ss = df[f].drop(history, errors="ignore")
+        ss = labels[f].drop(history, errors="ignore")
         if len(ss) == 0:
             return {"error": "No element available with this selection mode."}
         indicator = None
@@ -471,9 +578,9 @@ class Project:
 
         element = {
             "element_id": element_id,
-            "text": self.content.fillna("NA").loc[element_id, "text"],
+            "text": self.content.loc[element_id, ["text"]].fillna("NA")["text"],
             "context": dict(
-                self.content.fillna("NA").loc[element_id, self.params.cols_context].apply(str)
+                self.content.loc[element_id, self.params.cols_context].fillna("NA").apply(str)
             ),
             "selection": selection,
             "info": indicator,
@@ -570,12 +677,9 @@ class Project:
 
         # part train
         r = {"train_set_n": len(self.schemes.content)}
-        r["users"] = [
-            i[0]
-            for i in self.db_manager.projects_service.get_coding_users(
-                scheme, self.params.project_slug
-            )
-        ]
+        r["users"] = self.db_manager.projects_service.get_coding_users(
+            scheme, self.params.project_slug
+        )
 
         df = self.schemes.get_scheme_data(scheme, kind=["train", "predict"])
 
@@ -668,7 +772,8 @@ class Project:
         if path is None:
             raise ValueError("Problem of filesystem for project")
 
-        data = self.features.get(features)
+        # sparse columns not supported by the formats
+        data = self.features.get(features, dense=True)
 
         file_name = f"extract_schemes_{self.name}.{format}"
 
@@ -747,9 +852,14 @@ class Project:
         - manage error if needed
         """
         add_predictions = {}
+        append_predictions = {}
 
         # TODO : clean old errors from the message list
 
+        # jobs notified as finished by the queue
+        self.completed.update(self.queue.get_completed(self.name))
+        self.completed.intersection_update(self.queue.current)
+
         for e in self.computing.copy():
             # clean flag
             clean = False
@@ -760,7 +870,7 @@ class Project:
                 self.computing.remove(e)
                 continue
 
-            is_done = self.queue.current[e.unique_id]["future"].done()
+            is_done = e.unique_id in self.completed
 
             # case for bertmodels
             if (e.kind == "bert") and is_done:
@@ -789,6 +899,9 @@ class Project:
                     if "path" in r and "predict_train.parquet" in r["path"]:
                         add_predictions["predict_" + computation.model_name] = r["path"]
                         logging.debug("Prediction added")
+                    # the prediction for the rows missing in the feature
+                    if "path" in r and "predict_train_missing.parquet" in r["path"]:
+                        append_predictions["predict_" + computation.model_name] = r["path"]
 
                     self.bertmodels.add(computation)
                     logging.debug("Bertmodel treatment achieved")
@@ -824,13 +937,16 @@ class Project:
                 clean = True
                 try:
                     r = self.queue.current[feature_computation.unique_id]["future"].result()
-                    self.features.add(
-                        feature_computation.name,
-                        feature_computation.type,
-                        feature_computation.user,
-                        feature_computation.parameters,
-                        r,
-                    )
+                    if feature_computation.append:
+                        self.features.append(feature_computation.name, r)
+                    else:
+                        self.features.add(
+                            feature_computation.name,
+                            feature_computation.type,
+                            feature_computation.user,
+                            feature_computation.parameters,
+                            r,
+                        )
                     print("Feature added", feature_computation.name)
                 except Exception as ex:
                     self.errors.append(
@@ -887,6 +1003,7 @@ class Project:
             if clean:
                 self.computing.remove(e)
                 self.queue.delete(e.unique_id)
+                self.completed.discard(e.unique_id)
 
         # if predictions, add them
         for f in add_predictions:
@@ -898,10 +1015,16 @@ class Project:
             self.features.add(
                 name=name,
                 kind="prediction",
-                parameters={},
+                parameters={"model": f.removeprefix("predict_")},
                 username="system",
                 new_content=df,
             )
             logging.debug("Add feature", name)
 
+        for f in append_predictions:
+            df = pd.read_parquet(append_predictions[f])
+            df = df.drop(columns=["entropy", "prediction"])
+            df = df[df.columns[0:-1]]
+            self.features.append(f.replace("__", "_"), df)
+
         return None
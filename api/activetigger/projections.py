@@ -41,6 +41,13 @@ class Projections:
         else:
             raise Exception("Unsupported method")
 
+    def estimate_memory_use(self, features: DataFrame) -> dict[str, float]:
+        """
+        Estimate the memory in GB needed to project the features
+        (copies of the scaled features and the neighbors graph)
+        """
+        return {"ram": 1 + 4 * features.memory_usage(deep=True).sum() / 1e9}
+
     def current_computing(self):
         return [e.name for e in self.computing if e.kind == "projection"]
 
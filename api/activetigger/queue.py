@@ -1,37 +1,155 @@
 import concurrent.futures
 import datetime
 import logging
+import socket
+import threading
+import time
 import uuid
+from collections import Counter
 from multiprocessing import Manager
 from multiprocessing.managers import SyncManager
-from typing import Callable
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from typing import Any, Callable
+
+import psutil
+
+from activetigger.db.jobs import JobsService
+from activetigger.worker import MODELS_CACHE_SIZE, init_worker
 
 logger = logging.getLogger("server")
 
 
+# scheduling classes of the jobs, lower runs first
+PRIORITIES = {
+    "simplemodel": 0,
+    "feature": 1,
+    "projection": 2,
+    "prediction": 3,
+    "generation": 4,
+    "training": 5,
+}
+# jobs allowed on the reserved workers
+INTERACTIVE = {"simplemodel"}
+# waiting time after which a job reserves the memory it needs
+RESERVATION_DELAY = datetime.timedelta(seconds=60)
+
+
+def get_owner(pid: int | None = None) -> str:
+    """
+    Owner of the jobs : host, process id and start time of the process
+    (the ids are reused, e.g. 1 for a server restarted in a container)
+    """
+    process = psutil.Process(pid)
+    return f"{socket.gethostname()}:{process.pid}:{process.create_time()}"
+
+
+def is_owner_alive(owner: str | None) -> bool:
+    """
+    If the server process owning a job is still running
+    The processes of the other hosts can't be checked and are kept
+    """
+    if owner is None:
+        return False
+    host, pid, _ = owner.rsplit(":", 2)
+    if host != socket.gethostname():
+        return True
+    try:
+        return get_owner(int(pid)) == owner
+    except psutil.NoSuchProcess:
+        return False
+
+
+class Progress:
+    """
+    Progress (%) of a job, shared with the server through the queue
+    Writes are throttled to one every interval ms, except the last one
+    """
+
+    def __init__(self, channel: Any, unique_id: str, interval: int = 500) -> None:
+        self.channel = channel
+        self.unique_id = unique_id
+        self.interval = interval / 1000
+        self.last: float | None = None
+
+    def update(self, value: float) -> None:
+        """
+        Report the progress
+        """
+        now = time.monotonic()
+        if value < 100 and self.last is not None and now - self.last < self.interval:
+            return None
+        self.last = now
+        self.channel[self.unique_id] = value
+
+
 class Queue:
     """
     Managining parallel processes for computation
-    Jobs with  concurrent.futures.ProcessPoolExecutor
+    Jobs with concurrent.futures.ProcessPoolExecutor
+
+    Jobs wait in the queue and are sent to the executor when a worker is free
+    - by priority of their kind (see PRIORITIES)
+    - then fair share : the user and the project with the fewest running jobs first
+    - then in order of arrival
+    Some workers are reserved for interactive jobs (see INTERACTIVE)
+
+    Jobs declare the memory they need (GB of "ram" and "gpu") and wait
+    until the estimated memory is available ; a job waiting for longer than
+    RESERVATION_DELAY keeps its memory from the jobs behind it
+
+    If a jobs service is given, the jobs are also recorded in the database
+
+    Jobs get a Progress to report their progress, read with get_progress
 
     TODO : better management of failed processes
     """
 
     nb_workers: int
+    interactive_workers: int
     executor: concurrent.futures.ProcessPoolExecutor
     manager: SyncManager
     current: dict
+    pending: list[str]
+    running: set[str]
+    total_memory: dict[str, float] | None
+    completed: dict[str, SimpleQueue]
+    jobs_service: JobsService | None
 
-    def __init__(self, nb_workers: int = 4) -> None:
+    def __init__(
+        self,
+        nb_workers: int = 4,
+        interactive_workers: int = 1,
+        capacity: dict[str, float] | None = None,
+        jobs_service: JobsService | None = None,
+        progress_interval: int = 500,
+        models_cache_size: float = MODELS_CACHE_SIZE,
+    ) -> None:
         """
         Initiating the queue
+        - nb_workers for all the jobs
+        - interactive_workers more, reserved for interactive jobs
+        - capacity : memory in GB usable by the jobs, by default the total memory
+        - jobs_service : to keep track of the jobs in the database
+        - progress_interval : minimal time between two progress reports of a job in ms
+        - models_cache_size : memory in GB of the models kept by each worker
         """
-        self.nb_workers = nb_workers
-        self.executor = concurrent.futures.ProcessPoolExecutor(
-            max_workers=self.nb_workers
-        )  # manage parallel processes
+        self.nb_workers = nb_workers + interactive_workers
+        self.interactive_workers = interactive_workers
+        self.models_cache_size = models_cache_size
+        self.executor = self.create_executor()  # manage parallel processes
         self.manager = Manager()  # communicate within processes
+        self.progress = self.manager.dict()  # progress of the jobs by id
+        self.progress_interval = progress_interval
         self.current = {}  # keep track of the current stack
+        self.pending = []  # ids of the jobs waiting for a worker
+        self.running = set()  # ids of the jobs sent to the executor
+        self.total_memory = capacity  # measured on first use if not set
+        self.lock = threading.RLock()
+        self.completed = {}  # ids of the finished jobs by project
+        self.completed_lock = threading.Lock()
+        self.jobs_service = jobs_service
+        self.owner = get_owner()
 
         logger.info("Init Queue")
 
@@ -55,6 +173,16 @@ class Queue:
     #     except Exception as e:
     #         return True
 
+    def create_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        Workers initialized once, with their models cache
+        """
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.nb_workers,
+            initializer=init_worker,
+            initargs=(self.models_cache_size,),
+        )
+
     def check(self) -> None:
         """
         Check if the exector still works
@@ -64,50 +192,289 @@ class Queue:
             self.executor.submit(lambda: None)
         except Exception:
             self.executor.shutdown(cancel_futures=True)
-            self.executor = concurrent.futures.ProcessPoolExecutor(
-                max_workers=self.nb_workers
-            )
+            self.executor = self.create_executor()
             logger.error("Restart executor")
             print("Problem with executor ; restart")
+        # jobs waiting for memory
+        self.schedule()
 
-    def add(self, kind: str, project_slug: str, func: Callable, args: dict) -> str:
+    def add(
+        self,
+        kind: str,
+        project_slug: str,
+        func: Callable,
+        args: dict,
+        user: str | None = None,
+        resources: dict[str, float] | None = None,
+        result_path: str | Path | None = None,
+    ) -> str:
         """
         Add new element to queue
-        - launch the function func and args as a subprocess
         - push the process in the queue
+        - launch the function func and args as a subprocess when its turn comes
+        resources: estimated memory needed in GB, e.g. {"ram": 2, "gpu": 4}
+        result_path: file or directory written by the job, cleaned if it is interrupted
         """
         # generate a unique id
         unique_id = str(uuid.uuid4())
 
         # create an event to control the process
-        event = self.manager.Event()
-        args["event"] = event
-        args["unique_id"] = unique_id
-
-        # send the process to the executor
         try:
-            future = self.executor.submit(func, **args)
+            event = self.manager.Event()
         except Exception as e:
             logger.error(f"Error submitting task: {e}")
             return "error"
+        args["event"] = event
+        args["unique_id"] = unique_id
+        args["progress"] = Progress(self.progress, unique_id, self.progress_interval)
+
+        # the future is resolved by the executor once the job is sent
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        # notify the project when the job ends
+        completed = self.get_completed_queue(project_slug)
+        future.add_done_callback(lambda _: completed.put(unique_id))
 
         # save in the stack
-        self.current[unique_id] = {
-            "kind": kind,
-            "project_slug": project_slug,
-            "future": future,
-            "event": event,
-            "starting_time": datetime.datetime.now(),
-        }
+        with self.lock:
+            self.current[unique_id] = {
+                "kind": kind,
+                "project_slug": project_slug,
+                "user": user,
+                "resources": resources or {},
+                "func": func,
+                "args": args,
+                "future": future,
+                "event": event,
+                "starting_time": datetime.datetime.now(),
+            }
+            self.pending.append(unique_id)
+
+        if self.jobs_service is not None:
+            try:
+                self.jobs_service.add_job(
+                    unique_id,
+                    kind,
+                    project_slug,
+                    user,
+                    self.get_params(args),
+                    str(result_path) if result_path is not None else None,
+                    self.owner,
+                )
+            except Exception as e:
+                logger.error(f"Error recording job {unique_id}: {e}")
+
+        self.schedule()
         return unique_id
 
+    @staticmethod
+    def get_params(args: dict) -> dict[str, Any]:
+        """
+        Arguments of a job that can be saved (no data, no event)
+        """
+        scalars = (str, int, float, bool, type(None))
+        params: dict[str, Any] = {}
+        for key, value in args.items():
+            if key in ("event", "unique_id", "progress"):
+                continue
+            if isinstance(value, scalars):
+                params[key] = value
+            elif isinstance(value, Path):
+                params[key] = str(value)
+            elif isinstance(value, dict) and all(isinstance(v, scalars) for v in value.values()):
+                params[key] = value
+        return params
+
+    def record(self, unique_id: str, status: str, error: str | None = None) -> None:
+        """
+        Update the status of a job in the database
+        """
+        if self.jobs_service is None:
+            return None
+        try:
+            self.jobs_service.update_job(unique_id, status, error)
+        except Exception as e:
+            logger.error(f"Error recording job {unique_id}: {e}")
+
+    def schedule(self) -> None:
+        """
+        Send the waiting jobs to the executor while workers are free
+        """
+        with self.lock:
+            while len(self.pending) > 0 and len(self.running) < self.nb_workers:
+                unique_id = self.next_job()
+                if unique_id is None:
+                    break
+                self.pending.remove(unique_id)
+                self.submit(unique_id)
+
+    def next_job(self) -> str | None:
+        """
+        Choose the next job to run, None if no job can run now
+        """
+        running = [self.current[i] for i in self.running if i in self.current]
+        users = Counter(job["user"] for job in running)
+        projects = Counter(job["project_slug"] for job in running)
+
+        # the reserved workers are only for interactive jobs
+        nb_batch = len([job for job in running if job["kind"] not in INTERACTIVE])
+        batch_allowed = nb_batch < self.nb_workers - self.interactive_workers
+
+        # memory left for new jobs
+        available = None
+        reserved: Counter = Counter()
+        for job in running:
+            reserved.update(job["resources"])
+
+        now = datetime.datetime.now()
+        candidates = []
+        for order, unique_id in enumerate(self.pending):
+            job = self.current[unique_id]
+            if job["kind"] not in INTERACTIVE and not batch_allowed:
+                continue
+            # a job alone is always admitted, even if its estimate is too high
+            if len(running) > 0 and any(job["resources"].values()):
+                if available is None:
+                    available = self.get_available_resources()
+                if not self.fits(job["resources"], reserved, available):
+                    # the smaller jobs behind can't take the memory it waits for
+                    if now - job["starting_time"] > RESERVATION_DELAY:
+                        reserved.update(job["resources"])
+                        for resource, needed in job["resources"].items():
+                            available[resource] = available.get(resource, 0) - needed
+                    continue
+            rank = (
+                PRIORITIES.get(job["kind"], len(PRIORITIES)),
+                users[job["user"]],
+                projects[job["project_slug"]],
+                order,
+            )
+            candidates.append((rank, unique_id))
+        if len(candidates) == 0:
+            return None
+        return min(candidates)[1]
+
+    def fits(self, resources: dict, reserved: Counter, available: dict) -> bool:
+        """
+        Test if the memory needed by a job is available
+        - not reserved by the running jobs
+        - and currently free
+        """
+        for resource, needed in resources.items():
+            free = min(
+                self.capacity.get(resource, 0) - reserved[resource],
+                available.get(resource, 0),
+            )
+            if needed > free:
+                return False
+        return True
+
+    @property
+    def capacity(self) -> dict[str, float]:
+        """
+        Memory in GB usable by the jobs
+        """
+        if self.total_memory is None:
+            self.total_memory = self.get_capacity()
+        return self.total_memory
+
+    def get_capacity(self) -> dict[str, float]:
+        """
+        Total memory in GB
+        (measured lazily : the GPU needs torch, slow to import)
+        """
+        from activetigger.functions import get_gpu_memory_info
+
+        return {
+            "ram": psutil.virtual_memory().total / 1e9,
+            "gpu": get_gpu_memory_info()["total_memory"],
+        }
+
+    def get_available_resources(self) -> dict[str, float]:
+        """
+        Free memory in GB
+        """
+        r = {"ram": psutil.virtual_memory().available / 1e9, "gpu": 0.0}
+        if self.capacity.get("gpu"):
+            from activetigger.functions import get_gpu_memory_info
+
+            r["gpu"] = get_gpu_memory_info()["available_memory"]
+        return r
+
+    def submit(self, unique_id: str) -> None:
+        """
+        Send a job to the executor
+        """
+        job = self.current[unique_id]
+        future = job["future"]
+        func, args = job.pop("func"), job.pop("args")
+        if not future.set_running_or_notify_cancel():
+            return None
+        try:
+            execution = self.executor.submit(func, **args)
+        except Exception as e:
+            logger.error(f"Error submitting task: {e}")
+            future.set_exception(e)
+            self.record(unique_id, "failed", repr(e))
+            return None
+        self.running.add(unique_id)
+        job["starting_time"] = datetime.datetime.now()
+        self.record(unique_id, "running")
+        execution.add_done_callback(lambda f: self.finish(unique_id, f))
+
+    def finish(self, unique_id: str, execution: concurrent.futures.Future) -> None:
+        """
+        Resolve the future of a job ended in the executor and run the next jobs
+        """
+        with self.lock:
+            self.running.discard(unique_id)
+        future = self.current.get(unique_id, {}).get("future")
+        # killed jobs are no longer in the stack
+        if future is not None:
+            if execution.cancelled():
+                future.set_exception(concurrent.futures.CancelledError())
+                self.record(unique_id, "failed", "Cancelled")
+            elif execution.exception() is not None:
+                future.set_exception(execution.exception())
+                self.record(unique_id, "failed", repr(execution.exception()))
+            else:
+                future.set_result(execution.result())
+                self.record(unique_id, "done")
+        self.schedule()
+
+    def get_completed_queue(self, project_slug: str) -> SimpleQueue:
+        """
+        Queue of the finished jobs of a project
+        """
+        with self.completed_lock:
+            if project_slug not in self.completed:
+                self.completed[project_slug] = SimpleQueue()
+            return self.completed[project_slug]
+
+    def get_completed(self, project_slug: str) -> list[str]:
+        """
+        Ids of the jobs of a project finished since the last call
+        """
+        completed = self.get_completed_queue(project_slug)
+        ids = []
+        while True:
+            try:
+                ids.append(completed.get_nowait())
+            except Empty:
+                return ids
+
     def kill(self, unique_id: str) -> dict:
         """
         Send a kill process with the event manager
         """
         if unique_id not in self.current:
             return {"error": "Id does not exist"}
+        with self.lock:
+            if unique_id in self.pending:
+                self.pending.remove(unique_id)
+                self.current[unique_id]["future"].cancel()
         self.current[unique_id]["event"].set()  # TODO update status to flag the killing
+        self.record(unique_id, "killed")
         self.delete(unique_id)  # TODOmove this to the cleaning method
         return {"success": "Process killed"}
 
@@ -117,32 +484,53 @@ class Queue:
         """
         if type(ids) is str:
             ids = [ids]
-        for i in ids:
-            if not self.current[i]["future"].done():
-                print("Deleting a unfinished process")
-            del self.current[i]
+        with self.lock:
+            for i in ids:
+                if not self.current[i]["future"].done():
+                    print("Deleting a unfinished process")
+                if i in self.pending:
+                    self.pending.remove(i)
+                del self.current[i]
+                self.progress.pop(i, None)
 
     def state(self) -> dict:
         """
         Return state of the queue
         """
+        # jobs deleted meanwhile by the other threads are still read
+        with self.lock:
+            jobs = dict(self.current)
         r = {}
-        for f in self.current:
-            if self.current[f]["future"].running():
+        for f, job in jobs.items():
+            if job["future"].running():
                 info = "running"
                 exception = None
+            elif not job["future"].done():
+                info = "pending"
+                exception = None
             else:
                 info = "done"
-                exception = self.current[f]["future"].exception()
+                exception = job["future"].exception()
             r[f] = {
                 "state": info,
                 "exception": exception,
-                "kind": self.current[f]["kind"],
+                "kind": job["kind"],
+                "resources": job["resources"],
             }
         return r
 
+    def get_progress(self, unique_id: str) -> float | None:
+        """
+        Last progress (%) reported by a job
+        """
+        try:
+            return self.progress.get(unique_id)
+        except Exception as e:
+            logger.error(f"Error reading the progress of {unique_id}: {e}")
+            return None
+
     def get_nb_active_processes(self) -> int:
         """
         Number of active processes
         """
-        return len([f for f in self.current if self.current[f]["future"].running()])
+        return len(self.running)
@@ -1,3 +1,5 @@
+import datetime
+import threading
 from pathlib import Path
 from typing import Any, cast
 
@@ -10,6 +12,125 @@ from activetigger.db.manager import DatabaseManager
 from activetigger.db.projects import Codebook, ProjectsService
 from activetigger.functions import clean_regex
 
+# annotations of the other processes read again at each check
+# (transactions in progress, clocks of the servers)
+REFRESH_MARGIN = datetime.timedelta(seconds=5)
+
+
+def to_utc(timestamp: Any) -> pd.Timestamp:
+    """
+    Timestamp in UTC, the naive ones (SQLite) being in local time
+    """
+    if timestamp is None or pd.isna(timestamp):
+        return pd.NaT
+    return pd.Timestamp(
+        pd.Timestamp(timestamp).to_pydatetime().astimezone(datetime.timezone.utc)
+    )
+
+
+class SchemeState:
+    """
+    In-memory state of the last annotation of each element
+    for a scheme and a set of datasets
+
+    Rows are aligned on the index of the data, labels are categorical
+    and updated in place when an annotation is pushed
+    Timestamps are in UTC
+    """
+
+    columns = ["labels", "user", "timestamp", "comment"]
+    data: DataFrame
+    checked: pd.Timestamp  # last read of the db
+    lock: threading.Lock
+
+    def __init__(self, index: pd.Index, elements: list) -> None:
+        self.lock = threading.Lock()
+        self.checked = pd.Timestamp.now(tz="UTC")
+        df = pd.DataFrame(elements, columns=["id"] + self.columns).set_index("id")
+        df.index = [str(i) for i in df.index]
+        # in ns whatever the elements, to set any timestamp later
+        df["timestamp"] = pd.to_datetime(
+            [to_utc(i) for i in df["timestamp"]], utc=True
+        ).as_unit("ns")
+        # elements annotated outside of the data are kept at the end
+        full_index = index.append(df.index.difference(index))
+        self.data = df.reindex(full_index)
+        self.data["labels"] = self.data["labels"].astype("category")
+
+    def update(
+        self,
+        element_id: str,
+        label: str | None,
+        user: str,
+        timestamp: datetime.datetime,
+        comment: str | None,
+    ) -> None:
+        """
+        Set the last annotation of an element
+        """
+        with self.lock:
+            self.set(element_id, label, user, to_utc(timestamp), comment)
+
+    def merge(self, elements: list, checked: pd.Timestamp) -> None:
+        """
+        Set the annotations read from the db (written by any process)
+        unless the state has a more recent one
+        """
+        with self.lock:
+            for element_id, label, user, timestamp, comment in elements:
+                element_id, timestamp = str(element_id), to_utc(timestamp)
+                if element_id in self.data.index:
+                    current = self.data.at[element_id, "timestamp"]
+                    if pd.notna(current) and current > timestamp:
+                        continue
+                self.set(element_id, label, user, timestamp, comment)
+            self.checked = checked
+
+    def set(
+        self,
+        element_id: str,
+        label: str | None,
+        user: str,
+        timestamp: pd.Timestamp,
+        comment: str | None,
+    ) -> None:
+        labels = self.data["labels"]
+        if label is not None and label not in labels.cat.categories:
+            self.data["labels"] = labels.cat.add_categories([label])
+        if element_id not in self.data.index:
+            row = pd.DataFrame(
+                [[label, user, timestamp, comment]], columns=self.columns, index=[element_id]
+            ).astype(
+                {"labels": self.data["labels"].dtype, "timestamp": self.data["timestamp"].dtype}
+            )
+            self.data = pd.concat([self.data, row])
+            return None
+        self.data.loc[element_id, self.columns] = [label, user, timestamp, comment]
+
+    def labels(self) -> pd.Series:
+        """
+        Categorical labels aligned on the data
+        """
+        with self.lock:
+            return self.data["labels"].copy()
+
+    def frame(self) -> DataFrame:
+        """
+        All elements with their last annotation
+        """
+        with self.lock:
+            df = self.data.copy()
+        df["labels"] = df["labels"].astype(object)
+        return df
+
+    def annotated(self) -> DataFrame:
+        """
+        Elements with at least one annotation, most recent first
+        """
+        df = self.frame()
+        df = df[df["timestamp"].notna()]
+        return df.sort_values("timestamp", ascending=False)
+
 
 class Schemes:
     """
@@ -24,6 +145,8 @@ class Schemes:
     projects_service: ProjectsService
     content: DataFrame
     test: DataFrame | None
+    states: dict[tuple[str, tuple[str, ...]], SchemeState]
+    states_lock: threading.Lock
 
     def __init__(
         self,
@@ -31,12 +154,15 @@ class Schemes:
         path_content: Path,  # training data
         path_test: Path,  # test data
         db_manager: DatabaseManager,
+        states: dict | None = None,  # label states kept between loadings
     ) -> None:
         """
         Init empty
         """
         self.project_slug = project_slug
         self.projects_service = db_manager.projects_service
+        self.states = states if states is not None else {}
+        self.states_lock = threading.Lock()  # states read and updated by several requests
         self.content = pd.read_parquet(path_content)  # text + context
         if path_test.exists():
             self.test = pd.read_parquet(path_test)
@@ -70,28 +196,83 @@ class Schemes:
         if isinstance(kind, str):
             kind = [kind]
 
-        # get all elements from the db
-        # - last element for each id
-        # - for a specific scheme
-
-        results = self.projects_service.get_scheme_elements(
-            self.project_slug, scheme, kind
-        )
+        if complete and "test" in kind and len(kind) > 1:
+            return {"error": "Test data cannot be mixed with train data"}
 
-        df = pd.DataFrame(
-            results, columns=["id", "labels", "user", "timestamp", "comment"]
-        ).set_index("id")
-        df.index = [str(i) for i in df.index]
+        state = self.get_state(scheme, kind)
         if complete:  # all the elements
             if "test" in kind:
-                if len(kind) > 1:
-                    return {"error": "Test data cannot be mixed with train data"}
                 # case if the test, join the text data
-                t = self.test[["text"]].join(df)
+                t = self.test[["text"]].join(state.frame())
                 return t
             else:
-                return self.content.join(df, rsuffix="_content")
-        return df
+                return self.content.join(state.frame(), rsuffix="_content")
+        return state.annotated()
+
+    def get_state(self, scheme: str, kind: list[str]) -> SchemeState:
+        """
+        Get the label state of a scheme for datasets
+        Loaded from the db the first time
+        """
+        key = (scheme, tuple(sorted(kind)))
+        with self.states_lock:
+            if key not in self.states:
+                # last element for each id for a specific scheme
+                results = self.projects_service.get_scheme_elements(
+                    self.project_slug, scheme, kind
+                )
+                if "test" in kind and self.test is not None:
+                    index = self.test.index
+                else:
+                    index = self.content.index
+                self.states[key] = SchemeState(index, results)
+                return self.states[key]
+            state = self.states[key]
+
+        # annotations of the other processes (several workers, servers)
+        checked = pd.Timestamp.now(tz="UTC")
+        results = self.projects_service.get_scheme_elements(
+            self.project_slug,
+            scheme,
+            kind,
+            since=(state.checked - REFRESH_MARGIN).to_pydatetime().astimezone(),
+        )
+        state.merge(results, checked)
+        return state
+
+    def get_labels(self, scheme: str) -> pd.Series:
+        """
+        Current labels of the train data for a scheme
+        """
+        return self.get_state(scheme, ["train"]).labels()
+
+    def reset_states(self, scheme: str | None = None) -> None:
+        """
+        Drop label states to reload them from the db
+        """
+        with self.states_lock:
+            for key in list(self.states):
+                if scheme is None or key[0] == scheme:
+                    del self.states[key]
+
+    def update_states(
+        self,
+        element_id: str,
+        label: str | None,
+        scheme: str,
+        user: str,
+        dataset: str,
+        comment: str | None,
+        timestamp: datetime.datetime,
+    ) -> None:
+        """
+        Update loaded label states after an annotation
+        """
+        with self.states_lock:
+            states = list(self.states.items())
+        for (state_scheme, kind), state in states:
+            if state_scheme == scheme and dataset in kind:
+                state.update(element_id, label, user, timestamp, comment)
 
     def get_reconciliation_table(self, scheme: str):
         """
@@ -317,6 +498,7 @@ class Schemes:
             raise Exception("Cannot delete the last scheme")
 
         self.projects_service.delete_scheme(self.project_slug, name)
+        self.reset_states(name)
         return {"success": "scheme deleted"}
 
     def exists(self, name: str) -> bool:
@@ -349,7 +531,7 @@ class Schemes:
         i.e. : add empty label
         """
 
-        self.projects_service.add_annotation(
+        timestamp = self.projects_service.add_annotation(
             dataset="delete",
             user=user,
             project_slug=self.project_slug,
@@ -357,7 +539,8 @@ class Schemes:
             scheme=scheme,
             annotation=None,
         )
-        self.projects_service.add_annotation(
+        self.update_states(element_id, None, scheme, user, "delete", "", timestamp)
+        timestamp = self.projects_service.add_annotation(
             dataset=dataset,
             user=user,
             project_slug=self.project_slug,
@@ -365,6 +548,7 @@ class Schemes:
             scheme=scheme,
             annotation=None,
         )
+        self.update_states(element_id, None, scheme, user, dataset, "", timestamp)
 
         return True
 
@@ -405,7 +589,7 @@ class Schemes:
         # if (not element_id in self.content.index):
         #    return {"error":"element doesn't exist"}
 
-        self.projects_service.add_annotation(
+        timestamp = self.projects_service.add_annotation(
             dataset=mode,
             user=user,
             project_slug=self.project_slug,
@@ -414,6 +598,7 @@ class Schemes:
             annotation=label,
             comment=comment,
         )
+        self.update_states(element_id, label, scheme, user, mode, comment, timestamp)
         print(
             (
                 "push annotation",
@@ -1,14 +1,20 @@
 import logging
 import os
+import threading
+import time
 from pathlib import Path
 
 import yaml
 
 from activetigger.datamodels import UserInDBModel
+from activetigger.db import DBException
 from activetigger.db.manager import DatabaseManager
 from activetigger.db.models import Users as UserEntity
 from activetigger.functions import compare_to_hash, get_hash
 
+TOKEN_CACHE_TTL = 60  # seconds before checking a token again in the database
+TOKEN_CACHE_SIZE = 10000  # tokens kept at most
+
 
 class Users:
     """
@@ -16,6 +22,7 @@ class Users:
     """
 
     db_manager: DatabaseManager
+    tokens: dict[str, tuple[float, UserInDBModel]]
 
     def __init__(
         self,
@@ -26,6 +33,9 @@ class Users:
         Init users references
         """
         self.db_manager = db_manager
+        self.tokens = {}  # token -> (expiration, user)
+        self.tokens_lock = threading.Lock()
+        self.tokens_pruned = time.time()  # last removal of the expired tokens
 
         # add users if add_users.yaml exists
         if Path(file_users).exists():
@@ -52,6 +62,7 @@ class Users:
         Set user auth for a project
         """
         self.db_manager.projects_service.add_auth(project_slug, username, status)
+        self.invalidate_user(username)
         logging.info("Auth successfully to %s", username)
 
     def delete_auth(self, username: str, project_slug: str) -> None:
@@ -61,6 +72,7 @@ class Users:
         if username == "root":
             raise Exception("Can't delete root user auth")
         self.db_manager.projects_service.delete_auth(project_slug, username)
+        self.invalidate_user(username)
         logging.info("Auth of user %s deleted", username)
 
     def get_auth_projects(self, username: str) -> list:
@@ -134,6 +146,7 @@ class Users:
 
         # delete the user
         self.db_manager.users_service.delete_user(user_to_delete)
+        self.invalidate_user(user_to_delete)
 
         logging.info("User %s successfully deleted", user_to_delete)
 
@@ -141,9 +154,10 @@ class Users:
         """
         Get user from database
         """
-        if name not in self.existing_users():
-            raise Exception("Username doesn't exist")
-        user = self.db_manager.users_service.get_user(name)
+        try:
+            user = self.db_manager.users_service.get_user(name)
+        except DBException as e:
+            raise Exception("Username doesn't exist") from e
         return UserInDBModel(
             username=name, hashed_password=user.key, status=user.description
         )
@@ -179,4 +193,51 @@ class Users:
             raise Exception("Wrong password")
         hash_pwd = get_hash(password1)
         self.db_manager.users_service.change_password(username, hash_pwd.decode("utf8"))
+        self.invalidate_user(username)
         return None
+
+    def get_token_user(self, token: str) -> UserInDBModel | None:
+        """
+        Get the user of a token already verified, if not expired
+        """
+        with self.tokens_lock:
+            cached = self.tokens.get(token)
+            if cached is None:
+                return None
+            if cached[0] < time.time():
+                del self.tokens[token]
+                return None
+            return cached[1]
+
+    def cache_token_user(self, token: str, user: UserInDBModel, expiration: float) -> None:
+        """
+        Keep the user of a verified token
+        expiration: timestamp of the token expiration
+        """
+        now = time.time()
+        with self.tokens_lock:
+            # expired tokens removed regularly, the oldest one if the cache is full
+            if now - self.tokens_pruned > TOKEN_CACHE_TTL:
+                self.tokens = {t: cached for t, cached in self.tokens.items() if cached[0] >= now}
+                self.tokens_pruned = now
+            if len(self.tokens) >= TOKEN_CACHE_SIZE:
+                del self.tokens[next(iter(self.tokens))]
+            self.tokens[token] = (min(expiration, now + TOKEN_CACHE_TTL), user)
+
+    def invalidate_token(self, token: str) -> None:
+        """
+        Remove a token from the cache
+        """
+        with self.tokens_lock:
+            self.tokens.pop(token, None)
+
+    def invalidate_user(self, username: str) -> None:
+        """
+        Remove all the tokens of a user from the cache
+        """
+        with self.tokens_lock:
+            self.tokens = {
+                token: cached
+                for token, cached in self.tokens.items()
+                if cached[1].username != username
+            }
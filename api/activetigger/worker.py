@@ -0,0 +1,97 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Callable
+
+logger = logging.getLogger("server")
+
+# memory in GB of the models kept by each worker of the queue
+MODELS_CACHE_SIZE = 4
+
+
+class ModelsCache:
+    """
+    Models loaded by a worker, kept for the next jobs
+    - keyed by kind and model name/path
+    - least recently used models are evicted when the memory is over max_size (GB)
+    """
+
+    max_size: float
+    models: OrderedDict[tuple, tuple[Any, float]]
+
+    def __init__(self, max_size: float = MODELS_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.models = OrderedDict()
+
+    @property
+    def size(self) -> float:
+        return sum(size for _, size in self.models.values())
+
+    def get(
+        self,
+        key: tuple,
+        loader: Callable[[], Any],
+        sizer: Callable[[Any], float] | None = None,
+    ) -> Any:
+        """
+        Get a model from the cache, load it if needed
+        loader : function loading the model
+        sizer : function giving the memory used by the model in GB
+        """
+        if key in self.models:
+            self.models.move_to_end(key)
+            return self.models[key][0]
+
+        model = loader()
+        size = (sizer or get_size)(model)
+        if size > self.max_size:
+            # too large, not kept
+            return model
+        self.models[key] = (model, size)
+        while self.size > self.max_size:
+            evicted, _ = self.models.popitem(last=False)
+            logger.info(f"Evict {evicted} from the models cache")
+        return model
+
+    def clear(self) -> None:
+        self.models.clear()
+
+
+def get_size(model: Any) -> float:
+    """
+    Memory used by a model in GB
+    - torch modules : parameters and buffers
+    - others (tokenizers, pipelines) : counted as small
+    """
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors) / 1e9
+    return 0.1
+
+
+cache = ModelsCache()
+
+
+def get_cache() -> ModelsCache:
+    """
+    Models cache of the current process
+    """
+    return cache
+
+
+def init_worker(models_cache_size: float = MODELS_CACHE_SIZE) -> None:
+    """
+    Initialize a worker of the queue
+    - import the heavy libraries once (the functions of the jobs import them lazily)
+    - set the size of the models cache
+    """
+    global cache
+    cache = ModelsCache(models_cache_size)
+    # a failed warm up must not break the pool, the job will raise the error
+    try:
+        import sentence_transformers  # noqa: F401
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+
+        import activetigger.functions  # noqa: F401
+    except Exception as e:
+        logger.error(f"Error importing the libraries in the worker: {e}")
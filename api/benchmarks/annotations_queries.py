@@ -0,0 +1,150 @@
+"""
+Benchmark of the annotations queries with and without the composite indexes,
+and of the label states read from the current annotations table
+
+Usage (from api/): python -m benchmarks.annotations_queries [--rows 1000000]
+"""
+
+import argparse
+import datetime
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.db.models import Annotations, Base, CurrentAnnotations, Projects
+from activetigger.db.projects import ProjectsService
+
+PROJECT = "benchmark"
+SCHEMES = ["scheme_a", "scheme_b"]
+USERS = [f"user_{i}" for i in range(10)]
+LABELS = ["positive", "negative", "neutral"]
+INDEXES = [
+    "ix_annotations_element",
+    "ix_annotations_dataset",
+    "ix_annotations_user",
+    "ix_current_annotations_time",
+]
+START = datetime.datetime(2024, 1, 1)  # time of the first annotation, one per second
+
+
+def fill(path_db: Path, n_rows: int, n_elements: int, indexes: bool) -> sessionmaker:
+    """
+    Create a database with n_rows annotations
+    and the last one of each element in the current annotations
+    """
+    engine = create_engine(f"sqlite:///{path_db}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    now = datetime.datetime.now()
+    rng = random.Random(0)
+    current = {}
+
+    with Session.begin() as session:
+        if not indexes:
+            for name in INDEXES:
+                session.execute(text(f"DROP INDEX {name}"))
+        session.add(
+            Projects(
+                project_slug=PROJECT,
+                time_created=now,
+                time_modified=now,
+                parameters={},
+                user_id="root",
+            )
+        )
+
+    batch = 100_000
+    with Session.begin() as session:
+        for start in range(0, n_rows, batch):
+            rows = [
+                {
+                    "time": START + datetime.timedelta(seconds=i),
+                    "dataset": "train" if rng.random() < 0.9 else "test",
+                    "user_id": rng.choice(USERS),
+                    "project_id": PROJECT,
+                    "element_id": str(rng.randrange(n_elements)),
+                    "scheme_id": rng.choice(SCHEMES),
+                    "annotation": rng.choice(LABELS),
+                    "comment": "",
+                }
+                for i in range(start, min(start + batch, n_rows))
+            ]
+            session.execute(insert(Annotations), rows)
+            for row in rows:
+                current[(row["scheme_id"], row["dataset"], row["element_id"])] = row
+        current_rows = list(current.values())
+        for start in range(0, len(current_rows), batch):
+            session.execute(insert(CurrentAnnotations), current_rows[start : start + batch])
+    return Session
+
+
+def timeit(func, repeat: int) -> float:
+    """
+    Median time in ms
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(Session: sessionmaker, n_rows: int, n_elements: int, repeat: int) -> dict[str, float]:
+    service = ProjectsService(Session)
+    rng = random.Random(1)
+    # the annotations of the last minute, read to refresh a label state
+    since = START + datetime.timedelta(seconds=n_rows - 60)
+    return {
+        "get_scheme_elements": timeit(
+            lambda: service.get_scheme_elements(PROJECT, SCHEMES[0], ["train"]),
+            max(1, repeat // 5),
+        ),
+        "get_scheme_elements (since)": timeit(
+            lambda: service.get_scheme_elements(PROJECT, SCHEMES[0], ["train"], since=since),
+            repeat * 10,
+        ),
+        "get_annotations_by_element": timeit(
+            lambda: service.get_annotations_by_element(
+                PROJECT, SCHEMES[0], str(rng.randrange(n_elements))
+            ),
+            repeat * 10,
+        ),
+        "get_recent_annotations": timeit(
+            lambda: service.get_recent_annotations(PROJECT, "all", SCHEMES[0], 20), repeat
+        ),
+        "get_recent_annotations (user)": timeit(
+            lambda: service.get_recent_annotations(PROJECT, USERS[0], SCHEMES[0], 20), repeat
+        ),
+        "get_coding_users": timeit(lambda: service.get_coding_users(SCHEMES[0], PROJECT), repeat),
+        "get_table_annotations_users": timeit(
+            lambda: service.get_table_annotations_users(PROJECT, SCHEMES[0]), max(1, repeat // 5)
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--elements", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for indexes in [False, True]:
+            label = "with indexes" if indexes else "without indexes"
+            Session = fill(Path(tmp).joinpath(f"{label}.db"), args.rows, args.elements, indexes)
+            results[label] = run(Session, args.rows, args.elements, args.repeat)
+
+    print(f"{args.rows} annotations, median latency (ms)")
+    print(f"{'query':<32}{'without indexes':>18}{'with indexes':>16}")
+    for query in results["with indexes"]:
+        before = results["without indexes"][query]
+        after = results["with indexes"][query]
+        print(f"{query:<32}{before:>18.2f}{after:>16.2f}")
@@ -0,0 +1,86 @@
+"""
+Import time of the API, measured with python -X importtime
+
+Usage (from api/): python -m benchmarks.import_time [--module activetigger.api] [--top 15]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# libraries that must only be imported by the jobs using them
+HEAVY_MODULES = {
+    "cuml",
+    "datasets",
+    "fasttext",
+    "sentence_transformers",
+    "sklearn.manifold",
+    "spacy",
+    "torch",
+    "transformers",
+    "umap",
+}
+# root password of the temporary database
+ROOT_PASSWORD = "importtime"
+
+
+def measure(module: str) -> dict[str, int]:
+    """
+    Cumulative import time in us of each module imported by module
+    (run in a temporary directory, the API creates its files on import
+    and asks twice for the root password of the new database)
+    """
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).resolve().parents[1])}
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            input=f"{ROOT_PASSWORD}\n{ROOT_PASSWORD}\n",
+            capture_output=True,
+            text=True,
+            cwd=tmp,
+            env=env,
+            timeout=600,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def heavy_imports(times: dict[str, int]) -> set[str]:
+    """
+    Heavy libraries imported
+    """
+    return {
+        name
+        for name in times
+        if any(name == heavy or name.startswith(f"{heavy}.") for heavy in HEAVY_MODULES)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="activetigger.api")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = measure(args.module)
+    print(f"import {args.module}: {times[args.module] / 1e6:.2f} s")
+    for name, cumulative in sorted(times.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"{cumulative / 1e6:8.3f} s  {name}")
+    heavy = heavy_imports(times)
+    if heavy:
+        print(f"heavy libraries imported: {', '.join(sorted(heavy))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Load test of the annotation routes with concurrent annotators
+
+Each annotator gets the next element and annotates it in a loop, while
+other clients export the data of the project (slow requests). Reports the
+latency percentiles of each route, to compare with the routes run in the
+event loop (one slow request delays all the others).
+
+Usage (from api/, with a running server and an existing project and scheme):
+python -m benchmarks.load_bench --url http://localhost:5000 --username root
+    --password ... --project my_project --scheme default --annotators 20
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+
+
+class Recorder:
+    """
+    Latencies of the requests by route
+    """
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, route, **kwargs)
+        self.latencies[route].append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            self.errors[route] += 1
+        return response
+
+    def report(self) -> None:
+        print(f"{'route':<24}{'requests':>10}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for route, latencies in sorted(self.latencies.items()):
+            if len(latencies) < 2:
+                continue
+            q = statistics.quantiles(latencies, n=100)
+            print(
+                f"{route:<24}{len(latencies):>10}{self.errors[route]:>8}"
+                f"{q[49]:>10.1f}{q[94]:>10.1f}{q[98]:>10.1f}"
+            )
+        print("latencies in ms")
+
+
+async def annotator(
+    client: httpx.AsyncClient, recorder: Recorder, project: str, scheme: str, labels: list[str]
+) -> None:
+    """
+    Annotate elements until cancelled
+    """
+    params = {"project_slug": project}
+    while True:
+        r = await recorder.request(
+            client, "/elements/next", "POST", params=params, json={"scheme": scheme}
+        )
+        if r.status_code != 200:
+            await asyncio.sleep(0.1)
+            continue
+        annotation = {
+            "project_slug": project,
+            "scheme": scheme,
+            "element_id": r.json()["element_id"],
+            "label": random.choice(labels),
+        }
+        await recorder.request(client, "/annotation/add", "POST", params=params, json=annotation)
+
+
+async def exporter(client: httpx.AsyncClient, recorder: Recorder, project: str, scheme: str):
+    """
+    Export the annotations until cancelled
+    """
+    params = {"project_slug": project, "scheme": scheme, "format": "parquet"}
+    while True:
+        await recorder.request(client, "/export/data", "GET", params=params)
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+        r = await client.post("/token", data={"username": args.username, "password": args.password})
+        r.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+        # load the project before the measure
+        r = await client.get(f"/projects/{args.project}")
+        r.raise_for_status()
+        labels = r.json()["schemes"]["available"][args.scheme]["labels"]
+
+        recorder = Recorder()
+        tasks = [
+            asyncio.create_task(annotator(client, recorder, args.project, args.scheme, labels))
+            for _ in range(args.annotators)
+        ] + [
+            asyncio.create_task(exporter(client, recorder, args.project, args.scheme))
+            for _ in range(args.exporters)
+        ]
+        await asyncio.sleep(args.duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"{args.annotators} annotators, {args.exporters} exporters, {args.duration} s")
+    recorder.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--username", default="root")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--scheme", default="default")
+    parser.add_argument("--annotators", type=int, default=20)
+    parser.add_argument("--exporters", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=60)
+    asyncio.run(main(parser.parse_args()))
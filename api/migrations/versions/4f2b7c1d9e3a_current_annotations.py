@@ -0,0 +1,76 @@
+"""Current annotations
+
+Revision ID: 4f2b7c1d9e3a
+Revises: 85067581bdbd
+Create Date: 2025-02-10 09:12:41.503218
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4f2b7c1d9e3a"
+down_revision: Union[str, None] = "85067581bdbd"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "current_annotations",
+        sa.Column("project_id", sa.String(), nullable=False),
+        sa.Column("scheme_id", sa.Integer(), nullable=False),
+        sa.Column("dataset", sa.String(), nullable=False),
+        sa.Column("element_id", sa.String(), nullable=False),
+        sa.Column(
+            "time",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("annotation", sa.String(), nullable=True),
+        sa.Column("comment", sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["projects.project_slug"],
+            name=op.f("fk_current_annotations_project_id_projects"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["scheme_id"],
+            ["schemes.id"],
+            name=op.f("fk_current_annotations_scheme_id_schemes"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["users.id"], name=op.f("fk_current_annotations_user_id_users")
+        ),
+        sa.PrimaryKeyConstraint(
+            "project_id",
+            "scheme_id",
+            "dataset",
+            "element_id",
+            name=op.f("pk_current_annotations"),
+        ),
+    )
+
+    # fill with the last annotation of each element
+    op.execute(
+        """
+        INSERT INTO current_annotations
+            (project_id, scheme_id, dataset, element_id, time, user_id, annotation, comment)
+        SELECT project_id, scheme_id, dataset, element_id, time, user_id, annotation, comment
+        FROM annotations
+        WHERE id IN (
+            SELECT max(id) FROM annotations
+            GROUP BY project_id, scheme_id, dataset, element_id
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("current_annotations")
@@ -0,0 +1,43 @@
+"""Annotations indexes
+
+Revision ID: a83e5d20c6f1
+Revises: 4f2b7c1d9e3a
+Create Date: 2025-02-12 14:37:05.118342
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a83e5d20c6f1"
+down_revision: Union[str, None] = "4f2b7c1d9e3a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("annotations", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_annotations_element",
+            ["project_id", "scheme_id", "element_id", "time"],
+            unique=False,
+        )
+        batch_op.create_index(
+            "ix_annotations_dataset",
+            ["project_id", "scheme_id", "dataset", "time"],
+            unique=False,
+        )
+        batch_op.create_index(
+            "ix_annotations_user",
+            ["project_id", "scheme_id", "user_id", "time"],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("annotations", schema=None) as batch_op:
+        batch_op.drop_index("ix_annotations_user")
+        batch_op.drop_index("ix_annotations_dataset")
+        batch_op.drop_index("ix_annotations_element")
@@ -0,0 +1,31 @@
+"""Current annotations time index
+
+Revision ID: b4d9e2f7a1c3
+Revises: f3b8c1d2e5a7
+Create Date: 2025-03-10 10:12:44.503217
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b4d9e2f7a1c3"
+down_revision: Union[str, None] = "f3b8c1d2e5a7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("current_annotations", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_current_annotations_time",
+            ["project_id", "scheme_id", "dataset", "time"],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("current_annotations", schema=None) as batch_op:
+        batch_op.drop_index("ix_current_annotations_time")
@@ -0,0 +1,89 @@
+"""Portable references
+
+Usernames and scheme names were stored in integer columns referencing
+users.id and schemes.id, which only works with SQLite typing.
+
+Revision ID: c5d1e8a4b7f2
+Revises: a83e5d20c6f1
+Create Date: 2025-02-14 11:02:53.640127
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c5d1e8a4b7f2"
+down_revision: Union[str, None] = "a83e5d20c6f1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table: (foreign keys to drop, columns to convert to string)
+CHANGES = {
+    "projects": (["fk_projects_user_id_users"], ["user_id"]),
+    "schemes": (["fk_schemes_user_id_users"], ["user_id"]),
+    "annotations": (
+        ["fk_annotations_user_id_users", "fk_annotations_scheme_id_schemes"],
+        ["user_id", "scheme_id"],
+    ),
+    "current_annotations": (
+        ["fk_current_annotations_user_id_users", "fk_current_annotations_scheme_id_schemes"],
+        ["user_id", "scheme_id"],
+    ),
+    "auth": (["fk_auth_user_id_users"], ["user_id"]),
+    "logs": (["fk_logs_user_id_users", "fk_logs_project_id_projects"], ["user_id"]),
+    "generations": (["fk_generations_user_id_users"], ["user_id"]),
+    "features": (["fk_features_user_id_users"], ["user_id"]),
+    "models": (
+        ["fk_models_user_id_users", "fk_models_scheme_id_schemes"],
+        ["user_id", "scheme_id"],
+    ),
+}
+
+# foreign keys restored by the downgrade: (name, column, referred table, referred column)
+FOREIGN_KEYS = {
+    "fk_projects_user_id_users": ("user_id", "users", "id"),
+    "fk_schemes_user_id_users": ("user_id", "users", "id"),
+    "fk_annotations_user_id_users": ("user_id", "users", "id"),
+    "fk_annotations_scheme_id_schemes": ("scheme_id", "schemes", "id"),
+    "fk_current_annotations_user_id_users": ("user_id", "users", "id"),
+    "fk_current_annotations_scheme_id_schemes": ("scheme_id", "schemes", "id"),
+    "fk_auth_user_id_users": ("user_id", "users", "id"),
+    "fk_logs_user_id_users": ("user_id", "users", "id"),
+    "fk_logs_project_id_projects": ("project_id", "projects", "project_slug"),
+    "fk_generations_user_id_users": ("user_id", "users", "id"),
+    "fk_features_user_id_users": ("user_id", "users", "id"),
+    "fk_models_user_id_users": ("user_id", "users", "id"),
+    "fk_models_scheme_id_schemes": ("scheme_id", "schemes", "id"),
+}
+
+
+def upgrade() -> None:
+    for table, (foreign_keys, columns) in CHANGES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name in foreign_keys:
+                batch_op.drop_constraint(name, type_="foreignkey")
+            for column in columns:
+                batch_op.alter_column(
+                    column,
+                    existing_type=sa.Integer(),
+                    type_=sa.String(),
+                    existing_nullable=False,
+                )
+
+
+def downgrade() -> None:
+    for table, (foreign_keys, columns) in CHANGES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.alter_column(
+                    column,
+                    existing_type=sa.String(),
+                    type_=sa.Integer(),
+                    existing_nullable=False,
+                )
+            for name in foreign_keys:
+                column, referred_table, referred_column = FOREIGN_KEYS[name]
+                batch_op.create_foreign_key(name, referred_table, [column], [referred_column])
@@ -0,0 +1,28 @@
+"""Jobs owner
+
+Revision ID: d7a3c9e1f5b2
+Revises: b4d9e2f7a1c3
+Create Date: 2025-03-10 15:42:08.196534
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d7a3c9e1f5b2"
+down_revision: Union[str, None] = "b4d9e2f7a1c3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("jobs", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("owner", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("jobs", schema=None) as batch_op:
+        batch_op.drop_column("owner")
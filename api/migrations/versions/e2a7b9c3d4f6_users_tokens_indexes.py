@@ -0,0 +1,33 @@
+"""Users and tokens indexes
+
+Revision ID: e2a7b9c3d4f6
+Revises: c5d1e8a4b7f2
+Create Date: 2025-02-17 10:21:36.284915
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2a7b9c3d4f6"
+down_revision: Union[str, None] = "c5d1e8a4b7f2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_users_user"), ["user"], unique=False)
+
+    with op.batch_alter_table("tokens", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_tokens_token"), ["token"], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("tokens", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_tokens_token"))
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_users_user"))
@@ -0,0 +1,144 @@
+import os
+import shutil
+import socket
+import subprocess
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.datamodels import GenerationCreationModel
+from activetigger.db.generations import GenerationsService
+from activetigger.db.models import Base
+from activetigger.db.projects import ProjectsService
+from activetigger.db.users import UsersService
+
+
+def find_postgres() -> Path | None:
+    """
+    Directory of the PostgreSQL binaries, from PG_BIN or the PATH
+    """
+    if "PG_BIN" in os.environ:
+        return Path(os.environ["PG_BIN"])
+    pg_ctl = shutil.which("pg_ctl")
+    return Path(pg_ctl).parent if pg_ctl else None
+
+
+@pytest.fixture(scope="module")
+def postgres(tmp_path_factory):
+    """
+    Start a local PostgreSQL server for the tests
+    """
+    pytest.importorskip("psycopg")
+    path_bin = find_postgres()
+    if path_bin is None:
+        pytest.skip("PostgreSQL binaries not available")
+
+    path_data = tmp_path_factory.mktemp("postgres")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    subprocess.run(
+        [path_bin / "initdb", "-D", path_data, "-U", "activetigger", "--auth=trust"],
+        check=True,
+        capture_output=True,
+    )
+    subprocess.run(
+        [
+            path_bin / "pg_ctl",
+            "-D",
+            path_data,
+            "-o",
+            f"-p {port} -k {path_data} -c listen_addresses=127.0.0.1",
+            "-l",
+            path_data / "postgres.log",
+            "-w",
+            "start",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    yield f"postgresql+psycopg://activetigger@127.0.0.1:{port}/postgres"
+    subprocess.run(
+        [path_bin / "pg_ctl", "-D", path_data, "-m", "fast", "stop"], capture_output=True
+    )
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def get_session(request):
+    if request.param == "sqlite":
+        url = "sqlite://"
+    else:
+        url = request.getfixturevalue("postgres")
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_services(get_session: sessionmaker):
+    users = UsersService(get_session)
+    projects = ProjectsService(get_session)
+    generations = GenerationsService(get_session)
+
+    users.add_user("test_user", "hash", "manager", "root")
+    users.add_user("other_user", "hash", "annotator", "test_user")
+    assert users.get_user("test_user").description == "manager"
+    assert set(users.get_users_created_by("all")) == {"test_user", "other_user"}
+
+    projects.add_project("test_project", {"language": "en"}, "test_user")
+    projects.add_auth("test_project", "test_user", "manager")
+    projects.add_auth("test_project", "other_user", "annotator")
+    assert len(projects.get_user_projects("test_user")) == 1
+    projects.add_log("test_user", "start", "test_project", "not implemented")
+    projects.add_log("test_user", "add user", "all", "not implemented")
+    assert len(projects.get_logs("all", "all", 10)) == 2
+    assert projects.get_recent_projects(10) == ["test_project"]
+
+    projects.add_scheme("test_project", "test_scheme", ["a", "b"], "multiclass", "test_user")
+    assert projects.available_schemes("test_project")[0]["labels"] == ["a", "b"]
+
+    projects.add_annotation("train", "test_user", "test_project", "1", "test_scheme", "a")
+    projects.add_annotation("train", "other_user", "test_project", "1", "test_scheme", "b")
+    projects.add_annotation("train", "test_user", "test_project", "2", "test_scheme", "a")
+    projects.add_annotation("train", "test_user", "test_project", "1", "test_scheme", "b")
+
+    elements = projects.get_scheme_elements("test_project", "test_scheme", ["train"])
+    assert {e[0]: e[1] for e in elements} == {"1": "b", "2": "a"}
+    # annotations since a time (written by other processes)
+    time = projects.add_annotation("train", "other_user", "test_project", "3", "test_scheme", "a")
+    assert time.tzinfo is not None
+    elements = projects.get_scheme_elements("test_project", "test_scheme", ["train"], since=time)
+    assert [e[0] for e in elements] == ["3"]
+    assert projects.get_recent_annotations("test_project", "all", "test_scheme", 10) == [
+        "3",
+        "1",
+        "2",
+    ]
+    assert set(projects.get_coding_users("test_scheme", "test_project")) == {
+        "test_user",
+        "other_user",
+    }
+    assert set(projects.get_distinct_users("test_project", 600)) == {"test_user", "other_user"}
+    table = projects.get_table_annotations_users("test_project", "test_scheme")
+    assert sorted((row[0], row[2], row[1]) for row in table) == [
+        ("1", "other_user", "b"),
+        ("1", "test_user", "b"),
+        ("2", "test_user", "a"),
+        ("3", "other_user", "a"),
+    ]
+
+    model_id = generations.add_project_gen_model(
+        "test_project", GenerationCreationModel(slug="gpt-4o", api="OpenAI", name="gpt")
+    )
+    generations.add_generated("test_user", "test_project", "1", model_id, "prompt", "answer")
+    assert generations.get_generated("test_project", "test_user")[0][4] == "gpt"
+
+    projects.delete_project("test_project")
+    assert projects.existing_projects() == []
+    assert projects.get_logs("all", "all", 10)[0]["project"] == "all"
+
+    users.delete_user("other_user")
+    assert "other_user" not in users.get_users_created_by("all")
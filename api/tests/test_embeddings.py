@@ -0,0 +1,58 @@
+import numpy as np
+
+import activetigger.embeddings
+from activetigger.embeddings import EmbeddingsCache
+
+
+def test_embeddings_cache(tmp_path, monkeypatch):
+    # last access updated at each read
+    monkeypatch.setattr(activetigger.embeddings, "ACCESS_INTERVAL", -1)
+    cache = EmbeddingsCache(tmp_path / "embeddings.db", max_size=1e-6)  # 1 kB
+    keys = [cache.key(t) for t in ["first text", "second  text", "third text"]]
+    # the same text after normalization
+    assert cache.key(" second text\n") == keys[1]
+
+    vectors = np.arange(3 * 64, dtype=np.float32).reshape(3, 64)  # 256 B each
+    cache.add("model", keys, vectors)
+    found = cache.get("model", [keys[1], "unknown"])
+    assert list(found) == [keys[1]]
+    np.testing.assert_array_equal(found[keys[1]], vectors[1])
+    assert cache.get("other model", keys) == {}
+
+    # the least recently used are evicted over the limit
+    cache.get("model", [keys[0]])
+    new = np.ones((2, 64), dtype=np.float32)
+    cache.add("model", ["a", "b"], new)
+    assert cache.size <= 1e-6
+    assert set(cache.get("model", keys + ["a", "b"])) == {keys[0], "a", "b"}
+
+
+def test_embeddings_cache_total(tmp_path):
+    cache = EmbeddingsCache(tmp_path / "embeddings.db")
+    vectors = np.ones((2, 64), dtype=np.float32)
+    cache.add("model", ["a", "b"], vectors)
+    # already in the cache, not counted twice
+    cache.add("model", ["b", "c"], vectors)
+    assert cache.size == 3 * 256 / 1e9
+
+    # the total follows the evictions, and is shared with the other processes
+    small = EmbeddingsCache(tmp_path / "embeddings.db", max_size=600 / 1e9)
+    small.evict()
+    assert small.size == cache.size == 512 / 1e9
+    with cache.connect() as con:
+        assert con.execute("SELECT SUM(size) FROM embeddings").fetchone()[0] == 512
+
+
+def test_embeddings_cache_access(tmp_path):
+    cache = EmbeddingsCache(tmp_path / "embeddings.db")
+    cache.add("model", ["a", "b"], np.ones((2, 4), dtype=np.float32))
+    with cache.connect() as con:
+        con.execute("UPDATE embeddings SET last_access = 0 WHERE key = 'a'")
+        recent = con.execute("SELECT last_access FROM embeddings WHERE key = 'b'").fetchone()[0]
+
+    # only the old last accesses are written
+    assert set(cache.get("model", ["a", "b"])) == {"a", "b"}
+    with cache.connect() as con:
+        access = dict(con.execute("SELECT key, last_access FROM embeddings").fetchall())
+    assert access["a"] > 0
+    assert access["b"] == recent
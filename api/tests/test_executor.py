@@ -0,0 +1,74 @@
+import asyncio
+import inspect
+import threading
+import time
+from types import SimpleNamespace
+
+from activetigger.executor import RequestsExecutor
+
+
+def test_executor_locks():
+    executor = RequestsExecutor(threads=4)
+    running: dict[str, int] = {}
+    overlaps = []
+    lock = threading.Lock()
+
+    @executor.exclusive
+    def route(project, duration: float = 0.1) -> str:
+        with lock:
+            running[project.name] = running.get(project.name, 0) + 1
+            overlaps.append(running[project.name])
+        time.sleep(duration)
+        with lock:
+            running[project.name] -= 1
+        return threading.current_thread().name
+
+    async def main():
+        start = time.perf_counter()
+        loop_thread = threading.current_thread().name
+        requests = [route(project=SimpleNamespace(name=p)) for p in ["a", "a", "b", "b"]]
+        threads = await asyncio.gather(*requests)
+        return time.perf_counter() - start, loop_thread, threads
+
+    try:
+        duration, loop_thread, threads = asyncio.run(main())
+    finally:
+        executor.close()
+
+    # out of the loop, one request at a time per project, projects in parallel
+    assert loop_thread not in threads
+    assert max(overlaps) == 1
+    assert duration < 0.35
+    # the routes keep their signature for the api
+    assert list(inspect.signature(route).parameters) == ["project", "duration"]
+    # no lock kept for the projects without requests
+    assert executor.locks == {}
+
+
+def test_executor_reads_concurrent():
+    executor = RequestsExecutor(threads=4)
+
+    @executor.blocking
+    def export(project) -> None:
+        time.sleep(0.2)
+
+    @executor.exclusive
+    def annotate(project) -> float:
+        return time.perf_counter()
+
+    async def main():
+        project = SimpleNamespace(name="a")
+        start = time.perf_counter()
+        export_task = asyncio.create_task(export(project=project))
+        await asyncio.sleep(0.01)
+        annotated = await annotate(project=project)
+        await export_task
+        return annotated - start
+
+    try:
+        duration = asyncio.run(main())
+    finally:
+        executor.close()
+
+    # a slow reading request doesn't delay the changes of the project
+    assert duration < 0.1
@@ -0,0 +1,217 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from activetigger.features import Features
+
+
+class ProjectsServiceMock:
+    def __init__(self):
+        self.features = {}
+
+    def add_feature(self, project, kind, name, parameters, user, data):
+        self.features[name] = SimpleNamespace(kind=kind, parameters=parameters, data=data)
+
+    def get_feature(self, project, name):
+        return self.features.get(name)
+
+    def delete_feature(self, project, name):
+        del self.features[name]
+
+
+def test_features_files(tmp_path):
+    index = pd.Index(["a", "b", "c"], name="id")
+    # project saved in one file by a previous version
+    pd.DataFrame({"old__0": [1.0, 2.0, 3.0]}, index=index).to_parquet(tmp_path / "features.parquet")
+    features = Features(
+        "project",
+        tmp_path / "features.parquet",
+        tmp_path / "data_all.parquet",
+        tmp_path,
+        None,
+        [],
+        SimpleNamespace(projects_service=ProjectsServiceMock()),
+        "en",
+    )
+    assert features.map == {"old": ["old__0"]}
+    assert pd.read_parquet(tmp_path / "features.parquet").columns.empty
+
+    sbert = pd.DataFrame(
+        [[0.5, 0.6], [0.1, 0.2], [0.3, 0.4]], index=pd.Index(["c", "a", "b"], name="id")
+    )
+    features.add("sbert", "sbert", "user", {}, sbert)
+    features.add("regex_[a/b]_by_user", "regex", "user", {}, pd.Series([1, 0, 1], index=index))
+    assert len(list((tmp_path / "features").glob("*.parquet"))) == 2
+    assert len(list((tmp_path / "features").glob("*.npy"))) == 1
+
+    # only the requested features, aligned on the rows
+    data = features.get(["sbert", "regex_[a/b]_by_user"])
+    assert list(data.columns) == ["sbert__0", "sbert__1", "regex_[a/b]_by_user__0"]
+    assert list(data.index) == ["a", "b", "c"]
+    assert data.loc["b", "sbert__1"] == pytest.approx(0.4)
+
+    # dense features as a memory-mapped float32 matrix
+    matrix = features.get_matrix("sbert")
+    assert isinstance(matrix, np.memmap)
+    assert matrix.dtype == np.float32
+    assert matrix.shape == (3, 2)
+    assert np.shares_memory(features.get("sbert").to_numpy(), matrix)
+    assert list(features.get(["ghost", "sbert"]).columns) == ["sbert__0", "sbert__1"]
+
+    # document-term matrix kept sparse
+    dtm = pd.DataFrame.sparse.from_spmatrix(
+        sparse.csr_matrix([[0, 2], [1, 0], [0, 0]]),
+        index=pd.Index(["b", "c", "a"], name="id"),
+        columns=["word", "other"],
+    )
+    features.add("dfm", "dfm", "user", {}, dtm)
+    assert len(list((tmp_path / "features").glob("*.npz"))) == 1
+    data = features.get("dfm")
+    assert hasattr(data, "sparse")
+    assert data.sparse.to_coo().nnz == 2
+    assert data.loc["b", "dfm__other"] == 2
+    # densified for the export files
+    export = features.get(["dfm", "sbert"], dense=True)
+    export.to_parquet(tmp_path / "export.parquet")
+    assert pd.read_parquet(tmp_path / "export.parquet").loc["b", "dfm__other"] == 2
+
+    features.delete("sbert")
+    assert set(features.map) == {"old", "regex_[a/b]_by_user", "dfm"}
+    assert list((tmp_path / "features").glob("*.npy")) == []
+
+    # the name is tested again against the files, updated by another process
+    other = Features(
+        "project",
+        tmp_path / "features.parquet",
+        tmp_path / "data_all.parquet",
+        tmp_path,
+        None,
+        [],
+        SimpleNamespace(projects_service=ProjectsServiceMock()),
+        "en",
+    )
+    other.add("sbert", "sbert", "user", {}, sbert)
+    assert "error" in features.add("sbert", "sbert", "user", {}, sbert)
+
+
+def test_features_migrate(tmp_path):
+    index = pd.Index(["a", "b"], name="id")
+    pd.DataFrame(
+        {"emb__0": [0.1, 0.2], "emb__1": [0.3, 0.4], "dfm__word": [0, 3], "old__0": [1, 2]},
+        index=index,
+    ).to_parquet(tmp_path / "features.parquet")
+    service = ProjectsServiceMock()
+    service.add_feature("project", "sbert", "emb", {}, "user", "[]")
+    service.add_feature("project", "dfm", "dfm", {}, "user", "[]")
+    features = Features(
+        "project",
+        tmp_path / "features.parquet",
+        tmp_path / "data_all.parquet",
+        tmp_path,
+        None,
+        [],
+        SimpleNamespace(projects_service=service),
+        "en",
+    )
+    # in the format of their kind
+    assert isinstance(features.get_matrix("emb"), np.memmap)
+    assert features.get("dfm").sparse.to_coo().nnz == 1
+    assert features.get("old").loc["b", "old__0"] == 2
+    assert features.map == {"emb": ["emb__0", "emb__1"], "dfm": ["dfm__word"], "old": ["old__0"]}
+
+
+def test_features_update(tmp_path):
+    index = pd.Index(["a", "b"], name="id")
+    pd.DataFrame(index=index).to_parquet(tmp_path / "features.parquet")
+    features = Features(
+        "project",
+        tmp_path / "features.parquet",
+        tmp_path / "data_all.parquet",
+        tmp_path,
+        None,
+        [],
+        SimpleNamespace(projects_service=ProjectsServiceMock()),
+        "en",
+    )
+    texts = pd.Series(["a text", "other"], index=index)
+    features.compute(texts, "regex", "regex", {"value": "text"}, "user")
+    features.add("sbert", "sbert", "user", {}, pd.DataFrame([[1.0], [2.0]], index=index))
+
+    # rows added to the project
+    texts["c"] = "new text"
+    features.add_rows(texts.index)
+    assert list(features.get_missing("sbert")) == ["c"]
+    data = features.get("sbert")
+    assert list(data.index) == ["a", "b", "c"]
+    assert data["sbert__0"].isna().tolist() == [False, False, True]
+
+    # a feature computed before the rows were added, completed later
+    features.add("fasttext", "fasttext", "user", {}, pd.DataFrame([[4.0], [5.0]], index=index))
+    assert list(features.get_missing("fasttext")) == ["c"]
+
+    # only the missing rows are computed
+    name = "regex_[text]_by_user"
+    assert features.update(name, texts, "user") == {"success": "feature updated"}
+    assert features.get(name)[f"{name}__0"].tolist() == [True, False, True]
+    features.append("sbert", pd.DataFrame([[3.0]], index=pd.Index(["c"], name="id")))
+    assert features.get_matrix("sbert")[:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert len(features.get_missing("sbert")) == 0
+
+
+def test_features_append_predictions(tmp_path):
+    from activetigger.project import Project
+
+    index = pd.Index(["a", "b"], name="id")
+    pd.DataFrame(index=index).to_parquet(tmp_path / "features.parquet")
+    features = Features(
+        "project",
+        tmp_path / "features.parquet",
+        tmp_path / "data_all.parquet",
+        tmp_path,
+        None,
+        [],
+        SimpleNamespace(projects_service=ProjectsServiceMock()),
+        "en",
+    )
+    # probabilities of a BERT model, minus the last label, then rows added
+    features.add(
+        "predict_model",
+        "prediction",
+        "system",
+        {"model": "model"},
+        pd.DataFrame({"x": [0.9, 0.2]}, index=index),
+    )
+    features.add_rows(pd.Index(["a", "b", "c"], name="id"))
+
+    # prediction on the missing rows, as written by the job
+    path = tmp_path / "predict_train_missing.parquet"
+    pred = pd.DataFrame({"x": [0.3], "y": [0.7]}, index=pd.Index(["c"], name="id"))
+    pred["entropy"] = 0.6
+    pred["prediction"] = "y"
+    pred.to_parquet(path)
+    future: Future = Future()
+    future.set_result({"success": True, "path": str(path)})
+
+    project = Project.__new__(Project)
+    project.name = "project"
+    project.features = features
+    project.errors = []
+    project.completed = set()
+    project.computing = [SimpleNamespace(kind="bert", unique_id="job", model_name="model")]
+    project.queue = SimpleNamespace(
+        current={"job": {"future": future}},
+        get_completed=lambda project_slug: {"job"},
+        delete=lambda unique_id: None,
+    )
+    project.bertmodels = SimpleNamespace(add=lambda computation: None)
+    project.update_processes()
+
+    assert project.errors == []
+    assert project.computing == []
+    data = features.get("predict_model")
+    assert list(data.columns) == ["predict_model__x"]
+    assert data["predict_model__x"].tolist() == pytest.approx([0.9, 0.2, 0.3])
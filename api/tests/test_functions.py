@@ -1,8 +1,14 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+
 def test_get_root_pwd(monkeypatch, capsys):
     """
     Test the get_root_pwd
     """
-    from functions import get_root_pwd  # Import the function from your module
+    from activetigger.functions import get_root_pwd  # Import the function from your module
 
     inputs = iter(["password123", "password123"])
     monkeypatch.setattr("builtins.input", lambda _: next(inputs))
@@ -17,3 +23,32 @@ def test_get_root_pwd(monkeypatch, capsys):
     assert root_password == "password123"
     assert "Password confirmed successfully." in captured.out
     assert "Creating the entry in the database..." in captured.out
+
+
+@pytest.fixture
+def dtm():
+    """
+    Sparse document-term matrix (dfm feature)
+    """
+    rng = np.random.default_rng(0)
+    matrix = sparse.random(30, 8, density=0.3, format="csr", random_state=rng)
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=[f"e{i}" for i in range(30)])
+
+
+def test_compute_tsne_sparse(dtm):
+    from activetigger.functions import compute_tsne
+
+    params = {"n_components": 2, "learning_rate": "auto", "init": "pca", "perplexity": 5}
+    projection = compute_tsne(dtm, params)
+    assert projection.shape == (30, 2)
+    assert list(projection.index) == list(dtm.index)
+
+
+def test_compute_umap_sparse(dtm):
+    pytest.importorskip("umap")
+    from activetigger.functions import compute_umap
+
+    params = {"n_components": 2, "n_neighbors": 5, "min_dist": 0.1, "metric": "cosine"}
+    projection = compute_umap(dtm, params)
+    assert projection.shape == (30, 2)
+    assert projection.notna().all().all()
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.import_time import heavy_imports, measure
+
+
+@pytest.mark.parametrize(
+    "module", ["activetigger.functions", "activetigger.features", "activetigger.models"]
+)
+def test_import_is_light(module):
+    # regression guard : the ML libraries are only imported by the jobs
+    # (the whole API, which needs the server runtime, is measured by the benchmark)
+    assert heavy_imports(measure(module)) == set()
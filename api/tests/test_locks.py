@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from activetigger.locks import RWLock, atomic_write
+
+
+def test_rwlock():
+    lock = RWLock()
+    events = []
+
+    def read(i):
+        with lock.read():
+            events.append(f"read {i}")
+            time.sleep(0.1)
+            events.append(f"end read {i}")
+
+    def write():
+        with lock.write():
+            # reentrant for the writer
+            with lock.read(), lock.write():
+                events.append("write")
+
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(2)]
+    for t in readers:
+        t.start()
+    time.sleep(0.02)
+    writer = threading.Thread(target=write)
+    writer.start()
+    for t in readers + [writer]:
+        t.join(timeout=5)
+
+    # the readers run together, the writer waits for them
+    assert events[:2] == ["read 0", "read 1"] or events[:2] == ["read 1", "read 0"]
+    assert events[-1] == "write"
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("old")
+    with pytest.raises(ValueError):
+        with atomic_write(path) as tmp:
+            tmp.write_text("partial")
+            raise ValueError("failed")
+    # the file is unchanged and the temporary file removed
+    assert path.read_text() == "old"
+    assert list(tmp_path.iterdir()) == [path]
+
+    with atomic_write(path) as tmp:
+        tmp.write_text("new")
+    assert path.read_text() == "new"
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,48 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.db.models import Base
+from activetigger.db.projects import ProjectsService
+from activetigger.logs import LogsWriter
+
+
+def get_service(tmp_path) -> ProjectsService:
+    engine = create_engine(f"sqlite:///{tmp_path.joinpath('test.db')}")
+    Base.metadata.create_all(engine)
+    return ProjectsService(sessionmaker(bind=engine))
+
+
+def test_logs_without_task(tmp_path):
+    service = get_service(tmp_path)
+    writer = LogsWriter(service)
+    writer.add("test_user", "action", "test_project", "not implemented")
+    assert len(service.get_logs("all", "all", 10)) == 1
+
+
+def test_logs_buffered(tmp_path):
+    service = get_service(tmp_path)
+
+    async def scenario():
+        writer = LogsWriter(service, flush_interval=60000, flush_size=3)
+        writer.start()
+        writer.add("test_user", "first", "test_project", "not implemented")
+        writer.add("test_user", "second", "test_project", "not implemented")
+        await asyncio.sleep(0.05)
+        assert len(service.get_logs("all", "all", 10)) == 0
+
+        # the buffer is full, flushed by the task
+        writer.add("test_user", "third", "test_project", "not implemented")
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(service.get_logs("all", "all", 10)) == 3:
+                break
+        assert len(service.get_logs("all", "all", 10)) == 3
+
+        # remaining logs written when stopping
+        writer.add("test_user", "fourth", "test_project", "not implemented")
+        await writer.stop()
+        assert len(service.get_logs("all", "all", 10)) == 4
+
+    asyncio.run(scenario())
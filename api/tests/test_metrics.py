@@ -0,0 +1,28 @@
+from activetigger.metrics import Metrics
+
+
+def test_metrics_export():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.start()
+    metrics.end("GET", "/elements/next", 200, 0.05)
+    metrics.start()
+    metrics.end("GET", "/elements/next", 500, 0.5)
+    metrics.start()
+
+    queue_state = {
+        "a": {"state": "running", "exception": None, "kind": "bert"},
+        "b": {"state": "pending", "exception": None, "kind": "feature"},
+    }
+    text = metrics.export(queue_state, nb_workers=2)
+    lines = text.splitlines()
+
+    assert "activetigger_requests_in_flight 1" in lines
+    assert (
+        'activetigger_requests_total{method="GET",route="/elements/next",status="500"} 1' in lines
+    )
+    assert 'activetigger_request_errors_total{method="GET",route="/elements/next"} 1' in lines
+    labels = 'method="GET",route="/elements/next"'
+    assert f'activetigger_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in lines
+    assert f'activetigger_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert "activetigger_queue_depth 1" in lines
+    assert "activetigger_queue_utilization 0.5" in lines
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.db.jobs import JobsService
+from activetigger.db.models import Base
+from activetigger.orchestrator import Orchestrator
+from activetigger.queue import get_owner
+
+
+def loaded_project(memory: int, last_access: float, computing: list | None = None):
+    return SimpleNamespace(
+        get_memory=lambda: memory, last_access=last_access, computing=computing or []
+    )
+
+
+def test_evict_projects():
+    orchestrator = Orchestrator.__new__(Orchestrator)
+    orchestrator.projects_lock = threading.RLock()
+    orchestrator.projects_memory = 1  # GB
+    orchestrator.schemes_states = {"old": {}, "recent": {}}
+    orchestrator.projects = {
+        "old_running": loaded_project(400_000_000, 1, computing=["job"]),
+        "old": loaded_project(100_000_000, 2),
+        "large": loaded_project(600_000_000, 3),
+        "recent": loaded_project(100_000_000, 4),
+    }
+
+    orchestrator.evict_projects(keep="recent")
+
+    # least recently used first, until the memory is under the limit,
+    # without unloading the project with jobs in progress
+    assert list(orchestrator.projects) == ["old_running", "recent"]
+    # the label states survive the eviction
+    assert list(orchestrator.schemes_states) == ["old", "recent"]
+
+
+def test_get_project_loaded_once(monkeypatch):
+    orchestrator = Orchestrator.__new__(Orchestrator)
+    orchestrator.projects = {}
+    orchestrator.projects_lock = threading.RLock()
+    orchestrator.projects_loading = {}
+    orchestrator.projects_memory = 1
+    loadings = []
+
+    def start_project(project_slug):
+        loadings.append(project_slug)
+        time.sleep(0.2)
+        orchestrator.projects[project_slug] = loaded_project(1, time.time())
+        return {"success": "Project loaded"}
+
+    monkeypatch.setattr(orchestrator, "start_project", start_project)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(orchestrator.get_project, ["project"] * 4))
+
+    # the concurrent requests wait for the same loading
+    assert loadings == ["project"]
+    assert all(r is results[0] for r in results)
+    assert orchestrator.projects_loading == {}
+
+
+def test_recover_jobs(tmp_path):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    jobs_service = JobsService(sessionmaker(bind=engine))
+    deleted = []
+    orchestrator = Orchestrator.__new__(Orchestrator)
+    orchestrator.db_manager = SimpleNamespace(
+        jobs_service=jobs_service,
+        projects_service=SimpleNamespace(delete_model=lambda p, name: deleted.append(name)),
+    )
+    host, pid, _ = get_owner().rsplit(":", 2)
+    gone = f"{host}:{pid}:0.0"  # previous server process
+    (tmp_path / "running").mkdir()
+    jobs_service.add_job(
+        "running", "training", "p", "u", {"name": "running"}, str(tmp_path / "running"), gone
+    )
+    jobs_service.update_job("running", "running")
+    jobs_service.add_job("pending", "training", "p", "u", {"name": "pending"}, None, gone)
+    jobs_service.add_job("alive", "training", "p", "u", {"name": "alive"}, None, get_owner())
+    jobs_service.add_job(
+        "other", "training", "p", "u", {"name": "other"}, None, f"other-{host}:1:0.0"
+    )
+
+    orchestrator.recover_jobs()
+
+    # only the jobs of the processes gone, with their models
+    status = {job.id: job.status for job in jobs_service.get_jobs()}
+    assert status == {
+        "running": "orphaned",
+        "pending": "orphaned",
+        "alive": "pending",
+        "other": "pending",
+    }
+    assert sorted(deleted) == ["pending", "running"]
+    assert not (tmp_path / "running").exists()
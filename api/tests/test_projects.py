@@ -4,7 +4,13 @@ import pytest
 from sqlalchemy import create_engine, select
 from sqlalchemy.orm import Session, sessionmaker
 
-from activetigger.db.models import Base, Projects, Schemes
+from activetigger.db.models import (
+    Annotations,
+    Base,
+    CurrentAnnotations,
+    Projects,
+    Schemes,
+)
 from activetigger.db.projects import ProjectsService
 
 
@@ -52,3 +58,32 @@ def test_delete_project(dataset: sessionmaker[Session]):
 
     assert len(session.scalars(select(Projects)).all()) == 0
     assert len(session.scalars(select(Schemes)).all()) == 0
+
+
+def test_scheme_elements_last_annotation(dataset: sessionmaker[Session]):
+    service = ProjectsService(dataset)
+    service.add_annotation("train", "test_user", "test_project", "1", "test_scheme", "a")
+    service.add_annotations(
+        "train",
+        "test_user",
+        "test_project",
+        "test_scheme",
+        [
+            {"element_id": "1", "annotation": "b", "comment": "changed"},
+            {"element_id": "2", "annotation": "a", "comment": ""},
+        ],
+    )
+    service.add_annotation("test", "test_user", "test_project", "3", "test_scheme", "c")
+
+    elements = service.get_scheme_elements("test_project", "test_scheme", ["train"])
+    labels = {e[0]: (e[1], e[4]) for e in elements}
+    assert labels == {"1": ("b", "changed"), "2": ("a", "")}
+    assert len(service.get_scheme_elements("test_project", "test_scheme", ["test"])) == 1
+
+    with dataset.begin() as session:
+        assert len(session.scalars(select(Annotations)).all()) == 4
+        assert len(session.scalars(select(CurrentAnnotations)).all()) == 3
+
+    service.delete_project("test_project")
+    with dataset.begin() as session:
+        assert len(session.scalars(select(CurrentAnnotations)).all()) == 0
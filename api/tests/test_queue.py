@@ -0,0 +1,178 @@
+import datetime
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import activetigger.queue
+from activetigger.db.jobs import JobsService
+from activetigger.db.models import Base
+from activetigger.queue import Progress, Queue, get_owner, is_owner_alive
+
+
+def wait(event, unique_id, duration=0.0, **kwargs):
+    time.sleep(duration)
+    return unique_id
+
+
+def report(event, unique_id, progress):
+    for i in range(1, 101):
+        progress.update(i)
+    return unique_id
+
+
+def fail(event, unique_id, **kwargs):
+    raise ValueError("failed")
+
+
+@pytest.fixture
+def queue():
+    q = Queue(nb_workers=1, interactive_workers=1, capacity={"ram": 8, "gpu": 0})
+    yield q
+    q.close()
+
+
+def test_queue_scheduling(queue):
+    # a long job takes the only batch worker
+    training = queue.add("training", "project_a", wait, {"duration": 1}, user="a")
+    waiting = [
+        queue.add("training", "project_a", wait, {}, user="a"),
+        queue.add("feature", "project_b", wait, {}, user="b"),
+    ]
+    assert queue.state()[training]["state"] == "running"
+    assert all(queue.state()[i]["state"] == "pending" for i in waiting)
+
+    # interactive jobs use the reserved worker
+    simplemodel = queue.add("simplemodel", "project_b", wait, {}, user="b")
+    assert queue.current[simplemodel]["future"].result(timeout=5) == simplemodel
+    assert queue.state()[training]["state"] == "running"
+
+    # the feature goes before the training submitted earlier
+    queue.current[waiting[0]]["future"].result(timeout=5)
+    finished = queue.get_completed("project_b")
+    assert finished == [simplemodel, waiting[1]]
+    assert queue.get_completed("project_a") == [training, waiting[0]]
+
+
+def test_queue_kill_pending(queue):
+    queue.add("training", "project", wait, {"duration": 0.5}, user="a")
+    pending = queue.add("training", "project", wait, {}, user="a")
+    queue.kill(pending)
+    assert pending not in queue.current
+    assert queue.pending == []
+
+
+def test_queue_state_deleted(queue, monkeypatch):
+    unique_id = queue.add("feature", "project", wait, {}, user="a")
+    future = queue.current[unique_id]["future"]
+    future.result(timeout=5)
+
+    # the job is deleted by another thread while the state is read
+    def done():
+        queue.current.pop(unique_id, None)
+        return True
+
+    monkeypatch.setattr(future, "done", done)
+    assert queue.state()[unique_id]["state"] == "done"
+
+
+def test_queue_resources(monkeypatch):
+    queue = Queue(nb_workers=2, interactive_workers=0, capacity={"ram": 8, "gpu": 0})
+    monkeypatch.setattr(queue, "get_available_resources", lambda: {"ram": 8, "gpu": 0})
+    try:
+        # a job alone is admitted whatever its estimate
+        large = queue.add("training", "project", wait, {"duration": 1}, resources={"ram": 10})
+        small = queue.add("feature", "project", wait, {}, resources={"ram": 1})
+        state = queue.state()
+        assert state[large]["state"] == "running"
+        assert state[small]["state"] == "pending"
+        assert state[small]["resources"] == {"ram": 1}
+
+        # admitted once the memory is released
+        assert queue.current[small]["future"].result(timeout=5) == small
+    finally:
+        queue.close()
+
+
+def test_queue_jobs(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path.joinpath('test.db')}")
+    Base.metadata.create_all(engine)
+    jobs_service = JobsService(sessionmaker(bind=engine))
+    queue = Queue(
+        nb_workers=1,
+        interactive_workers=0,
+        capacity={"ram": 8, "gpu": 0},
+        jobs_service=jobs_service,
+    )
+    try:
+        done = queue.add("feature", "project", wait, {"duration": 0.5}, user="a")
+        failed = queue.add("feature", "project", fail, {}, user="a")
+        killed = queue.add("training", "project", wait, {}, user="a", result_path=tmp_path)
+        queue.kill(killed)
+        with pytest.raises(ValueError):
+            queue.current[failed]["future"].result(timeout=5)
+    finally:
+        queue.close()
+
+    jobs = {job.id: job for job in jobs_service.get_jobs(project_slug="project")}
+    assert jobs[done].status == "done"
+    assert jobs[done].params == {"duration": 0.5}
+    assert jobs[done].time_started is not None and jobs[done].time_ended is not None
+    assert jobs[failed].status == "failed"
+    assert "failed" in jobs[failed].error
+    assert jobs[killed].status == "killed"
+    assert jobs[killed].result_path == str(tmp_path)
+    assert jobs[done].owner == queue.owner
+    assert jobs_service.get_jobs(status=["pending", "running"]) == []
+
+
+def test_jobs_owner():
+    owner = get_owner()
+    assert is_owner_alive(owner)
+    # previous process with the same id, process gone, other host
+    host, pid, _ = owner.rsplit(":", 2)
+    assert not is_owner_alive(f"{host}:{pid}:0.0")
+    assert not is_owner_alive(f"{host}:999999999:0.0")
+    assert is_owner_alive(f"other-{host}:{pid}:0.0")
+    assert not is_owner_alive(None)
+
+
+def test_progress():
+    channel = {}
+    progress = Progress(channel, "job", interval=60000)
+    progress.update(10)
+    progress.update(20)
+    assert channel == {"job": 10}
+    # the end is always reported
+    progress.update(100)
+    assert channel == {"job": 100}
+
+
+def test_queue_progress(queue):
+    unique_id = queue.add("prediction", "project", report, {})
+    queue.current[unique_id]["future"].result(timeout=5)
+    assert queue.get_progress(unique_id) == 100
+    queue.delete(unique_id)
+    assert queue.get_progress(unique_id) is None
+
+
+def test_queue_reservation(monkeypatch):
+    queue = Queue(nb_workers=2, interactive_workers=0, capacity={"ram": 8, "gpu": 0})
+    monkeypatch.setattr(queue, "get_available_resources", lambda: {"ram": 8, "gpu": 0})
+    monkeypatch.setattr(activetigger.queue, "RESERVATION_DELAY", datetime.timedelta(0))
+    try:
+        running = queue.add("training", "project", wait, {"duration": 1}, resources={"ram": 4})
+        large = queue.add("training", "project", wait, {"duration": 0.5}, resources={"ram": 6})
+        # the small job would fit but the large one waits for the memory first
+        small = queue.add("feature", "project", wait, {}, resources={"ram": 2})
+        state = queue.state()
+        assert state[running]["state"] == "running"
+        assert state[large]["state"] == "pending"
+        assert state[small]["state"] == "pending"
+
+        # then the small job runs beside the large one
+        assert queue.current[large]["future"].result(timeout=5) == large
+        assert queue.get_completed("project") == [running, small, large]
+    finally:
+        queue.close()
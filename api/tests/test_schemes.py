@@ -0,0 +1,94 @@
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+
+from activetigger.schemes import SchemeState, Schemes
+
+
+def test_scheme_state_update():
+    now = datetime.datetime.now()
+    state = SchemeState(
+        pd.Index(["1", "2", "3"]),
+        [["2", "a", "test_user", now, ""]],
+    )
+    assert list(state.labels().index) == ["1", "2", "3"]
+    assert len(state.annotated()) == 1
+
+    state.update("3", "b", "test_user", now + datetime.timedelta(seconds=1), "new label")
+    state.update("2", None, "test_user", now + datetime.timedelta(seconds=2), "")
+
+    annotated = state.annotated()
+    assert list(annotated.index) == ["2", "3"]
+    assert pd.isna(annotated.loc["2", "labels"])
+    assert annotated.loc["3", "labels"] == "b"
+    assert list(state.labels().cat.categories) == ["a", "b"]
+
+
+def test_scheme_state_timezones():
+    # timestamps of PostgreSQL (aware) and of the annotations (local time)
+    now = datetime.datetime.now().astimezone()
+    state = SchemeState(
+        pd.Index(["1", "2"]),
+        [["1", "a", "test_user", now.astimezone(datetime.timezone.utc), ""]],
+    )
+    state.update("2", "b", "test_user", now + datetime.timedelta(seconds=1), "")
+    state.update("3", "c", "test_user", datetime.datetime.now() + datetime.timedelta(seconds=2), "")
+    annotated = state.annotated()
+    assert str(annotated["timestamp"].dt.tz) == "UTC"
+    assert list(annotated.index) == ["3", "2", "1"]
+
+
+def test_scheme_state_merge():
+    now = datetime.datetime.now().astimezone()
+    state = SchemeState(pd.Index(["1", "2"]), [["1", "a", "test_user", now, ""]])
+    state.update("2", "b", "test_user", now + datetime.timedelta(seconds=2), "")
+    checked = pd.Timestamp.now(tz="UTC")
+    # annotations read from the db, written by other processes
+    state.merge(
+        [
+            ["1", "b", "other_user", now + datetime.timedelta(seconds=1), ""],
+            ["2", "a", "other_user", now + datetime.timedelta(seconds=1), ""],
+        ],
+        checked,
+    )
+    assert state.labels().tolist() == ["b", "b"]
+    assert state.checked == checked
+
+
+def test_scheme_state_empty():
+    # no annotation yet
+    state = SchemeState(pd.Index(["1", "2"]), [])
+    state.update("1", "a", "test_user", datetime.datetime.now(), "")
+    assert state.labels()["1"] == "a"
+    assert pd.isna(state.labels()["2"])
+
+
+def test_schemes_states_threads():
+    schemes = Schemes.__new__(Schemes)
+    schemes.project_slug = "project"
+    schemes.projects_service = SimpleNamespace(get_scheme_elements=lambda *args, **kwargs: [])
+    schemes.content = pd.DataFrame(index=pd.Index(["1", "2"]))
+    schemes.test = None
+    schemes.states = {}
+    schemes.states_lock = threading.Lock()
+    now = datetime.datetime.now()
+
+    def read(i):
+        # new states inserted while the annotations update the others
+        return [schemes.get_state("default", [f"kind_{i}_{j}", "train"]) for j in range(10)]
+
+    def write(i):
+        for _ in range(10):
+            schemes.update_states("1", "a", "default", "user", "train", "", now)
+
+    with ThreadPoolExecutor(8) as executor:
+        reads = [executor.submit(read, i) for i in range(4)]
+        writes = [executor.submit(write, i) for i in range(4)]
+        same = [executor.submit(schemes.get_state, "default", ["train"]) for _ in range(8)]
+        for future in reads + writes:
+            future.result()
+    # a single state by key
+    assert len({id(future.result()) for future in same}) == 1
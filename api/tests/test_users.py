@@ -0,0 +1,85 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from activetigger.db.models import Base
+from activetigger.db.projects import ProjectsService
+from activetigger.db.users import UsersService
+from activetigger.users import TOKEN_CACHE_TTL, Users
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)
+    users = Users(
+        SimpleNamespace(
+            users_service=UsersService(session), projects_service=ProjectsService(session)
+        )
+    )
+    users.add_user("user", "password", created_by="root")
+    users.db_manager.projects_service.add_project("project", {}, "user")
+    return users
+
+
+def test_tokens_cache(users, monkeypatch):
+    user = users.get_user("user")
+    users.cache_token_user("token", user, time.time() + 3600)
+    assert users.get_token_user("token") is user
+    assert users.get_token_user("other") is None
+
+    # checked again in the database after the TTL or the expiration of the token
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + TOKEN_CACHE_TTL + 1)
+    assert users.get_token_user("token") is None
+    users.cache_token_user("expired", user, now)
+    assert users.get_token_user("expired") is None
+    assert users.tokens == {}
+
+
+def test_tokens_cache_pruned(users, monkeypatch):
+    user = users.get_user("user")
+    now = time.time()
+    for i in range(10):
+        users.cache_token_user(f"token{i}", user, now + 1)
+    # expired tokens never looked up again are removed
+    monkeypatch.setattr(time, "time", lambda: now + TOKEN_CACHE_TTL + 1)
+    users.cache_token_user("new", user, now + 3600)
+    assert list(users.tokens) == ["new"]
+
+    monkeypatch.setattr("activetigger.users.TOKEN_CACHE_SIZE", 2)
+    users.cache_token_user("new2", user, now + 3600)
+    users.cache_token_user("new3", user, now + 3600)
+    assert list(users.tokens) == ["new2", "new3"]
+
+
+def test_tokens_invalidated(users):
+    user = users.get_user("user")
+    expiration = time.time() + 3600
+
+    users.cache_token_user("token", user, expiration)
+    users.invalidate_token("token")
+    assert users.get_token_user("token") is None
+
+    # password changed
+    users.cache_token_user("token", user, expiration)
+    users.change_password("user", "password", "new_password", "new_password")
+    assert users.get_token_user("token") is None
+
+    # rights changed
+    users.cache_token_user("token", user, expiration)
+    users.set_auth("user", "project", "manager")
+    assert users.get_token_user("token") is None
+    users.cache_token_user("token", user, expiration)
+    users.delete_auth("user", "project")
+    assert users.get_token_user("token") is None
+
+    # user deleted
+    users.cache_token_user("token", user, expiration)
+    users.delete_user("user", "root")
+    assert users.get_token_user("token") is None
@@ -0,0 +1,30 @@
+from activetigger.worker import ModelsCache
+
+
+def test_models_cache():
+    cache = ModelsCache(max_size=2)
+    loaded = []
+
+    def loader(name):
+        def load():
+            loaded.append(name)
+            return name
+
+        return load
+
+    def sizer(_):
+        return 1
+
+    assert cache.get(("model", "a"), loader("a"), sizer) == "a"
+    assert cache.get(("model", "b"), loader("b"), sizer) == "b"
+    assert cache.get(("model", "a"), loader("a"), sizer) == "a"
+    assert loaded == ["a", "b"]
+
+    # b is the least recently used
+    cache.get(("model", "c"), loader("c"), sizer)
+    assert list(cache.models) == [("model", "a"), ("model", "c")]
+    assert cache.size == 2
+
+    # too large to be kept
+    assert cache.get(("model", "d"), loader("d"), lambda _: 3) == "d"
+    assert ("model", "d") not in cache.models